@@ -6,16 +6,19 @@
 #     Copyright (c) 2021 Pablo Martínez Bernal
 # ==========================================================
 
+# Tiempo de arranque
+import time
+_import_start = time.perf_counter()
+
 # Información
 from datos import info
 
 # Debug
 import logging
+import logs
 
 # Alexa Skill Kit SDK
 import ask_sdk_core.utils as ask_utils
-from ask_sdk_core.skill_builder import SkillBuilder
-from flask_ask_sdk.skill_adapter import SkillAdapter
 from ask_sdk_core.dispatch_components import AbstractRequestHandler, AbstractExceptionHandler
 from ask_sdk_core.handler_input import HandlerInput
 from ask_sdk_model import Response
@@ -30,85 +33,255 @@ import json
 from pymongo import MongoClient
 
 # Type hinting
-from typing import Dict
+from typing import Any, Dict, Optional
 from collections.abc import Callable
 
 # Decoradores
 import functools
 
+# Recarga de datos
+import signal
+import threading
+
+# Trabajo en paralelo dentro de una petición
+from concurrent.futures import ThreadPoolExecutor, Future
+import contextvars
+
+# Cachés
+from cache import SQLiteTokenStore, TokenCache, TTLCache, VersionedCache
+
 # Parecido string
-from difflib import get_close_matches
+import matching
+import candidates
+
+# Datos académicos en memoria
+from snapshots import SnapshotStore
+from watcher import ChangeWatcher
+
+# Estado del proceso
+import os
+
+# Login with Amazon
+from lwa import LWAClient
+
+# Elegir handler
+import routing
 
-# Peticiones HTTP
-from requests import get
+# Respuestas generadas al arrancar
+import prerender
+
+# URLs y objetos que se crean al usarlos
+from utils import Lazy, parse_url, s3_url
+
+# Tiempos por petición
+import metrics
 
 
 # ==========================================================
 #      CONFIGURACIÓN
 # ==========================================================
-logging.basicConfig(
-    level=logging.DEBUG,
-    filename="app.log",
-    format="%(asctime)s -- %(message)s",
-    datefmt="%d/%b/%y %H:%M:%S", 
-    filemode="w"
-)
+# los registros se escriben en disco desde otro hilo, ver logs.py
+# > después de un fork hay que volver a llamarla (el hilo no pasa al hijo)
+# > con varios procesos, "{pid}" en log_file da un archivo a cada uno: rotar
+# el mismo archivo desde varios procesos pierde registros
+def setup_logging() -> None:
+    logs.setup(
+        path=getattr(info, "log_file", "app.log").format(pid=os.getpid()),
+        level=getattr(info, "log_level", "INFO"),  # DEBUG para desarrollo
+        json_format=getattr(info, "log_json", True),
+        max_bytes=getattr(info, "log_max_bytes", 10 * 1024 * 1024),
+        backups=getattr(info, "log_backups", 5),
+        when=getattr(info, "log_rotate_when", None),  # p.ej. "midnight" para rotar por días
+        levels=getattr(info, "log_levels", None),  # {"logger": "NIVEL"}
+        use_queue=getattr(info, "log_queue", True),
+    )
+
+
+setup_logging()
 
 app = Flask(__name__)
 
-database = MongoClient(info.database_ip)[info.database_name]
+# los clientes se crean al usarlos por primera vez (o en `warm_up`), no al importar
+# > cada consulta queda apuntada en las métricas de la petición que la hace
+database = Lazy(
+    lambda: MongoClient(info.database_ip, event_listeners=[metrics.MongoListener()])[info.database_name],
+    close=lambda database: database.client.close(),
+)
+
+# cliente de LWA, se puede apuntar a un servidor local para pruebas
+lwa_client = Lazy(
+    lambda: LWAClient(
+        base_url=getattr(info, "lwa_url", "https://api.amazon.com"),
+        timeout=getattr(info, "lwa_timeout", (1.0, 2.0)),  # (conexión, lectura)
+        retries=getattr(info, "lwa_retries", 1),
+    ),
+    close=lambda client: client.close(),
+)
+
+# caché de tokens de LWA, si se configura una ruta se comparte entre procesos
+token_cache = TokenCache(
+    maxsize=getattr(info, "token_cache_size", 10000),
+    ttl=getattr(info, "token_ttl", 3600),  # los tokens de LWA duran una hora
+    store=SQLiteTokenStore(info.token_cache_path) if getattr(info, "token_cache_path", None) else None,
+)
+
+# caché user_id:datos del usuario, solo cambian al volver a registrarse
+# > la caducidad acota cuánto tarda en verse un registro hecho en otro proceso
+profile_cache = TTLCache(
+    maxsize=getattr(info, "profile_cache_size", 10000),
+    ttl=getattr(info, "profile_ttl", 300),
+)
+
+# userId de Alexa -> última titulación que conocemos del usuario
+# > el userId no cambia al renovar el token: mientras LWA resuelve el token nuevo
+# se puede ir buscando el nombre del slot en su titulación (ver CustomHandler.prefetch)
+last_studies = TTLCache(
+    maxsize=getattr(info, "last_studies_size", 10000),
+    ttl=getattr(info, "last_studies_ttl", 86400),
+)
+
+# hilos para resolver la identidad del usuario (LWA + usuarios) mientras
+# el handler adelanta el trabajo que no depende de quién es
+prefetch_pool = ThreadPoolExecutor(
+    max_workers=getattr(info, "prefetch_threads", 8),
+    thread_name_prefix="prefetch",
+)
+
+# tiempos de arranque del proceso, se ven en /estado
+startup: Dict[str, Any] = {"importar_ms": None, "preparar_ms": None, "pasos": {}}
+
+# peticiones que tarden más de esto (en milisegundos) se escriben en el log con sus tiempos
+slow_request = getattr(info, "slow_request_ms", 1000) / 1000
+
+# datos académicos por titulación (asignaturas, profesores, fechas, contacto)
+snapshots = SnapshotStore(database, version_field=getattr(info, "version_field", "actualizado"))
+
+# con catálogos muy grandes, Mongo nos da unos pocos candidatos en vez de tener
+# todos los nombres en memoria (ver candidates.py), si no se pueden crear los
+# índices se sigue buscando en memoria
+# > los índices se comprueban en `warm_up` o en la primera búsqueda
+server_search_collections = getattr(info, "server_search_collections", ("asignaturas",))
+server_search = Lazy(
+    lambda: bool(getattr(info, "server_search", False) and candidates.ensure_indexes(database, server_search_collections))
+)
+
+# respuestas que solo dependen de la titulación y el slot (fechas, contacto), se
+# guardan ya montadas hasta que cambian los datos de la titulación (ver snapshots.version_of)
+response_cache = VersionedCache(maxsize=getattr(info, "response_cache_size", 4096))
+
+# mantiene al día los snapshots y los índices de nombres cuando cambia la base de datos
+watcher = ChangeWatcher(
+    database,
+    snapshots,
+    on_change=matching.invalidate,
+    on_document=lambda collection, key, document: refresh_tokens(collection, document),
+    poll_interval=getattr(info, "poll_interval", 30),
+)
 
 
 # ==========================================================
 #      FUNCIONES
 # ==========================================================
 
-def get_user_id(handler_input: HandlerInput, cache: Dict[str, str] = {}):
+def get_user_id(handler_input: HandlerInput) -> str:
     """
     En la caché guardaremos token:user_id para evitar hacer peticiones extra a LWA
-
-    Al tener como valor por defecto un diccionario vacío, la función se queda ligada
-    a la posicion de memoria donde está ese dict y conforme lo vayamos editando se 
-    guarda la información
+    > ver cache.TokenCache, tiene tamaño máximo, caducidad y es segura entre hilos
     """
 
     # token del usuario, nos llega en su petición
     token = handler_input.request_envelope.session.user.access_token
 
-    if token not in cache:
-        # si no tenemos el token en cache, consultamos LWA
-        user_id = get(f"https://api.amazon.com/user/profile?access_token={token}").json()["user_id"]
+    # si no tenemos el token en caché se consulta LWA, una sola vez aunque
+    # lleguen varias peticiones a la vez con ese token
+    return token_cache.get(token, lwa_client.user_id)
+
+
+def get_profile(user_id: str):
+    """
+    Datos del usuario (None si no está registrado)
+    > solo vamos a la base de datos si no lo tenemos en caché
+    > no guardamos los no registrados, así se ve su registro aunque lo haga otro proceso
+    """
+    data = profile_cache.get(user_id)
+    if data is None:
+        data = database["usuarios"].find_one({"_id": user_id}, {"_id": False})
+        if data is not None:
+            profile_cache.set(user_id, data)
+    return data
+
+
+def submit(func: Callable, *args) -> Future:
+    """
+    Ejecuta la función en `prefetch_pool`
+    > con el contexto de la petición, para que sus tiempos cuenten en ella (ver metrics.py)
+    """
+    return prefetch_pool.submit(contextvars.copy_context().run, func, *args)
+
+
+def resolve_user(handler_input: HandlerInput):
+    """Datos del usuario que hace la petición (None si no está registrado)"""
+    return get_profile(get_user_id(handler_input))
 
-        # comprobamos si teníamos el usuario en la caché con otro token y borramos esa entrada
-        for key, value in cache.items():
-            if value == user_id:
-                cache.pop(key)
-                break
 
-        # guardamos token:user_id
-        cache[token] = user_id
+def cached_user(handler_input: HandlerInput):
+    """
+    Datos del usuario si los tenemos en caché (token y perfil), sin hacer I/O
+    > solo la memoria del proceso: el almacén compartido de tokens (SQLite) lo
+    lee `resolve_user` en el pool, a la vez que `prefetch`
+    """
+    user_id = token_cache.cached(handler_input.request_envelope.session.user.access_token)
+    return None if user_id is None else profile_cache.get(user_id)
 
-    # devolvemos id del usuario
-    return cache[token] 
+
+def remember_studies(handler_input: HandlerInput, data) -> None:
+    """Apunta la titulación del usuario para su próxima petición (ver `last_studies`)"""
+    if data is not None and data.get("estudios") is not None:
+        last_studies.set(handler_input.request_envelope.session.user.user_id, data["estudios"])
 
 
 def get_data(func: Callable, *args, **kwargs) -> Callable:
-    """Obtener la info del usuario a partir del handler_input"""
+    """
+    Obtener la info del usuario a partir del handler_input
+
+    > Si no la tenemos en caché, la pedimos en otro hilo y mientras tanto el handler
+    hace lo que no depende del usuario (su método `prefetch`), así la petición tarda
+    lo que el más lento de los dos en vez de la suma
+    > Si la tenemos no hay ningún hilo de por medio, `prefetch` se hace aquí mismo
+    """
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs) -> Response:
         # args[0] es self porque las funciones que estamos decorando son métodos
         # args[1] es handler_input de donde sacamos la id del usuario
-        # > obtenemos el id a partir del JSON entrante
-        user_id = get_user_id(args[1])
+        handler, handler_input = args[0], args[1]
+        prefetch = getattr(handler, "prefetch", lambda handler_input: {})
+
+        data = cached_user(handler_input)
+        if data is not None:
+            remember_studies(handler_input, data)
+            prefetched = prefetch(handler_input)
+        else:
+            # > obtenemos el id a partir del JSON entrante, en paralelo
+            future = submit(resolve_user, handler_input)
+            prefetched = prefetch(handler_input)
+            data = future.result()
+            remember_studies(handler_input, data)
 
         # a la función decorada le pasamos los datos (un dict) como parámetro
         # será None si el usuario no está en el sistema
+        # > pasamos una copia para que el handler no pueda modificar la caché
+        # > lo que haya adelantado el handler va en `prefetched`
         return func(
             *args,
-            data=database["usuarios"].find_one({"_id": user_id}, {"_id": False}),
+            data=None if data is None else dict(data),
+            prefetched=prefetched,
             **kwargs,
         )
+
+    # para saber sin ejecutarlo que el handler necesita al usuario (ver asgi.py)
+    # > functools.wraps lo copia a los decoradores que van por encima
+    wrapper.uses_data = True
     return wrapper
 
 
@@ -141,11 +314,12 @@ def check_data(func: Callable, *args, **kwargs) -> Callable:
     return wrapper
 
 
-def find(input_str: str, filtering = None, field: str = "nombre", collection: str = "asignaturas") -> str:
+def name_index(filtering = None, field: str = "nombre", collection: str = "asignaturas"):
     """
-    Devuelve la cadena más parecida al input encontrada en el campo especificado
-    de la colección dada
+    Índice de nombres del campo especificado de la colección dada
     > se pueden aplicar filtros a la query
+    > los valores se leen una sola vez y se guardan en un índice en memoria (ver matching.py)
+    > o, con `server_search`, se le piden a Mongo solo los candidatos (ver candidates.py)
     """
 
     # el valor por defecto de una función no puede ser una estructura de datos
@@ -155,50 +329,224 @@ def find(input_str: str, filtering = None, field: str = "nombre", collection: st
     if filtering is None:
         filtering = {}
 
-    return get_close_matches(
-        input_str,
-        # lista con todos los valores
-        list((element[field] for element in database[collection].find(filtering, {field: True}))),
-        n=1,  # solo queremos un valor
-        cutoff=0,  # no buscamos una similaridad mínima, para garantizar encontrar resultado
-    )[0]
+    # comparar sin tildes, palabras vacías ni numerales (ver matching.tokens)
+    normalize = getattr(info, "normalize_names", True)
+
+    factory = None
+    if server_search.get() and collection in server_search_collections and field == "nombre":
+        factory = lambda fallback: candidates.CandidateIndex(
+            database, collection, field, filtering, fallback, normalize=normalize,
+        )
+
+    return matching.get_index(
+        collection,
+        field,
+        filtering,
+        # lista con todos los valores, solo se lee al crear o refrescar el índice
+        lambda: [element[field] for element in database[collection].find(filtering, {field: True})],
+        normalize=normalize,
+        factory=factory,
+    )
+
+
+@metrics.timed("find")
+def find(input_str: str, filtering = None, field: str = "nombre", collection: str = "asignaturas") -> str:
+    """
+    Devuelve la cadena más parecida al input encontrada en el campo especificado
+    de la colección dada (ver `name_index`)
+    """
+
+    # sin normalizar, mismo resultado que get_close_matches con n=1 y cutoff=0
+    return name_index(filtering, field, collection).best_match(input_str)
+
+
+def refresh_tokens(collection: str, document: Optional[dict] = None) -> None:
+    """
+    Con `server_search`, palabras del documento que ha cambiado (ver candidates.refresh_tokens)
+    > sin documento (tras una recarga) las de toda la colección que lo necesiten
+    > se llama desde el hilo del watcher o el de la recarga, nunca en una petición
+    """
+    if collection not in server_search_collections or not server_search.get():
+        return
+    if document is None:
+        candidates.fill_tokens(database[collection])
+    else:
+        candidates.refresh_tokens(database[collection], document)
+
 
+def refresh_data() -> None:
+    """Vuelve a leer los datos académicos y los índices de nombres"""
+    snapshots.load()
+    for collection in server_search_collections:
+        refresh_tokens(collection)
+    matching.refresh()
 
-def parse_url(url: str) -> str: 
-    """Elimina algunos caracteres de la URL para evitar errores"""
-    return url.split('://')[1].replace("/", "").replace(".", "")
 
+def install_refresh_signal() -> None:
+    """
+    Al recibir SIGHUP recargamos los datos sin reiniciar el servidor
+    > lo hacemos en otro hilo para no bloquear la petición que se esté atendiendo
+    > en Windows no existe SIGHUP
+    """
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(
+            signal.SIGHUP,
+            lambda signum, frame: threading.Thread(target=refresh_data, daemon=True).start(),
+        )
+
+
+def preload_indexes() -> None:
+    """
+    Crea los índices de nombres que usan los handlers (escuelas, estudios y
+    asignaturas de cada titulación)
+    > con `server_search` las asignaturas se buscan en Mongo, no hace falta cargarlas
+    """
+    name_index(collection="secretarias", field="_id").refresh()
+    name_index(collection="estudios").refresh()
+
+    if not (server_search.get() and "asignaturas" in server_search_collections):
+        for studying in database["estudios"].distinct("_id"):
+            name_index({"_id.id_estudios": studying}).refresh()
+
+
+def warm_up(data: bool = True) -> Dict[str, float]:
+    """
+    Prepara el proceso antes de atender peticiones, así la primera no paga las
+    conexiones ni la carga de datos
+    > abre las conexiones con Mongo y LWA, carga los snapshots, comprueba los
+    índices de búsqueda y crea los índices de nombres
+    > con `data=False` solo abre las conexiones, para los workers que ya han
+    heredado los datos del proceso padre (ver gunicorn.conf.py)
+    > si algún paso falla se sigue con el resto, se hará en la primera petición
+    > devuelve lo que ha tardado cada paso, en milisegundos
+    """
+
+    times = {}
+
+    def step(name: str, func: Callable) -> None:
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception:
+            logging.warning(f"Error preparando {name}, se hará en la primera petición", exc_info=True)
+        times[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    step("mongo", lambda: database.client.admin.command("ping"))
+    step("lwa", lwa_client.warm_up)
+    if data:
+        step("snapshots", snapshots.load)
+        step("busqueda", server_search.get)
+        step("indices", preload_indexes)
 
-def s3_url(url: str) -> str:
-    """URL de S3 donde se encuentra el archivo"""
-    return f"https://imagenes-tfg.s3.eu-west-3.amazonaws.com/{url}.png"
+    # en un worker se suman a los pasos que ya hizo el proceso padre
+    startup["pasos"] = {**startup["pasos"], **times}
+    startup["preparar_ms"] = round(sum(startup["pasos"].values()), 1)
+    logging.info(f"Proceso preparado en {startup['preparar_ms']:.0f} ms {times}")
+    return times
+
+
+def reset_connections(close: bool = True) -> None:
+    """
+    Descarta los clientes de Mongo y LWA (y las conexiones a SQLite de la caché
+    de tokens), se vuelven a crear al usarlos
+    > en un worker recién creado con fork no se cierran, son del proceso padre
+    """
+    database.reset(close)
+    lwa_client.reset(close)
+    if token_cache.store is not None:
+        token_cache.store.reset(close)
+
+
+def start_process() -> None:
+    """
+    Lo que no pasa de un proceso a otro al hacer fork: la señal de recarga y el
+    hilo que vigila los cambios en la base de datos
+    """
+    install_refresh_signal()
+    if getattr(info, "watch_changes", True):
+        watcher.start()
 
 
 # ==========================================================
 #      HANDLERS
 # ==========================================================
 
-class BaseHandler(AbstractRequestHandler):
-    """Objeto base para los handlers de Amazon, evitamos repetir can_handle"""
+class RoutedHandler(AbstractRequestHandler):
+    """
+    Handler con las rutas que atiende (tipos de petición o nombres de intent)
+    > el SkillBuilder las usa para montar su tabla (ver routing.py), can_handle
+    solo hace falta si se pregunta directamente al handler
+    """
 
-    amazon = False
+    routes = ()
+    # la respuesta solo depende de la ruta, se genera una vez al arrancar (ver prerender.py)
+    static = False
 
     def can_handle(self, handler_input: HandlerInput) -> bool:
-        return ask_utils.is_request_type(
-            "AMAZON." * self.amazon + self.__class__.__name__.split("Handler")[0]
-        )(handler_input)
+        return routing.route(handler_input) in self.routes
+
 
+class BaseHandler(RoutedHandler):
+    """
+    Objeto base para los handlers de Amazon, evitamos repetir can_handle
+    > la ruta sale del nombre de la clase: "LaunchRequest", o "AMAZON.HelpIntent" con `amazon`
+    """
 
-class CustomHandler(AbstractRequestHandler):
-    """Objeto base para nuestros intents"""
+    amazon = False
 
-    def can_handle(self, handler_input: HandlerInput) -> bool:
-        return ask_utils.is_intent_name(
-            self.__class__.__name__.split("Handler")[0]
-        )(handler_input)
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.routes = ("AMAZON." * cls.amazon + cls.__name__.split("Handler")[0],)
+
+
+class CustomHandler(RoutedHandler):
+    """
+    Objeto base para nuestros intents
+    > la ruta es el nombre del intent, que sale del nombre de la clase
+    """
+
+    # slot que lee el handler, si tiene
+    slot = None
+    # el slot es el nombre de una asignatura de la titulación del usuario
+    subject_slot = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.routes = (cls.__name__.split("Handler")[0],)
+
+    def prefetch(self, handler_input: HandlerInput) -> dict:
+        """
+        Trabajo que no depende del usuario, se hace mientras resolvemos su identidad
+        > leer el slot y tener cargados los datos académicos
+        > con `subject_slot`, buscar la asignatura en la última titulación que
+        conocemos del usuario (ver `subject`): casi siempre es la misma
+        """
+        snapshots.ensure_loaded()
+        if self.slot is None:
+            return {}
+
+        prefetched = {"slot": ask_utils.request_util.get_slot(handler_input, self.slot).value}
+        studying = last_studies.get(handler_input.request_envelope.session.user.user_id)
+        if self.subject_slot and studying is not None and prefetched["slot"] is not None:
+            try:
+                prefetched["asignatura"] = (studying, find(prefetched["slot"], filtering={"_id.id_estudios": studying}))
+            except Exception:
+                # se repite en `subject` con la titulación buena y, si falla, el error sale de ahí
+                logging.debug("No se pudo adelantar la búsqueda de la asignatura", exc_info=True)
+        return prefetched
+
+    @staticmethod
+    def subject(studying: str, prefetched: dict) -> str:
+        """Asignatura del slot, la de `prefetch` si se buscó en la misma titulación"""
+        found = prefetched.get("asignatura")
+        if found is not None and found[0] == studying:
+            return found[1]
+        return find(prefetched["slot"], filtering={"_id.id_estudios": studying})
 
 
 class LaunchRequestHandler(BaseHandler):
+    static = True
+
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         text = "Tengo información de: " + \
         "guías docentes, " + \
@@ -218,13 +566,15 @@ class LaunchRequestHandler(BaseHandler):
         )
 
 
-class SignUpIntentHandler(AbstractRequestHandler):
+class SignUpIntentHandler(RoutedHandler):
+    routes = ("SignUpIntent",)
+    # con este atributo de sesión la conversación es del registro, sea cual sea el intent
+    session_key = "estado"
+
     def can_handle(self, handler_input: HandlerInput) -> bool:
-        # comprobamos si el nombre del intent coincide o si hay atributos de sesion
-        # > estos atributos solo los usamos para el estado de conversación del intent
         return (
-            ask_utils.is_intent_name("SignUpIntent")(handler_input) or
-            (handler_input.attributes_manager.session_attributes != {})
+            super().can_handle(handler_input) or
+            self.session_key in handler_input.attributes_manager.session_attributes
         )
 
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
@@ -272,17 +622,19 @@ class SignUpIntentHandler(AbstractRequestHandler):
 
         # para acabar el registro, borramos el estado y guardamos los estudios del usuario
         handler_input.attributes_manager.session_attributes.pop("estado")
+        # mientras buscamos la titulación, obtenemos el id del usuario
+        user_id = submit(get_user_id, handler_input)
         # leer y parsear
         slot_value = ask_utils.request_util.get_slot(handler_input, "TextSlot").value
         study_name = find(slot_value, collection="estudios")
         study = database["estudios"].find_one({"nombre": study_name},{})["_id"]
         # guardamos la informacion del usuario
-        user_id = get_user_id(handler_input)
-        try: 
-            database["usuarios"].insert_one({"_id": user_id, "estudios": study})
-        # si insertar la información da error es porque el usuario ya está en el sistema, actualizamos
-        except Exception:
-            database["usuarios"].update_one({"_id": user_id}, {"$set": {"estudios": study}})
+        user_id = user_id.result()
+        # una sola operación tanto si es nuevo como si se vuelve a registrar
+        database["usuarios"].update_one({"_id": user_id}, {"$set": {"estudios": study}}, upsert=True)
+
+        # actualizamos también la caché, las siguientes peticiones ya no leen de la base de datos
+        profile_cache.set(user_id, {"estudios": study})
 
         text = f"Vale, he registrado que estudias {study_name}({study}), si en algún momento quieres editar \
         esta información, puedes repetir el proceso de registro"          
@@ -296,37 +648,44 @@ class SignUpIntentHandler(AbstractRequestHandler):
 
 
 class SubjectIntentHandler(CustomHandler):
+    slot = "SubjectSlot"
+    subject_slot = True
+
     @check_data  # para poder filtrar segun su titulación
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         # datos del usuario
         studying = kwargs.get("data")["estudios"]
         # datos del slot
-        slot_value = ask_utils.request_util.get_slot(handler_input, "SubjectSlot").value
-        subject = find(slot_value, filtering={"_id.id_estudios": studying})
+        subject = self.subject(studying, kwargs.get("prefetched"))
         # obtenemos enlace de la guia docente
-        url = database["asignaturas"].find_one({"nombre": subject}, {"_id": False})["guia_docente"]
+        url = snapshots.get(studying)["asignaturas"][subject]["guia_docente"]
 
         text = f"Aquí tienes la guía docente de {subject}, {url}"
         return (
             handler_input.response_builder
             .set_should_end_session(False)
             .speak(text)
-            .set_card(StandardCard("Guía docente", text, Image(s3_url(parse_url(url)))))
+            .set_card(StandardCard("Guía docente", text, Image(
+                small_image_url=s3_url(parse_url(url), "small"),
+                large_image_url=s3_url(parse_url(url), "large"),
+            )))
             .response
         )
 
 
 class TeacherIntentHandler(CustomHandler):
+    slot = "SubjectSlot"
+    subject_slot = True
+
     @check_data
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         # user
         studying = kwargs.get("data")["estudios"]
         # slot
-        slot_value = ask_utils.request_util.get_slot(handler_input, "SubjectSlot").value
-        subject = find(slot_value, filtering={"_id.id_estudios": studying})
+        subject = self.subject(studying, kwargs.get("prefetched"))
         # email y nombre del profesor
-        email = database["asignaturas"].find_one({"nombre": subject}, {"_id": False})["responsable"]
-        teacher = database["profesores"].find_one({"_id": email}, {"nombre": True})["nombre"]
+        info_subject = snapshots.get(studying)["asignaturas"][subject]
+        email, teacher = info_subject["responsable"], info_subject["profesor"]
 
         text = f"El profesor responsable de {subject} es {teacher}, aquí tienes su mail: {email}"
         return (
@@ -339,12 +698,14 @@ class TeacherIntentHandler(CustomHandler):
 
 
 class ScheduleIntentHandler(CustomHandler):
+    slot = "YearSlot"
+
     @check_data
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         # user
         studying = kwargs.get("data")["estudios"]
         # slot
-        year = ask_utils.request_util.get_slot(handler_input, "YearSlot").value
+        year = kwargs.get("prefetched")["slot"]
 
         text = f"Aquí tienes el horario de {year}º"
         image = Image(large_image_url=s3_url(f"{studying}-{year}"))
@@ -358,15 +719,26 @@ class ScheduleIntentHandler(CustomHandler):
 
 
 class DatesIntentHandler(CustomHandler):
+    slot = "DateSlot"
+
     @check_data
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         # user
         studying = kwargs.get("data")["estudios"]
         # slot
-        date = ask_utils.request_util.get_slot(handler_input, "DateSlot").value
-        logging.info(f"date slot type {type(date)}")
+        date = kwargs.get("prefetched")["slot"]
+
+        # la respuesta es la misma para toda la titulación, solo se monta la primera vez
+        return response_cache.get(
+            (self.routes[0], studying, date),
+            snapshots.version_of(studying),
+            lambda: self.respond(handler_input, studying, date),
+        )
+
+    def respond(self, handler_input: HandlerInput, studying: str, date: str) -> Response:
+        logging.debug(f"date slot type {type(date)}")
         # información
-        dates = database["fechas"].find_one({"_id": studying}, {date: True})[date]
+        dates = snapshots.get(studying)["fechas"][date]
 
         text = f"Los {date} son {dates}"
         return (
@@ -383,10 +755,19 @@ class ContactIntentHandler(CustomHandler):
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         # user
         studying = kwargs.get("data")["estudios"]
-        school = database["estudios"].find_one({"_id": studying}, {"escuela": True})["escuela"]
+
+        # sin slot, la respuesta solo depende de la titulación
+        return response_cache.get(
+            (self.routes[0], studying, None),
+            snapshots.version_of(studying),
+            lambda: self.respond(handler_input, studying),
+        )
+
+    def respond(self, handler_input: HandlerInput, studying: str) -> Response:
+        study = snapshots.get(studying)
+        school = study["escuela"]
         # creamos un generador con las formas de contactar
-        contact = (f"{k.capitalize()} ({v})" 
-        for k, v in dict(database["secretarias"].find_one({"_id": school}, {"_id": False})).items())
+        contact = (f"{k.capitalize()} ({v})" for k, v in study["contacto"].items())
 
         nl = "\n"
         text = f"Las formas de contactar con la secretaría de {school} son {nl.join(contact)}"
@@ -401,6 +782,7 @@ class ContactIntentHandler(CustomHandler):
 
 class HelpIntentHandler(BaseHandler):
     amazon = True
+    static = True
 
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         text = "Las opciones disponibles son: asignatura, profesor \
@@ -414,12 +796,9 @@ class HelpIntentHandler(BaseHandler):
         )
 
 
-class CancelOrStopIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input: HandlerInput) -> bool:
-        return (
-            ask_utils.is_intent_name("AMAZON.CancelIntent")(handler_input) or
-            ask_utils.is_intent_name("AMAZON.StopIntent")(handler_input)
-        )
+class CancelOrStopIntentHandler(RoutedHandler):
+    routes = ("AMAZON.CancelIntent", "AMAZON.StopIntent")
+    static = True
 
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         text = "Hasta luego"
@@ -434,6 +813,7 @@ class CancelOrStopIntentHandler(AbstractRequestHandler):
 
 class FallbackIntentHandler(BaseHandler):
     amazon = True
+    static = True
 
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         text = "Puedes decir 'Ayuda' para ver las opciones disponibles"
@@ -447,6 +827,8 @@ class FallbackIntentHandler(BaseHandler):
 
 
 class SessionEndedRequestHandler(BaseHandler):
+    static = True
+
     def handle(self, handler_input: HandlerInput, *args, **kwargs) -> Response:
         # Si se extiende la funcionalidad de la skill, aquí se debería añadir
         # limpieza de datos temporales  
@@ -497,31 +879,62 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
 #      SKILL ADAPTER
 # ==========================================================
 
-skill_builder = SkillBuilder()
+# elige el handler con una tabla montada al crear la skill (ver routing.py)
+skill_builder = routing.RoutingSkillBuilder()
+
+# metrics.instrument mide cada handler y apunta en la petición cuál la ha atendido
+request_handlers = [
+    SignUpIntentHandler(),
+    LaunchRequestHandler(),
+    SubjectIntentHandler(),
+    TeacherIntentHandler(),
+    ScheduleIntentHandler(),
+    DatesIntentHandler(),
+    ContactIntentHandler(),
+
+    HelpIntentHandler(),
+    CancelOrStopIntentHandler(),
+    FallbackIntentHandler(),
+    SessionEndedRequestHandler(),
+
+    # último para que no sobre-escriba
+    IntentReflectorHandler(),
+]
+for handler in request_handlers:
+    skill_builder.add_request_handler(metrics.instrument(handler))
+skill_builder.add_exception_handler(CatchAllExceptionHandler())
+
+# con gunicorn y preload_app se hace en cada worker (ver gunicorn.conf.py)
+prefork = getattr(info, "prefork", False)
+if not prefork:
+    start_process()
 
-skill_builder.add_request_handler(SignUpIntentHandler())
-skill_builder.add_request_handler(LaunchRequestHandler())
-skill_builder.add_request_handler(SubjectIntentHandler())
-skill_builder.add_request_handler(TeacherIntentHandler())
-skill_builder.add_request_handler(ScheduleIntentHandler())
-skill_builder.add_request_handler(DatesIntentHandler())
-skill_builder.add_request_handler(ContactIntentHandler())
+# la skill es la misma para Flask (aquí) y para ASGI (asgi.py)
+skill = metrics.instrument_serializer(skill_builder.create())
 
-skill_builder.add_request_handler(HelpIntentHandler())
-skill_builder.add_request_handler(CancelOrStopIntentHandler())
-skill_builder.add_request_handler(FallbackIntentHandler())
-skill_builder.add_request_handler(SessionEndedRequestHandler())
+# las pruebas locales (ver benchmarks/) no llevan la firma de Alexa
+# > el SkillAdapter las lee al crearse, aquí se dejan tal cual por defecto
+app.config.setdefault("ASK_SDK_VERIFY_SIGNATURE", getattr(info, "verify_signature", True))
+app.config.setdefault("ASK_SDK_VERIFY_TIMESTAMP", getattr(info, "verify_timestamp", True))
 
-# último para que no sobre-escriba
-skill_builder.add_request_handler(IntentReflectorHandler())  
-skill_builder.add_exception_handler(CatchAllExceptionHandler())
+# bienvenida, ayuda, despedida... se generan una vez y se sirven ya en JSON (ver prerender.py)
+static_responses = prerender.StaticResponses(skill, request_handlers)
+if getattr(info, "static_responses", True):
+    static_responses.render()
 
-skill_adapter = SkillAdapter(
-    skill=skill_builder.create(),
+skill_adapter = prerender.StaticSkillAdapter(
+    skill=skill,
     skill_id=info.skill_id,
-    app=app
+    app=app,
+    static=static_responses,
 )
 
+startup["importar_ms"] = round((time.perf_counter() - _import_start) * 1000, 1)
+
+# sin servidor que llame a `warm_up` (p.ej. `flask run`) se puede preparar al importar
+if getattr(info, "warm_up_on_import", False):
+    warm_up()
+
 
 # ==========================================================
 #      FLASK
@@ -532,6 +945,25 @@ def hello_world():
     return "Hello world!"
 
 
+@app.get("/estado")  # versión de los datos que tiene este proceso
+def status():
+    return {
+        "pid": os.getpid(),
+        "version": snapshots.version,
+        "actualizado": snapshots.updated,
+        "modo": watcher.mode,
+        "ultimo_cambio": watcher.last_event,
+        "respuestas": response_cache.stats(),
+        "arranque": startup,
+    }
+
+
+@app.get("/metrics")  # tiempos por handler y etapa, formato de Prometheus
+def metrics_endpoint():
+    return metrics.expose(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
 @app.post("/")  # atiende peticiones POST
 def invoke_skill():
-    return skill_adapter.dispatch_request()
+    with metrics.request(slow_request):
+        return skill_adapter.dispatch_request()
@@ -0,0 +1,297 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Servir la skill por ASGI, por ejemplo:
+#         uvicorn asgi:application --workers 2
+#
+#     Los handlers son los mismos que con Flask (app.py), lo único que cambia
+#     es que la identidad del usuario (LWA + usuarios) se obtiene con I/O
+#     asíncrona, así un proceso atiende muchas peticiones a la vez mientras
+#     espera a la red. Con eso rellenamos las cachés de app.py y después la
+#     skill se ejecuta en un pool de hilos sin tener que esperar a nada
+# ==========================================================
+
+# Información
+from datos import info
+
+# Debug
+import logging
+
+# Concurrencia
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# JSON
+import json
+
+# Type hinting
+from typing import Dict, Optional
+
+# Alexa Skill Kit SDK
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.exceptions import AskSdkException
+from ask_sdk_webservice_support.verifier import RequestVerifier, TimestampVerifier, VerificationException
+
+# MongoDB asíncrono
+from motor.motor_asyncio import AsyncIOMotorClient
+
+# Login with Amazon
+from lwa import AsyncLWAClient
+
+# Tiempos por petición
+import metrics
+
+# Respuestas generadas al arrancar
+from prerender import StaticResponses
+
+# Handler de cada petición
+import routing
+
+# Skill (handlers, cachés y datos compartidos con Flask)
+import app as skill_app
+
+
+# ==========================================================
+#      APLICACIÓN
+# ==========================================================
+
+class SkillASGI:
+    """
+    Aplicación ASGI con las mismas rutas que la de Flask
+
+    > GET / -> hello world
+    > GET /estado -> versión de los datos del proceso
+    > GET /metrics -> tiempos por handler y etapa
+    > POST / -> petición de Alexa
+    """
+
+    def __init__(self, skill, verify_signature: bool = True, verify_timestamp: bool = True, threads: int = 32):
+        self.skill = skill
+
+        self.verifiers = []
+        if verify_signature:
+            self.verifiers.append(RequestVerifier())
+        if verify_timestamp:
+            self.verifiers.append(TimestampVerifier())
+
+        # los handlers son síncronos, se ejecutan aquí
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="skill")
+
+        # se crean al arrancar, dentro del bucle de eventos
+        self.lwa: Optional[AsyncLWAClient] = None
+        self.database = None
+
+        # token -> consulta a LWA en curso, para no repetirla si llegan varias a la vez
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    # ------------------------------------------------------
+    #   Arranque y parada
+    # ------------------------------------------------------
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self) -> None:
+        self.lwa = AsyncLWAClient(
+            base_url=getattr(info, "lwa_url", "https://api.amazon.com"),
+            timeout=getattr(info, "lwa_timeout", (1.0, 2.0)),
+            retries=getattr(info, "lwa_retries", 1),
+        )
+        self.database = AsyncIOMotorClient(info.database_ip)[info.database_name]
+
+        # no se aceptan peticiones hasta terminar (ver app.warm_up)
+        if getattr(info, "warm_up", True):
+            await self.lwa.warm_up()
+            # con preload_app los datos ya vienen del proceso padre (ver gunicorn.conf.py)
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(skill_app.warm_up, data=not skill_app.prefork),
+            )
+
+    async def shutdown(self) -> None:
+        if self.lwa is not None:
+            await self.lwa.close()
+        if self.database is not None:
+            self.database.client.close()
+        self.executor.shutdown(wait=False)
+
+    # ------------------------------------------------------
+    #   HTTP
+    # ------------------------------------------------------
+
+    async def _http(self, scope, receive, send) -> None:
+        method, path = scope["method"], scope["path"]
+
+        if method == "GET" and path == "/":
+            await self._respond(send, 200, b"Hello world!", b"text/html; charset=utf-8")
+
+        elif method == "GET" and path == "/estado":
+            await self._respond(send, 200, json.dumps(skill_app.status()).encode())
+
+        elif method == "GET" and path == "/metrics":
+            await self._respond(send, 200, metrics.expose().encode(), b"text/plain; version=0.0.4; charset=utf-8")
+
+        elif method == "POST" and path == "/":
+            body = await self._read_body(receive)
+            headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+
+            try:
+                with metrics.request(skill_app.slow_request):
+                    response = await self.dispatch(body.decode("utf-8"), headers)
+            except VerificationException:
+                logging.error("Request verification failed", exc_info=True)
+                await self._respond(send, 400, b"Incoming request failed verification", b"text/plain")
+            except AskSdkException:
+                logging.error("Skill dispatch exception", exc_info=True)
+                await self._respond(send, 500, b"Exception occurred during skill dispatch", b"text/plain")
+            else:
+                await self._respond(send, 200, response)
+
+        else:
+            await self._respond(send, 404, b"Not found", b"text/plain")
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                return body
+
+    @staticmethod
+    async def _respond(send, status: int, body: bytes, content_type: bytes = b"application/json") -> None:
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    # ------------------------------------------------------
+    #   Skill
+    # ------------------------------------------------------
+
+    async def _run(self, func, *args):
+        # con el contexto de la petición, para que sus tiempos cuenten en ella (ver metrics.py)
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(context.run, func, *args)
+        )
+
+    async def dispatch(self, body: str, headers: Dict[str, str]) -> bytes:
+        """
+        Lo mismo que hace el SkillAdapter de Flask, pero sin bloquear el bucle de eventos
+        > las respuestas generadas al arrancar no pasan por la skill (ver prerender.py)
+        """
+
+        try:
+            parsed = json.loads(body)
+        except ValueError:
+            parsed = None
+
+        found = skill_app.static_responses.lookup(parsed) if isinstance(parsed, dict) else None
+        if found is not None:
+            name, route, response = found
+            await self._run(StaticResponses.verify, self.verifiers, headers, body, parsed)
+            metrics.label(name, parsed["request"].get("requestId"), route)
+            return response
+
+        envelope = self.skill.serializer.deserialize(payload=body, obj_type=RequestEnvelope)
+
+        # la verificación de la firma puede descargar el certificado, la sacamos del bucle
+        for verifier in self.verifiers:
+            await self._run(verifier.verify, headers, body, envelope)
+
+        await self.prefetch(envelope)
+
+        response = await self._run(self.skill.invoke, envelope, None)
+        return json.dumps(self.skill.serializer.serialize(response)).encode()
+
+    async def prefetch(self, envelope: RequestEnvelope) -> None:
+        """
+        Rellena las cachés de token y de usuario con I/O asíncrona, así los
+        decoradores `get_data`/`check_data` no tienen que esperar a la red
+
+        > Solo si el handler que atenderá la petición los usa (ver routing.find_handler)
+        > Si falla no pasa nada, el handler lo volverá a intentar por su cuenta y
+        el error le llegará al usuario a través de CatchAllExceptionHandler
+        """
+
+        session = envelope.session
+        token = session.user.access_token if session is not None and session.user is not None else None
+        if token is None:
+            return
+
+        handler_input = HandlerInput(request_envelope=envelope)
+        handler = routing.find_handler(self.skill, handler_input)
+        if handler is None or not getattr(handler.handle, "uses_data", False):
+            return
+
+        # los tiempos de LWA y Mongo cuentan ya para este handler (ver metrics.instrument)
+        metrics.label(handler.__class__.__name__, envelope.request.request_id, routing.route(handler_input))
+
+        try:
+            user_id = await self._user_id(token)
+            if skill_app.profile_cache.get(user_id) is None:
+                data = await self.database["usuarios"].find_one({"_id": user_id}, {"_id": False})
+                if data is not None:
+                    skill_app.profile_cache.set(user_id, data)
+        except Exception:
+            logging.warning("No se pudo obtener el usuario de forma asíncrona", exc_info=True)
+
+    async def _user_id(self, token: str) -> str:
+        # la caché del proceso es memoria, el almacén compartido (SQLite) se lee fuera del bucle
+        user_id = skill_app.token_cache.cached(token)
+        if user_id is None and skill_app.token_cache.store is not None:
+            user_id = await self._run(skill_app.token_cache.peek, token)
+        if user_id is not None:
+            return user_id
+
+        # si ya hay una consulta en curso para este token, esperamos a esa
+        task = self._pending.get(token)
+        if task is None:
+            task = self._pending[token] = asyncio.ensure_future(self._lookup(token))
+            task.add_done_callback(lambda _: self._pending.pop(token, None))
+
+        return await task
+
+    async def _lookup(self, token: str) -> str:
+        user_id = await self.lwa.user_id(token)
+        # con almacén compartido es un INSERT en SQLite, fuera del bucle
+        if skill_app.token_cache.store is not None:
+            await self._run(skill_app.token_cache.remember, token, user_id)
+        else:
+            skill_app.token_cache.remember(token, user_id)
+        return user_id
+
+
+application = SkillASGI(
+    skill_app.skill,
+    verify_signature=skill_app.app.config.get("ASK_SDK_VERIFY_SIGNATURE", True),
+    verify_timestamp=skill_app.app.config.get("ASK_SDK_VERIFY_TIMESTAMP", True),
+    threads=getattr(info, "asgi_threads", 32),
+)
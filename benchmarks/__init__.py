@@ -0,0 +1 @@
+# Pruebas de rendimiento de la skill, ver benchmarks/load.py
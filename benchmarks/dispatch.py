@@ -0,0 +1,156 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Microbenchmark de la elección de handler, desde la raíz:
+#
+#         python -m benchmarks.dispatch
+#         python -m benchmarks.dispatch --intents 10 100 1000 --lookups 20000
+#
+#     Con N intents registrados mide cuánto tarda en encontrar el handler el
+#     mapper del SDK (can_handle de cada handler en orden, como eran los de
+#     app.py) y la tabla de routing.py, para el primer intent, el último y
+#     uno que no tiene handler (cae en IntentReflectorHandler)
+# ==========================================================
+
+# Argumentos
+import argparse
+
+# Tiempo
+import time
+
+# Alexa Skill Kit SDK
+import ask_sdk_core.utils as ask_utils
+from ask_sdk_core.dispatch_components import AbstractRequestHandler
+from ask_sdk_core.attributes_manager import AttributesManager
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_model import Intent, IntentRequest, RequestEnvelope, Session
+from ask_sdk_runtime.dispatch_components import GenericRequestHandlerChain, GenericRequestMapper
+
+# Type hinting
+from typing import Dict, List
+
+import routing
+
+
+SIZES = [10, 50, 200, 1000]
+
+
+# ==========================================================
+#      HANDLERS
+# ==========================================================
+
+class ScanHandler(AbstractRequestHandler):
+    """Como los handlers de antes: el nombre se construye en cada can_handle"""
+
+    def __init__(self, index: int):
+        self.name = f"Intent{index}Handler"
+
+    def can_handle(self, handler_input: HandlerInput) -> bool:
+        return ask_utils.is_intent_name(self.name.split("Handler")[0])(handler_input)
+
+    def handle(self, handler_input: HandlerInput, *args, **kwargs):
+        return None
+
+
+class RoutedHandler(ScanHandler):
+    def __init__(self, index: int):
+        super().__init__(index)
+        self.routes = (f"Intent{index}",)
+
+
+class SessionHandler(AbstractRequestHandler):
+    """Como SignUpIntentHandler, el primero de la lista"""
+
+    routes = ("SignUpIntent",)
+    session_key = "estado"
+
+    def can_handle(self, handler_input: HandlerInput) -> bool:
+        return (
+            ask_utils.is_intent_name("SignUpIntent")(handler_input) or
+            self.session_key in handler_input.attributes_manager.session_attributes
+        )
+
+    def handle(self, handler_input: HandlerInput, *args, **kwargs):
+        return None
+
+
+class ReflectorHandler(AbstractRequestHandler):
+    def can_handle(self, handler_input: HandlerInput) -> bool:
+        return ask_utils.is_request_type("IntentRequest")(handler_input)
+
+    def handle(self, handler_input: HandlerInput, *args, **kwargs):
+        return None
+
+
+def chains(handlers: List[AbstractRequestHandler]) -> List[GenericRequestHandlerChain]:
+    return [GenericRequestHandlerChain(request_handler=handler) for handler in handlers]
+
+
+def mappers(size: int) -> Dict[str, GenericRequestMapper]:
+    return {
+        "sdk": GenericRequestMapper(chains([SessionHandler(), *map(ScanHandler, range(size)), ReflectorHandler()])),
+        "tabla": routing.RoutingRequestMapper(
+            chains([SessionHandler(), *map(RoutedHandler, range(size)), ReflectorHandler()]),
+        ),
+    }
+
+
+def handler_input(intent: str) -> HandlerInput:
+    envelope = RequestEnvelope(
+        session=Session(new=False, session_id="benchmark", attributes={}),
+        request=IntentRequest(request_id="benchmark", intent=Intent(name=intent)),
+    )
+    return HandlerInput(request_envelope=envelope, attributes_manager=AttributesManager(envelope))
+
+
+# ==========================================================
+#      MEDIDAS
+# ==========================================================
+
+def measure(mapper: GenericRequestMapper, request: HandlerInput, lookups: int) -> float:
+    """Microsegundos por búsqueda"""
+    start = time.perf_counter()
+    for _ in range(lookups):
+        mapper.get_request_handler_chain(request)
+    return (time.perf_counter() - start) / lookups * 1e6
+
+
+def run(sizes: List[int], lookups: int) -> List[dict]:
+    rows = []
+    for size in sizes:
+        cases = {
+            "primero": handler_input("Intent0"),
+            "ultimo": handler_input(f"Intent{size - 1}"),
+            "sin handler": handler_input("OtroIntent"),
+        }
+        for name, mapper in mappers(size).items():
+            row = {"intents": size, "mapper": name}
+            for case, request in cases.items():
+                row[case] = measure(mapper, request, lookups)
+            rows.append(row)
+    return rows
+
+
+def print_rows(rows: List[dict]) -> None:
+    header = f"{'intents':>8} {'mapper':<8}{'primero µs':>13}{'último µs':>13}{'sin handler µs':>17}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['intents']:>8} {row['mapper']:<8}{row['primero']:>13.2f}"
+            f"{row['ultimo']:>13.2f}{row['sin handler']:>17.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark de la elección de handler")
+    parser.add_argument("--intents", type=int, nargs="*", default=SIZES, help="intents registrados")
+    parser.add_argument("--lookups", type=int, default=5000, help="búsquedas por caso")
+    args = parser.parse_args()
+
+    print_rows(run(args.intents, args.lookups))
@@ -0,0 +1,241 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Microbenchmark de la búsqueda de nombres de find(), desde la raíz:
+#
+#         python -m benchmarks.find
+#         python -m benchmarks.find --sizes 100 1000 --queries 500 --check
+#
+#     Para cada tamaño de catálogo (100 a 100k asignaturas) y cada tipo de
+#     ruido en el slot (tildes, erratas, frases cortadas...) mide la latencia
+#     de cada motor, cuántas veces acierta la asignatura buscada y cuántas
+#     devuelve lo mismo que difflib (get_close_matches, lo que hacía find())
+#
+#     Con --check termina con error si algún motor marcado como exacto no
+#     devuelve siempre lo mismo que difflib
+# ==========================================================
+
+# Argumentos
+import argparse
+import os
+
+# Aleatoriedad
+import random
+
+# Tiempo
+import time
+import datetime
+
+# JSON
+import json
+
+# Parecido string
+from difflib import get_close_matches
+
+# Type hinting
+from typing import Dict, List, Tuple
+from collections.abc import Callable
+
+from benchmarks.fixtures import PREFIXES, SUBJECTS, SUFFIXES, spoken
+from benchmarks.load import ROOT, git_version, percentile
+
+import matching
+
+
+RESULTS_PATH = os.path.join(ROOT, "benchmarks", "find_results.jsonl")
+
+SIZES = [100, 1000, 10000, 100000]
+
+
+# ==========================================================
+#      DATOS
+# ==========================================================
+
+def catalog(rng: random.Random, size: int) -> List[str]:
+    """
+    `size` nombres de asignatura distintos
+    > con catálogos grandes se combinan dos materias ("Física y Química Aplicada")
+    """
+    names = set()
+    simple = len(PREFIXES) * len(SUBJECTS) * len(SUFFIXES)
+    while len(names) < size:
+        name = rng.choice(PREFIXES) + rng.choice(SUBJECTS)
+        if len(names) >= simple // 2 or rng.random() < 0.3:
+            name += rng.choice((" y ", " de ", " en ")) + rng.choice(SUBJECTS).lower()
+        names.add(name + rng.choice(SUFFIXES))
+    return sorted(names)
+
+
+NUMERALS = {" I": " uno", " II": " dos", " III": " tres"}
+
+
+def _spoken_numeral(name: str) -> str:
+    for roman, word in NUMERALS.items():
+        if name.endswith(roman):
+            return name[:-len(roman)] + word
+    return name
+
+
+# tipo de ruido -> función(nombre, rng) que da lo que llegaría en el slot
+NOISE: Dict[str, Callable] = {
+    # lo que dice el usuario tal cual, pero sin tildes ni mayúsculas
+    "exacto": lambda name, rng: spoken(name, rng, 0),
+    # una letra perdida o cambiada
+    "errata": lambda name, rng: spoken(name, rng, 1),
+    # dos erratas
+    "erratas": lambda name, rng: spoken(spoken(name, rng, 1), rng, 1),
+    # solo las primeras palabras ("teoria de" por "Teoría de Circuitos II")
+    "cortado": lambda name, rng: " ".join(spoken(name, rng, 0).split()[:max(1, len(name.split()) - 2)]),
+    # numerales dichos con palabras ("calculo dos")
+    "numeral": lambda name, rng: spoken(_spoken_numeral(name), rng, 0),
+}
+
+
+def queries(rng: random.Random, names: List[str], count: int, noise: str) -> List[Tuple[str, str]]:
+    """(lo que llega en el slot, nombre buscado)"""
+    targets = [rng.choice(names) for _ in range(count)]
+    return [(NOISE[noise](target, rng), target) for target in targets]
+
+
+# ==========================================================
+#      MOTORES
+# ==========================================================
+
+def difflib_engine(names: List[str]) -> Callable:
+    """Lo que hacía find() antes de matching.py"""
+    return lambda query: get_close_matches(query, names, n=1, cutoff=0)[0]
+
+
+def index_engine(names: List[str], normalize: bool = False) -> Callable:
+    """matching.NameIndex sin memo, para medir la búsqueda y no la caché"""
+    index = matching.NameIndex(lambda: names, memo_size=0, normalize=normalize)
+    index.refresh()
+    return index.resolve
+
+
+# nombre -> (constructor, si tiene que dar siempre lo mismo que difflib)
+ENGINES: Dict[str, Tuple[Callable, bool]] = {
+    "difflib": (difflib_engine, True),
+    "indice": (index_engine, True),
+    # sin tildes, palabras vacías ni numerales, lo que usa find() por defecto
+    "normalizado": (lambda names: index_engine(names, normalize=True), False),
+}
+
+
+# ==========================================================
+#      MEDIDAS
+# ==========================================================
+
+def measure(search: Callable, cases: List[Tuple[str, str]]) -> Tuple[List[str], List[float]]:
+    results, latencies = [], []
+    for query, _ in cases:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append(time.perf_counter() - start)
+    return results, sorted(latencies)
+
+
+def run(sizes: List[int], noises: List[str], engines: List[str], count: int, reference: int, seed: int) -> List[dict]:
+    """
+    Una fila por (tamaño, ruido, motor)
+
+    > difflib solo se ejecuta con las `reference` primeras consultas, con 100k
+    nombres tarda segundos por consulta
+    > "coincide" es el % de esas consultas en las que el motor da lo mismo que difflib
+    """
+
+    rows = []
+    for size in sizes:
+        rng = random.Random(seed)
+        names = catalog(rng, size)
+
+        built = {}
+        for engine in engines:
+            start = time.perf_counter()
+            built[engine] = ENGINES[engine][0](names)
+            build_time = time.perf_counter() - start
+            built[engine] = (built[engine], build_time)
+
+        for noise in noises:
+            cases = queries(rng, names, count, noise)
+            expected, _ = measure(built["difflib"][0], cases[:reference]) if "difflib" in built else (None, None)
+
+            for engine in engines:
+                search, build_time = built[engine]
+                engine_cases = cases[:reference] if engine == "difflib" else cases
+                results, latencies = measure(search, engine_cases)
+
+                hits = sum(result == target for result, (_, target) in zip(results, engine_cases))
+                same = None
+                if expected is not None:
+                    same = sum(a == b for a, b in zip(results, expected)) / len(expected) * 100
+
+                rows.append({
+                    "nombres": size,
+                    "ruido": noise,
+                    "motor": engine,
+                    "consultas": len(engine_cases),
+                    "construir_ms": round(build_time * 1000, 1),
+                    "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+                    "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+                    "acierto": round(hits / len(engine_cases) * 100, 1),
+                    "coincide": None if same is None else round(same, 1),
+                })
+
+    return rows
+
+
+def print_rows(rows: List[dict]) -> None:
+    header = (
+        f"{'nombres':>8} {'ruido':<9}{'motor':<13}{'n':>6}{'construir':>11}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'acierto':>9}{'=difflib':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        same = "-" if row["coincide"] is None else f"{row['coincide']:.1f}%"
+        print(
+            f"{row['nombres']:>8} {row['ruido']:<9}{row['motor']:<13}{row['consultas']:>6}"
+            f"{row['construir_ms']:>9.1f}ms{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}"
+            f"{row['acierto']:>8.1f}%{same:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark de la búsqueda de nombres")
+    parser.add_argument("--sizes", type=int, nargs="*", default=SIZES, help="tamaños del catálogo")
+    parser.add_argument("--noise", nargs="*", choices=list(NOISE), default=list(NOISE), help="tipos de ruido")
+    parser.add_argument("--engines", nargs="*", choices=list(ENGINES), default=list(ENGINES), help="motores")
+    parser.add_argument("--queries", type=int, default=200, help="consultas por tamaño y ruido")
+    parser.add_argument("--reference", type=int, default=20, help="consultas que se comparan con difflib")
+    parser.add_argument("--seed", type=int, default=0, help="semilla de los nombres y las consultas")
+    parser.add_argument("--check", action="store_true", help="fallar si un motor exacto no coincide con difflib")
+    parser.add_argument("--no-save", action="store_true", help="no guardar en benchmarks/find_results.jsonl")
+    args = parser.parse_args()
+
+    rows = run(args.sizes, args.noise, args.engines, args.queries, args.reference, args.seed)
+    print_rows(rows)
+
+    if not args.no_save:
+        with open(RESULTS_PATH, "a", encoding="utf-8") as file:
+            file.write(json.dumps({
+                **git_version(),
+                "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+                "config": {"consultas": args.queries, "referencia": args.reference, "semilla": args.seed},
+                "resultados": rows,
+            }, ensure_ascii=False) + "\n")
+
+    if args.check:
+        wrong = [
+            row for row in rows
+            if ENGINES[row["motor"]][1] and row["coincide"] is not None and row["coincide"] < 100
+        ]
+        for row in wrong:
+            print(f"{row['motor']} no coincide con difflib: {row['nombres']} nombres, ruido {row['ruido']}")
+        if wrong:
+            raise SystemExit(1)
@@ -0,0 +1,374 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Datos y peticiones sintéticas para las pruebas de rendimiento
+#
+#     > Base de datos con tamaños parecidos a los de la UPCT
+#     > Servidor local que hace de api.amazon.com/user/profile
+#     > Peticiones de Alexa para cada intent, el registro con sus tres turnos
+# ==========================================================
+
+# Aleatoriedad
+import random
+
+# Peticiones HTTP
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Fechas
+import datetime
+
+# Identificadores
+import uuid
+import unicodedata
+
+# Type hinting
+from typing import Dict, List, Optional, Tuple
+
+
+# ==========================================================
+#      NOMBRES
+# ==========================================================
+
+SUBJECTS = [
+    "Cálculo", "Álgebra Lineal", "Física", "Química", "Estadística", "Programación",
+    "Expresión Gráfica", "Economía de la Empresa", "Electrónica", "Teoría de Circuitos",
+    "Señales y Sistemas", "Sistemas Operativos", "Redes de Computadores", "Bases de Datos",
+    "Ingeniería del Software", "Arquitectura de Computadores", "Control Automático",
+    "Máquinas Eléctricas", "Resistencia de Materiales", "Mecánica de Fluidos", "Termodinámica",
+    "Tecnología Medioambiental", "Electrónica de Potencia", "Comunicaciones Ópticas",
+    "Antenas y Propagación", "Microondas", "Sistemas de Telecomunicación", "Teoría de Estructuras",
+    "Hidráulica", "Geotecnia", "Topografía", "Construcción", "Urbanismo", "Proyectos",
+    "Ciencia de Materiales", "Métodos Numéricos", "Inteligencia Artificial", "Robótica",
+    "Tratamiento Digital de Señales", "Sistemas Embebidos", "Edafología", "Botánica",
+    "Genética", "Fitotecnia", "Zootecnia", "Navegación", "Derecho Marítimo", "Contabilidad",
+    "Marketing", "Dirección de Operaciones", "Microeconomía", "Macroeconomía",
+]
+
+SUFFIXES = ["", " I", " II", " III", " Avanzada", " Aplicada", " para Ingenieros"]
+PREFIXES = ["", "Ampliación de ", "Laboratorio de ", "Fundamentos de ", "Taller de "]
+
+FIRST_NAMES = [
+    "Ana", "Antonio", "Carmen", "José", "María", "Francisco", "Isabel", "Juan", "Lucía",
+    "Manuel", "Pilar", "Javier", "Elena", "David", "Rosa", "Pedro", "Teresa", "Miguel",
+    "Marta", "Ángel", "Cristina", "Alberto", "Raquel", "Fernando", "Nuria", "Ginés",
+]
+
+SURNAMES = [
+    "García", "Martínez", "López", "Sánchez", "Pérez", "Gómez", "Fernández", "Ruiz",
+    "Hernández", "Jiménez", "Díaz", "Moreno", "Muñoz", "Álvarez", "Romero", "Navarro",
+    "Torres", "Domínguez", "Vázquez", "Ramos", "Gil", "Serrano", "Molina", "Castillo",
+    "Ortega", "Marín", "Rubio", "Nicolás", "Egea", "Cánovas",
+]
+
+STUDIES = [
+    "Grado en Ingeniería", "Máster en Ingeniería", "Grado en", "Máster en",
+]
+
+FIELDS = [
+    "Telemática", "Sistemas de Telecomunicación", "Electrónica Industrial", "Mecánica",
+    "Eléctrica", "Química Industrial", "Civil", "de Caminos", "Agronómica", "Naval",
+    "de Minas", "Administración de Empresas", "Turismo", "Arquitectura", "Biotecnología",
+    "Organización Industrial", "Recursos Minerales", "Tecnologías Industriales",
+]
+
+SCHOOLS = ["ETSIT", "ETSII", "ETSAE", "ETSICCPM", "ETSIA", "ETSINO", "EIMIM", "FCE"]
+
+DATES = ["examenes", "festivos", "matricula", "clases"]
+
+
+def subject_names(rng: random.Random, count: int) -> List[str]:
+    """`count` nombres de asignatura distintos"""
+    names = set()
+    while len(names) < count:
+        names.add(rng.choice(PREFIXES) + rng.choice(SUBJECTS) + rng.choice(SUFFIXES))
+    return sorted(names)
+
+
+def spoken(name: str, rng: random.Random, noise: float = 0.1) -> str:
+    """
+    Cómo llega un nombre en el slot: minúsculas, sin tildes y con algún error
+    > con probabilidad `noise` se pierde o se cambia una letra
+    """
+    text = unicodedata.normalize("NFKD", name.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    if len(text) > 3 and rng.random() < noise:
+        position = rng.randrange(len(text))
+        if rng.random() < 0.5:
+            text = text[:position] + text[position + 1:]
+        else:
+            text = text[:position] + rng.choice("aeiourst") + text[position + 1:]
+    return text
+
+
+# ==========================================================
+#      BASE DE DATOS
+# ==========================================================
+
+def seed(database, scale: float = 1.0, users: int = 5000, seed: int = 0) -> Dict[str, list]:
+    """
+    Rellena la base de datos (borrando lo que hubiera)
+
+    > Con scale=1: 8 escuelas, 48 titulaciones, ~2200 asignaturas, 1200 profesores
+    > Los usuarios registrados son amzn1.account.u<i>, ver FakeLWA
+
+    Devuelve lo que necesitan las peticiones para tener slots válidos
+    """
+
+    rng = random.Random(seed)
+    studies_per_school = max(1, round(6 * scale))
+    subjects_per_study = max(1, round(45 * scale))
+    teachers_count = max(1, round(1200 * scale))
+
+    for collection in ("secretarias", "estudios", "asignaturas", "profesores", "fechas", "usuarios"):
+        database[collection].drop()
+
+    database["secretarias"].insert_many([
+        {"_id": school, "email": f"secretaria@{school.lower()}.upct.es", "telefono": f"968 32 {i:02d} 00"}
+        for i, school in enumerate(SCHOOLS)
+    ])
+
+    teachers = []
+    for i in range(teachers_count):
+        first, surname = rng.choice(FIRST_NAMES), rng.choice(SURNAMES)
+        teachers.append({
+            "_id": f"{spoken(first, rng, 0)}.{spoken(surname, rng, 0)}{i}@upct.es",
+            "nombre": f"{first} {surname} {rng.choice(SURNAMES)}",
+        })
+    database["profesores"].insert_many(teachers)
+
+    studies, subjects, dates = [], [], []
+    study_names = set()
+    code = 0
+    for school in SCHOOLS:
+        for _ in range(studies_per_school):
+            name = f"{rng.choice(STUDIES)} {rng.choice(FIELDS)}"
+            if name in study_names:
+                name = f"{name} ({len(studies)})"
+            study_names.add(name)
+
+            study_id = f"{school[:3]}{len(studies):03d}"
+            studies.append({"_id": study_id, "nombre": name, "escuela": school})
+            dates.append({"_id": study_id, **{date: f"del {rng.randint(1, 28)} de junio" for date in DATES}})
+
+            for subject in subject_names(rng, subjects_per_study):
+                code += 1
+                subjects.append({
+                    "_id": {"id_estudios": study_id, "codigo": code},
+                    "nombre": subject,
+                    "guia_docente": f"https://www.upct.es/guias/{study_id}/{code}.pdf",
+                    "responsable": rng.choice(teachers)["_id"],
+                })
+
+    database["estudios"].insert_many(studies)
+    database["asignaturas"].insert_many(subjects)
+    database["fechas"].insert_many(dates)
+
+    registered = [(f"u{i}", rng.choice(studies)["_id"]) for i in range(users)]
+    database["usuarios"].insert_many([
+        {"_id": f"amzn1.account.{user}", "estudios": studying} for user, studying in registered
+    ])
+
+    by_study: Dict[str, List[str]] = {}
+    for subject in subjects:
+        by_study.setdefault(subject["_id"]["id_estudios"], []).append(subject["nombre"])
+
+    return {
+        "users": registered,
+        "subjects": by_study,
+        "studies": studies,
+        "schools": SCHOOLS,
+    }
+
+
+# ==========================================================
+#      LOGIN WITH AMAZON
+# ==========================================================
+
+class FakeLWA:
+    """
+    Servidor local que responde como api.amazon.com/user/profile
+
+    > El token "<usuario>.<n>" es del usuario amzn1.account.<usuario>, así un
+    mismo usuario puede tener tokens nuevos (que la skill aún no ha visto)
+    > `latency` simula lo que tarda la red hasta Amazon
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # cabeceras y cuerpo van en escrituras separadas, sin esto cada
+            # respuesta espera al ACK retardado del cliente (~40ms)
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                token = self.headers.get("Authorization", "").split(" ")[-1]
+                body = json.dumps({"user_id": f"amzn1.account.{token.split('.')[0]}"}).encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.latency = latency
+        self.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self) -> "FakeLWA":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ==========================================================
+#      PETICIONES
+# ==========================================================
+
+def envelope(
+    skill_id: str,
+    token: str,
+    request_type: str = "IntentRequest",
+    intent: Optional[str] = None,
+    slots: Optional[Dict[str, str]] = None,
+    attributes: Optional[dict] = None,
+) -> dict:
+    """Petición de Alexa como la que llega a POST /"""
+
+    request = {
+        "type": request_type,
+        "requestId": f"amzn1.echo-api.request.{uuid.uuid4()}",
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "locale": "es-ES",
+    }
+    if intent is not None:
+        request["intent"] = {
+            "name": intent,
+            "confirmationStatus": "NONE",
+            "slots": {
+                name: {"name": name, "value": value, "confirmationStatus": "NONE"}
+                for name, value in (slots or {}).items()
+            },
+        }
+    if request_type == "SessionEndedRequest":
+        request["reason"] = "USER_INITIATED"
+
+    user = {"userId": f"amzn1.ask.account.{token}", "accessToken": token}
+    return {
+        "version": "1.0",
+        "session": {
+            "new": not attributes,
+            "sessionId": f"amzn1.echo-api.session.{uuid.uuid4()}",
+            "application": {"applicationId": skill_id},
+            "attributes": attributes or {},
+            "user": user,
+        },
+        "context": {
+            "System": {
+                "application": {"applicationId": skill_id},
+                "user": user,
+                "device": {"deviceId": "benchmark", "supportedInterfaces": {}},
+                "apiEndpoint": "https://api.eu.amazonalexa.com",
+            },
+        },
+        "request": request,
+    }
+
+
+# intent -> etiqueta en los resultados
+INTENTS = [
+    "LaunchRequest", "SubjectIntent", "TeacherIntent", "ScheduleIntent", "DatesIntent",
+    "ContactIntent", "AMAZON.HelpIntent", "AMAZON.StopIntent", "AMAZON.FallbackIntent",
+    "SessionEndedRequest", "SignUpIntent",
+]
+
+
+class Scenarios:
+    """
+    Genera las peticiones de cada prueba
+
+    > Cada tarea es una lista de (etiqueta, petición) que se mandan en orden,
+    el registro son tres turnos de la misma sesión
+    > `cold` es la fracción de peticiones con un token que la skill no ha visto
+    (tiene que preguntar a LWA), el resto reutiliza los tokens de los usuarios
+    """
+
+    def __init__(self, data: Dict[str, list], skill_id: str, cold: float = 0.05, seed: int = 0):
+        self.data = data
+        self.skill_id = skill_id
+        self.cold = cold
+        self.rng = random.Random(seed)
+        self._new_users = 0
+        self._lock = threading.Lock()
+
+    def _user(self) -> Tuple[str, str]:
+        user, studying = self.rng.choice(self.data["users"])
+        suffix = self.rng.randrange(10 ** 9) if self.rng.random() < self.cold else 0
+        return f"{user}.{suffix}", studying
+
+    def task(self, intent: str) -> List[Tuple[str, dict]]:
+        with self._lock:
+            return self._task(intent)
+
+    def _task(self, intent: str) -> List[Tuple[str, dict]]:
+        rng = self.rng
+        token, studying = self._user()
+
+        def build(**kwargs) -> dict:
+            return envelope(self.skill_id, kwargs.pop("token", token), **kwargs)
+
+        if intent in ("LaunchRequest", "SessionEndedRequest"):
+            return [(intent, build(request_type=intent))]
+
+        if intent in ("SubjectIntent", "TeacherIntent"):
+            subject = spoken(rng.choice(self.data["subjects"][studying]), rng)
+            return [(intent, build(intent=intent, slots={"SubjectSlot": subject}))]
+
+        if intent == "ScheduleIntent":
+            return [(intent, build(intent=intent, slots={"YearSlot": str(rng.randint(1, 4))}))]
+
+        if intent == "DatesIntent":
+            return [(intent, build(intent=intent, slots={"DateSlot": rng.choice(DATES)}))]
+
+        if intent == "SignUpIntent":
+            # usuario nuevo, su primera petición siempre pregunta a LWA
+            self._new_users += 1
+            token = f"nuevo{self._new_users}-{rng.randrange(10 ** 9)}.0"
+            study = rng.choice(self.data["studies"])
+            return [
+                ("SignUpIntent (inicio)", build(intent=intent, token=token)),
+                ("SignUpIntent (escuela)", build(
+                    intent=intent, token=token,
+                    slots={"TextSlot": spoken(study["escuela"], rng, 0)}, attributes={"estado": "Escuela"},
+                )),
+                ("SignUpIntent (estudios)", build(
+                    intent=intent, token=token,
+                    slots={"TextSlot": spoken(study["nombre"], rng)}, attributes={"estado": "Estudio"},
+                )),
+            ]
+
+        return [(intent, build(intent=intent))]
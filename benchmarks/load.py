@@ -0,0 +1,346 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Prueba de carga de la skill, desde la raíz del repositorio:
+#
+#         python -m benchmarks.load                     # mongomock, en el mismo proceso
+#         python -m benchmarks.load --mongo-uri mongodb://localhost:27017
+#         python -m benchmarks.load --url http://localhost:8000 --mongo-uri ... --lwa-port 8081
+#
+#     Por cada intent manda `--requests` peticiones con `--concurrency` hilos
+#     y mide p50/p95/p99 y peticiones por segundo. Los resultados se añaden a
+#     benchmarks/results.jsonl junto con el commit, para comparar entre versiones
+#
+#     Con --url se prueba un servidor ya arrancado (gunicorn, uvicorn...), que
+#     tiene que usar la misma base de datos, tener lwa_url apuntando al
+#     --lwa-port de aquí y verify_signature/verify_timestamp a False
+# ==========================================================
+
+# Argumentos
+import argparse
+import os
+import sys
+import types
+
+# Concurrencia
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Tiempo
+import time
+import datetime
+
+# JSON
+import json
+
+# Versión del código
+import subprocess
+
+# Type hinting
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.fixtures import INTENTS, FakeLWA, Scenarios, seed
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(ROOT, "benchmarks", "results.jsonl")
+
+# respuesta de CatchAllExceptionHandler, la contamos como error
+ERROR_TEXT = "No pude hacer lo que has pedido"
+
+
+# ==========================================================
+#      ENTORNO
+# ==========================================================
+
+def load_info():
+    """
+    Configuración de la skill (datos/info.py)
+    > si no existe (no está en el repositorio) usamos una vacía, se rellena en `configure`
+    """
+    try:
+        from datos import info
+    except ImportError:
+        info = types.SimpleNamespace(skill_id="amzn1.ask.skill.benchmark")
+        datos = types.ModuleType("datos")
+        datos.info = info
+        sys.modules["datos"] = datos
+        sys.modules["datos.info"] = info
+    return info
+
+
+def configure(args, lwa_url: str):
+    """
+    Prepara datos.info e importa la skill
+    > sin --mongo-uri, pymongo se sustituye por mongomock antes de importar app
+    """
+
+    info = load_info()
+    info.database_ip = args.mongo_uri or "mongodb://localhost:27017"
+    info.database_name = args.database
+    info.lwa_url = lwa_url
+    info.verify_signature = False
+    info.verify_timestamp = False
+    info.watch_changes = False
+    info.log_file = os.path.join(ROOT, "benchmarks", "benchmark.log")
+    info.log_level = "WARNING"
+
+    if args.mongo_uri is None:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+
+    import app
+    return info, app
+
+
+def git_version() -> Dict[str, object]:
+    """Commit actual y si hay cambios sin guardar"""
+    def git(*command) -> str:
+        try:
+            return subprocess.run(
+                ["git", *command], cwd=ROOT, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD") or None,
+        "cambios": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+# ==========================================================
+#      CLIENTES
+# ==========================================================
+
+class InProcessClient:
+    """Peticiones a invoke_skill con el cliente de pruebas de Flask"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def post(self, body: dict) -> Tuple[int, str]:
+        response = self.app.test_client().post("/", data=json.dumps(body), content_type="application/json")
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HTTPClient:
+    """Peticiones a un servidor ya arrancado, una sesión (conexiones) por hilo"""
+
+    def __init__(self, url: str):
+        import requests
+
+        self.url = url
+        self._requests = requests
+        self._local = threading.local()
+
+    def post(self, body: dict) -> Tuple[int, str]:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.post(self.url, json=body, timeout=30)
+        return response.status_code, response.text
+
+
+# ==========================================================
+#      MEDIDAS
+# ==========================================================
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentil por rango (valores ordenados)"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "peticiones": len(latencies),
+        "errores": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def run_phase(
+    client, scenarios: Scenarios, intents: List[str], tasks: int, concurrency: int,
+) -> Tuple[Dict[str, dict], Dict[str, float]]:
+    """
+    Manda `tasks` tareas (repartidas entre `intents`) con `concurrency` hilos
+    > devuelve el resumen por etiqueta y el de toda la fase
+    > el rps de cada etiqueta es sobre el tiempo de toda la fase
+    """
+
+    plan = [scenarios.task(intents[i % len(intents)]) for i in range(tasks)]
+    results: Dict[str, Tuple[List[float], List[int]]] = {}
+    lock = threading.Lock()
+
+    def execute(task: List[Tuple[str, dict]]) -> None:
+        for label, body in task:
+            start = time.perf_counter()
+            status, text = client.post(body)
+            elapsed = time.perf_counter() - start
+            error = status != 200 or ERROR_TEXT in text
+
+            with lock:
+                latencies, errors = results.setdefault(label, ([], [0]))
+                latencies.append(elapsed)
+                errors[0] += error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(execute, plan))
+    elapsed = time.perf_counter() - start
+
+    per_label = {label: summarize(latencies, errors[0], elapsed) for label, (latencies, errors) in results.items()}
+    total = summarize(
+        [latency for latencies, _ in results.values() for latency in latencies],
+        sum(errors[0] for _, errors in results.values()),
+        elapsed,
+    )
+    return per_label, total
+
+
+# ==========================================================
+#      INFORME
+# ==========================================================
+
+def print_table(results: Dict[str, dict], previous: Optional[Dict[str, dict]] = None) -> None:
+    header = f"{'intent':<28}{'n':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}"
+    if previous:
+        header += f"{'Δp95':>9}{'Δrps':>9}"
+    print(header)
+    print("-" * len(header))
+
+    for label, row in results.items():
+        line = (
+            f"{label:<28}{row['peticiones']:>7}{row['errores']:>5}"
+            f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['rps']:>9.1f}"
+        )
+        before = (previous or {}).get(label)
+        if before:
+            line += f"{_change(row['p95_ms'], before['p95_ms']):>9}{_change(row['rps'], before['rps']):>9}"
+        print(line)
+
+
+def _change(now: float, before: float) -> str:
+    if not before:
+        return "-"
+    return f"{(now - before) / before * 100:+.0f}%"
+
+
+def previous_run(config: dict) -> Optional[dict]:
+    """Último resultado guardado con la misma configuración"""
+    if not os.path.exists(RESULTS_PATH):
+        return None
+
+    last = None
+    with open(RESULTS_PATH, encoding="utf-8") as file:
+        for line in file:
+            entry = json.loads(line)
+            if entry.get("config") == config:
+                last = entry
+    return last
+
+
+def save(entry: dict) -> None:
+    with open(RESULTS_PATH, "a", encoding="utf-8") as file:
+        file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+# ==========================================================
+#      MAIN
+# ==========================================================
+
+def main(args) -> None:
+    lwa = FakeLWA(port=args.lwa_port, latency=args.lwa_latency / 1000).start()
+    print(f"LWA de pruebas en {lwa.url}")
+
+    if args.url:
+        if args.mongo_uri is None:
+            raise SystemExit("Con --url hace falta --mongo-uri, el servidor tiene que ver los mismos datos")
+        from pymongo import MongoClient
+
+        info = load_info()
+        database = MongoClient(args.mongo_uri)[args.database]
+        client = HTTPClient(args.url)
+    else:
+        info, app = configure(args, lwa.url)
+        database = app.database
+        client = InProcessClient(app.app)
+
+    start = time.perf_counter()
+    data = seed(database, scale=args.scale, users=args.users, seed=args.seed)
+    print(f"Base de datos rellenada en {time.perf_counter() - start:.1f}s")
+
+    scenarios = Scenarios(data, info.skill_id, cold=args.cold, seed=args.seed)
+    intents = args.intents or INTENTS
+
+    # una pasada corta para cargar snapshots, índices y conexiones
+    run_phase(client, scenarios, intents, args.warmup, args.concurrency)
+
+    # cada intent por separado y después todos mezclados
+    results: Dict[str, dict] = {}
+    for intent in intents:
+        per_label, _ = run_phase(client, scenarios, [intent], args.requests, args.concurrency)
+        results.update(per_label)
+
+    _, results["mezcla"] = run_phase(client, scenarios, intents, args.requests * 2, args.concurrency)
+
+    config = {
+        "modo": "http" if args.url else "proceso",
+        "mongo": "mongod" if args.mongo_uri else "mongomock",
+        "escala": args.scale,
+        "usuarios": args.users,
+        "peticiones": args.requests,
+        "concurrencia": args.concurrency,
+        "frios": args.cold,
+        "lwa_ms": args.lwa_latency,
+        "intents": intents,
+    }
+    previous = previous_run(config)
+
+    print()
+    print_table(results, previous["resultados"] if previous else None)
+    if previous:
+        print(f"\n(Δ respecto a {previous['commit']} del {previous['fecha']})")
+    print(f"\nConsultas a LWA: {lwa.requests}")
+
+    if not args.no_save:
+        save({
+            **git_version(),
+            "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+            "config": config,
+            "resultados": results,
+        })
+
+    lwa.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de la skill")
+    parser.add_argument("--requests", type=int, default=500, help="peticiones por intent")
+    parser.add_argument("--concurrency", type=int, default=8, help="peticiones a la vez")
+    parser.add_argument("--warmup", type=int, default=100, help="peticiones antes de medir")
+    parser.add_argument("--intents", nargs="*", choices=INTENTS, help="intents a probar (todos por defecto)")
+    parser.add_argument("--scale", type=float, default=1.0, help="tamaño de la base de datos (1 ~ UPCT)")
+    parser.add_argument("--users", type=int, default=5000, help="usuarios registrados")
+    parser.add_argument("--cold", type=float, default=0.05, help="fracción de peticiones con un token nuevo")
+    parser.add_argument("--lwa-latency", type=float, default=0, help="milisegundos de cada consulta a LWA")
+    parser.add_argument("--lwa-port", type=int, default=0, help="puerto del LWA de pruebas (0 = cualquiera)")
+    parser.add_argument("--mongo-uri", help="MongoDB real en vez de mongomock")
+    parser.add_argument("--database", default="benchmark", help="base de datos (se borra)")
+    parser.add_argument("--url", help="probar un servidor ya arrancado en vez de la skill en este proceso")
+    parser.add_argument("--seed", type=int, default=0, help="semilla de los datos y las peticiones")
+    parser.add_argument("--no-save", action="store_true", help="no guardar en benchmarks/results.jsonl")
+    main(parser.parse_args())
@@ -0,0 +1,201 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Tiempo de arranque de la skill, desde la raíz del repositorio:
+#
+#         python -m benchmarks.startup
+#         python -m benchmarks.startup --runs 10 --mongo-uri mongodb://localhost:27017
+#
+#     Cada medida es un proceso nuevo: cuánto tarda `import app`, cuánto
+#     tarda app.warm_up y la latencia de la primera petición de cada intent
+#     (y de la segunda, ya en caliente), con y sin warm_up antes de atenderlas
+#
+#     Con mongomock no hay conexión que abrir, con --mongo-uri se ve también
+#     lo que cuesta conectar con Mongo
+# ==========================================================
+
+# Argumentos
+import argparse
+import os
+import sys
+
+# Tiempo
+import time
+import datetime
+
+# JSON
+import json
+
+# Procesos
+import subprocess
+
+# Type hinting
+from typing import Dict, List
+
+from benchmarks.fixtures import INTENTS, FakeLWA, Scenarios, seed
+from benchmarks.load import ROOT, InProcessClient, configure, git_version, percentile
+
+
+RESULTS_PATH = os.path.join(ROOT, "benchmarks", "startup_results.jsonl")
+
+# los que más cargan en la primera petición: LWA, snapshots e índices de nombres
+DEFAULT_INTENTS = ["SubjectIntent", "TeacherIntent", "DatesIntent", "LaunchRequest"]
+
+
+# ==========================================================
+#      PROCESO HIJO
+# ==========================================================
+
+def child(args) -> None:
+    """Un arranque, escribe las medidas en JSON por la salida estándar"""
+
+    start = time.perf_counter()
+    info, app = configure(args, args.lwa_url)
+    import_time = time.perf_counter() - start
+
+    # los datos se crean antes de medir, con mongomock tiene que ser con el cliente de la skill
+    if args.mongo_uri is None:
+        data = seed(app.database, scale=args.scale, users=args.users, seed=args.seed)
+    else:
+        from pymongo import MongoClient
+
+        client = MongoClient(args.mongo_uri)
+        data = seed(client[args.database], scale=args.scale, users=args.users, seed=args.seed)
+        client.close()
+
+    warm_up_time = None
+    if args.warm:
+        start = time.perf_counter()
+        app.warm_up()
+        warm_up_time = time.perf_counter() - start
+
+    client = InProcessClient(app.app)
+    scenarios = Scenarios(data, info.skill_id, cold=0, seed=args.seed)
+
+    requests: Dict[str, List[float]] = {}
+    for _ in range(2):
+        for intent in args.intents:
+            label, body = scenarios.task(intent)[0]
+            start = time.perf_counter()
+            client.post(body)
+            requests.setdefault(label, []).append(time.perf_counter() - start)
+
+    print(json.dumps({
+        "importar": import_time,
+        "preparar": warm_up_time,
+        "peticiones": requests,
+    }))
+
+
+# ==========================================================
+#      MEDIDAS
+# ==========================================================
+
+def spawn(args, lwa_url: str, warm: bool) -> dict:
+    command = [
+        sys.executable, "-m", "benchmarks.startup", "--child",
+        "--lwa-url", lwa_url,
+        "--scale", str(args.scale),
+        "--users", str(args.users),
+        "--seed", str(args.seed),
+        "--database", args.database,
+        "--intents", *args.intents,
+    ]
+    if args.mongo_uri:
+        command += ["--mongo-uri", args.mongo_uri]
+    if warm:
+        command.append("--warm")
+
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode:
+        raise SystemExit(f"Error en el proceso de prueba:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def median_ms(values: List[float]) -> float:
+    return round(percentile(sorted(values), 50) * 1000, 2)
+
+
+def run(args, lwa_url: str) -> Dict[str, dict]:
+    """
+    Mediana de `runs` arranques con y sin warm_up
+    > "primera" es la latencia de la primera petición del intent, "segunda" la de la siguiente
+    """
+
+    results = {}
+    for warm in (False, True):
+        runs = [spawn(args, lwa_url, warm) for _ in range(args.runs)]
+
+        row = {
+            "importar_ms": median_ms([run["importar"] for run in runs]),
+            "preparar_ms": median_ms([run["preparar"] for run in runs]) if warm else None,
+            "intents": {},
+        }
+        for label in runs[0]["peticiones"]:
+            row["intents"][label] = {
+                "primera_ms": median_ms([run["peticiones"][label][0] for run in runs]),
+                "segunda_ms": median_ms([run["peticiones"][label][1] for run in runs]),
+            }
+        results["con warm_up" if warm else "sin warm_up"] = row
+
+    return results
+
+
+def print_results(results: Dict[str, dict]) -> None:
+    for mode, row in results.items():
+        preparation = "-" if row["preparar_ms"] is None else f"{row['preparar_ms']:.1f} ms"
+        print(f"{mode}: importar {row['importar_ms']:.1f} ms, warm_up {preparation}")
+
+        header = f"    {'intent':<28}{'primera ms':>12}{'segunda ms':>12}"
+        print(header)
+        print("    " + "-" * (len(header) - 4))
+        for label, times in row["intents"].items():
+            print(f"    {label:<28}{times['primera_ms']:>12.2f}{times['segunda_ms']:>12.2f}")
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiempo de arranque de la skill")
+    parser.add_argument("--runs", type=int, default=5, help="arranques por modo")
+    parser.add_argument("--intents", nargs="*", choices=INTENTS, default=DEFAULT_INTENTS, help="intents a medir")
+    parser.add_argument("--scale", type=float, default=1.0, help="tamaño de la base de datos (1 ~ UPCT)")
+    parser.add_argument("--users", type=int, default=100, help="usuarios registrados")
+    parser.add_argument("--lwa-latency", type=float, default=0, help="milisegundos de cada consulta a LWA")
+    parser.add_argument("--mongo-uri", help="MongoDB real en vez de mongomock")
+    parser.add_argument("--database", default="benchmark", help="base de datos (se borra)")
+    parser.add_argument("--seed", type=int, default=0, help="semilla de los datos y las peticiones")
+    parser.add_argument("--no-save", action="store_true", help="no guardar en benchmarks/startup_results.jsonl")
+    # uso interno: cada arranque
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--warm", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--lwa-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        raise SystemExit(0)
+
+    lwa = FakeLWA(latency=args.lwa_latency / 1000).start()
+    results = run(args, lwa.url)
+    lwa.stop()
+
+    print_results(results)
+
+    if not args.no_save:
+        with open(RESULTS_PATH, "a", encoding="utf-8") as file:
+            file.write(json.dumps({
+                **git_version(),
+                "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+                "config": {
+                    "arranques": args.runs,
+                    "mongo": "mongod" if args.mongo_uri else "mongomock",
+                    "escala": args.scale,
+                    "lwa_ms": args.lwa_latency,
+                },
+                "resultados": results,
+            }, ensure_ascii=False) + "\n")
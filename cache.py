@@ -0,0 +1,328 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+
+# Concurrencia
+import threading
+
+# Tiempo
+import time
+
+# Caché compartida entre procesos
+import sqlite3
+
+# Estructuras
+from collections import OrderedDict
+
+# Type hinting
+from typing import Any, Dict, Hashable, Optional, Tuple
+from collections.abc import Callable
+
+
+# ==========================================================
+#      CACHÉ EN MEMORIA
+# ==========================================================
+
+class TTLCache:
+    """
+    Caché LRU con tamaño máximo y caducidad de las entradas
+
+    > Cada entrada guarda (instante de caducidad, valor)
+    > Las caducadas se borran al leerlas, las menos usadas al superar el tamaño
+    > `on_evict(key, value)` se llama cada vez que se saca una entrada
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, on_evict: Optional[Callable] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires < time.monotonic():
+                self._evict(key)
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+            # si nos pasamos de tamaño, sacamos la menos usada
+            while len(self._data) > self.maxsize:
+                self._evict(next(iter(self._data)))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._evict(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._data):
+                self._evict(key)
+
+    def _evict(self, key: Hashable) -> Any:
+        _, value = self._data.pop(key)
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+        return value
+
+
+_MISSING = object()
+
+
+class VersionedCache:
+    """
+    Caché LRU de valores calculados a partir de datos con versión
+
+    > Cada entrada guarda la versión de los datos con la que se calculó, si al
+    leerla la versión es otra se vuelve a calcular (no caducan por tiempo)
+    > La versión se lee antes de calcular: si los datos cambian mientras tanto
+    la entrada nace ya vieja y se recalcula en la siguiente lectura
+    > Los contadores tienen su propio lock: `+= 1` no es atómico entre hilos
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self._data = TTLCache(maxsize, ttl=float("inf"))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, version: Hashable, compute: Callable) -> Any:
+        """Valor de la clave para esa versión, `compute()` solo se llama si no lo tenemos"""
+
+        entry = self._data.get(key)
+        if entry is not None and entry[0] == version:
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+
+        with self._lock:
+            self.misses += 1
+        value = compute()
+        self._data.set(key, (version, value))
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entradas": len(self), "aciertos": self.hits, "fallos": self.misses}
+
+
+class SingleFlight:
+    """
+    Evita que varios hilos hagan a la vez la misma consulta lenta
+
+    > El primero que pide una clave ejecuta la función, el resto espera
+    su resultado (o su excepción)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, "_Call"] = {}
+
+    def do(self, key: Hashable, func: Callable) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            return call.wait()
+
+        try:
+            call.result = func()
+        except BaseException as exception:
+            call.exception = exception
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+        return call.result
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exception: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        self.event.wait()
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+# ==========================================================
+#      CACHÉ COMPARTIDA
+# ==========================================================
+
+class SQLiteTokenStore:
+    """
+    Tabla token -> user_id en un fichero SQLite, para que los distintos
+    procesos del servidor (workers de gunicorn) compartan lo que ya saben
+
+    > Cada hilo usa su propia conexión, sqlite3 no permite compartirlas
+    > Las conexiones se abren al usarlas, nunca al crear el objeto: así el
+    proceso padre de gunicorn no deja conexiones que hereden los workers
+    (además, `reset` las descarta después del fork)
+    """
+
+    def __init__(self, path: str, timeout: float = 1.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            # la tabla se crea con la primera conexión de cada hilo (si no existe ya)
+            with connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS tokens "
+                    "(token TEXT PRIMARY KEY, user_id TEXT NOT NULL, expires REAL NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS tokens_user_id ON tokens (user_id)")
+            self._local.connection = connection
+        return connection
+
+    def reset(self, close: bool = True) -> None:
+        """
+        Descarta las conexiones, se vuelven a abrir al usarlas
+        > solo se puede cerrar la del hilo actual, las de otros hilos se
+        cierran al recogerlas el recolector
+        > después de un fork no hay que cerrarla: es del proceso padre
+        """
+        connection = getattr(self._local, "connection", None)
+        self._local = threading.local()
+        if close and connection is not None:
+            connection.close()
+
+    def get(self, token: str) -> Optional[Tuple[str, float]]:
+        """(user_id, instante de caducidad) del token, None si no está o ha caducado"""
+        row = self._connection().execute(
+            "SELECT user_id, expires FROM tokens WHERE token = ? AND expires > ?", (token, time.time())
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, token: str, user_id: str, ttl: float) -> None:
+        with self._connection() as connection:
+            # el usuario solo tiene un token válido, borramos los anteriores y los caducados
+            connection.execute(
+                "DELETE FROM tokens WHERE (user_id = ? AND token != ?) OR expires <= ?",
+                (user_id, token, time.time()),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)", (token, user_id, time.time() + ttl)
+            )
+
+
+class TokenCache:
+    """
+    Caché token -> user_id para evitar hacer peticiones extra a LWA
+
+    > Tamaño máximo y caducidad, los tokens de LWA duran una hora
+    > Índice inverso user_id -> token: cuando un usuario llega con un token
+    nuevo borramos el anterior sin recorrer toda la caché
+    > Si varios hilos piden a la vez el mismo token, solo uno consulta LWA
+    > Opcionalmente se apoya en un `SQLiteTokenStore` compartido entre procesos
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 3600, store: Optional[SQLiteTokenStore] = None):
+        self.ttl = ttl
+        self.store = store
+
+        self._tokens = TTLCache(maxsize, ttl, on_evict=self._forget)
+        self._users: Dict[str, str] = {}
+        self._flight = SingleFlight()
+
+    def _forget(self, token: str, user_id: str) -> None:
+        # al salir un token de la caché, limpiamos el índice inverso
+        if self._users.get(user_id) == token:
+            del self._users[user_id]
+
+    def get(self, token: str, lookup: Callable) -> str:
+        """user_id del token, `lookup(token)` solo se llama si no lo conocemos"""
+
+        user_id = self._tokens.get(token)
+        if user_id is None:
+            user_id = self._flight.do(token, lambda: self._resolve(token, lookup))
+        return user_id
+
+    def _resolve(self, token: str, lookup: Callable) -> str:
+        user_id = self.peek(token)
+
+        if user_id is None:
+            user_id = lookup(token)
+            self.remember(token, user_id)
+
+        return user_id
+
+    def cached(self, token: str) -> Optional[str]:
+        """user_id del token si lo tiene este proceso, sin I/O"""
+        return self._tokens.get(token)
+
+    def peek(self, token: str) -> Optional[str]:
+        """user_id del token si ya lo conocemos (este proceso o el almacén compartido), sin consultar LWA"""
+
+        user_id = self._tokens.get(token)
+        if user_id is None and self.store is not None:
+            stored = self.store.get(token)
+            if stored is not None:
+                # solo lo que le queda en el almacén, no un `ttl` nuevo
+                user_id, expires = stored
+                self.set(token, user_id, expires - time.time())
+
+        return user_id
+
+    def remember(self, token: str, user_id: str) -> None:
+        """Guarda un user_id obtenido de LWA, también en el almacén compartido"""
+        if self.store is not None:
+            self.store.set(token, user_id, self.ttl)
+        self.set(token, user_id)
+
+    def set(self, token: str, user_id: str, ttl: Optional[float] = None) -> None:
+        with self._tokens._lock:
+            # si teníamos el usuario con otro token, borramos esa entrada
+            old = self._users.get(user_id)
+            if old is not None and old != token:
+                self._tokens.pop(old)
+
+            self._tokens.set(token, user_id, ttl)
+            self._users[user_id] = token
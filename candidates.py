@@ -0,0 +1,263 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+
+# Concurrencia
+import threading
+
+# Debug
+import logging
+
+# Estructuras
+from collections import OrderedDict
+
+# MongoDB
+from pymongo import ASCENDING, TEXT, UpdateOne
+from pymongo.errors import OperationFailure
+
+# Type hinting
+from typing import Iterable, List, Optional
+
+# Parecido string
+import matching
+
+
+# campo con las palabras normalizadas del nombre (ver matching.tokens)
+TOKENS_FIELD = "nombre_tokens"
+# nombre del que salen esas palabras, si ya no coincide (se ha renombrado) se recalculan
+TOKENS_SOURCE = "nombre_tokens_origen"
+
+
+# ==========================================================
+#      ÍNDICES DE MONGODB
+# ==========================================================
+
+def token_fields(name: str) -> dict:
+    """Campos con las palabras del nombre, para guardarlos en el documento"""
+    return {TOKENS_FIELD: matching.tokens(name), TOKENS_SOURCE: name}
+
+
+def fill_tokens(collection, field: str = "nombre", batch_size: int = 1000) -> int:
+    """
+    Calcula las palabras normalizadas de los documentos que no las tienen o que
+    han cambiado de nombre desde que se calcularon
+    > devuelve cuántos se han actualizado
+    """
+
+    stale = {"$or": [
+        {TOKENS_SOURCE: {"$exists": False}},
+        {"$expr": {"$ne": [f"${TOKENS_SOURCE}", f"${field}"]}},
+    ]}
+
+    updated = 0
+    batch = []
+    for document in collection.find(stale, {field: True}):
+        if not isinstance(document.get(field), str):
+            continue
+
+        batch.append(UpdateOne({"_id": document["_id"]}, {"$set": token_fields(document[field])}))
+        if len(batch) >= batch_size:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+
+    return updated
+
+
+def refresh_tokens(collection, document: Optional[dict], field: str = "nombre") -> bool:
+    """
+    Recalcula las palabras de un documento que acaba de cambiar, si su nombre
+    ya no es del que salieron (ver watcher.ChangeWatcher `on_document`)
+    > devuelve si se ha actualizado
+    """
+    if document is None or not isinstance(document.get(field), str):
+        return False
+    if document.get(TOKENS_SOURCE) == document[field]:
+        return False
+
+    collection.update_one({"_id": document["_id"]}, {"$set": token_fields(document[field])})
+    return True
+
+
+def ensure_indexes(database, collections: Iterable[str] = ("asignaturas",), field: str = "nombre") -> bool:
+    """
+    Prepara las colecciones para buscar candidatos en el servidor
+
+    > `_id.id_estudios` + palabras: las asignaturas siempre se filtran por titulación
+    > índice de texto en español sobre el nombre (sin tildes y con raíces)
+    > rellena el campo de palabras de los documentos que no lo tengan (o renombrados)
+
+    Devuelve False si no se han podido crear (p.ej. sin permisos), en ese caso
+    hay que seguir buscando en memoria
+    """
+
+    try:
+        for name in collections:
+            collection = database[name]
+            filled = fill_tokens(collection, field)
+
+            collection.create_index([("_id.id_estudios", ASCENDING), (TOKENS_FIELD, ASCENDING)], name="estudios_tokens")
+            collection.create_index([(TOKENS_FIELD, ASCENDING)], name="tokens")
+            collection.create_index([(field, TEXT)], name=f"{field}_texto", default_language="spanish")
+
+            # comprobamos que están, create_index no falla si ya existían con otras opciones
+            existing = {index["name"] for index in collection.list_indexes()}
+            missing = {"estudios_tokens", "tokens", f"{field}_texto"} - existing
+            if missing:
+                logging.warning(f"Faltan índices en {name}: {', '.join(sorted(missing))}")
+                return False
+
+            logging.info(f"Índices de búsqueda listos en {name} ({filled} documentos actualizados)")
+
+    except OperationFailure:
+        logging.warning("No se pudieron crear los índices de búsqueda, se busca en memoria", exc_info=True)
+        return False
+
+    return True
+
+
+# ==========================================================
+#      ÍNDICE
+# ==========================================================
+
+class CandidateIndex:
+    """
+    Misma interfaz que `matching.NameIndex`, pero sin tener la colección en memoria
+
+    > Mongo devuelve como mucho `limit` candidatos: los que tienen todas las
+    palabras de la entrada si no son más de `limit`, si no los mejores según el
+    índice de texto y, si tampoco hay, los que tienen más palabras en común
+    > Los candidatos se puntúan en local igual que en `NameIndex`
+    > Si Mongo no encuentra nada (todas las palabras con erratas) o falla, se
+    usa `fallback`, el índice en memoria de siempre, que solo se carga entonces
+    > Solo lee: las palabras de los documentos que cambian las recalcula quien
+    los cambia (el importador, o la app al recibir el cambio, ver `refresh_tokens`)
+    > Guarda la base de datos y el nombre de la colección, no la colección: el
+    cliente puede cambiar (p.ej. uno por proceso después de un fork, ver utils.Lazy)
+    """
+
+    def __init__(
+        self,
+        database,
+        collection: str,
+        field: str,
+        filtering: dict,
+        fallback: matching.NameIndex,
+        limit: int = 30,
+        memo_size: int = 1024,
+        normalize: bool = True,
+    ):
+        self.database = database
+        self.name = collection
+        self.field = field
+        self.filtering = filtering
+        self.fallback = fallback
+        self.limit = limit
+        self.memo_size = memo_size
+        # igual que el índice en memoria (ver matching.NameIndex)
+        self.normalize = normalize
+
+        self._lock = threading.Lock()
+        self._memo: OrderedDict = OrderedDict()
+        # sin índice de texto (o si Mongo no lo soporta) solo buscamos por palabras
+        self._text = True
+
+    @property
+    def collection(self):
+        return self.database[self.name]
+
+    def refresh(self) -> None:
+        self.invalidate()
+        self.fallback.refresh()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._memo = OrderedDict()
+        self.fallback.invalidate()
+
+    def best_match(self, input_str: str) -> str:
+        """Nombre más parecido a la cadena recibida"""
+
+        with self._lock:
+            memo = self._memo
+            if input_str in memo:
+                memo.move_to_end(input_str)
+                return memo[input_str]
+
+        names = self.candidates(input_str)
+        if names:
+            # mismo orden de preferencia que en memoria, pero solo entre los candidatos
+            result = matching.NameIndex(lambda: names, memo_size=0, normalize=self.normalize).resolve(input_str)
+        else:
+            result = self.fallback.best_match(input_str)
+
+        with self._lock:
+            # si se ha invalidado mientras buscábamos, no guardamos el resultado
+            if memo is self._memo:
+                memo[input_str] = result
+                if len(memo) > self.memo_size:
+                    memo.popitem(last=False)
+
+        return result
+
+    def candidates(self, input_str: str) -> List[str]:
+        """Nombres que pueden ser el buscado (vacío si Mongo no encuentra ninguno)"""
+
+        words = matching.tokens(input_str)
+        if not words:
+            return []
+
+        projection = {self.field: True, "_id": False}
+        try:
+            # con una palabra muy común ("fundamentos") serían demasiados, mejor ordenados por relevancia
+            names = self._names(
+                self.collection.find({**self.filtering, TOKENS_FIELD: {"$all": words}}, projection),
+                self.limit + 1,
+            )
+            if len(names) > self.limit:
+                names = []
+            if not names and self._text:
+                names = self._text_search(words)
+            if not names:
+                names = self._shared_words(words)
+        except OperationFailure:
+            logging.warning("Error buscando candidatos en Mongo, se busca en memoria", exc_info=True)
+            return []
+
+        return names
+
+    def _text_search(self, words: List[str]) -> List[str]:
+        try:
+            cursor = self.collection.find(
+                {**self.filtering, "$text": {"$search": " ".join(words)}},
+                {self.field: True, "_id": False, "score": {"$meta": "textScore"}},
+            ).sort([("score", {"$meta": "textScore"})])
+            return self._names(cursor)
+        except (OperationFailure, NotImplementedError):
+            # sin índice de texto no lo volvemos a intentar
+            logging.warning("Búsqueda de texto no disponible, solo se busca por palabras", exc_info=True)
+            self._text = False
+            return []
+
+    def _shared_words(self, words: List[str]) -> List[str]:
+        """Los `limit` nombres con más palabras de la entrada (el índice de palabras elige los que tienen alguna)"""
+        cursor = self.collection.aggregate([
+            {"$match": {**self.filtering, TOKENS_FIELD: {"$in": words}}},
+            {"$project": {
+                "_id": False,
+                self.field: True,
+                "compartidas": {"$size": {"$filter": {"input": f"${TOKENS_FIELD}", "cond": {"$in": ["$$this", words]}}}},
+            }},
+            {"$sort": {"compartidas": -1, self.field: 1}},
+            {"$limit": self.limit},
+        ])
+        return [document[self.field] for document in cursor if self.field in document]
+
+    def _names(self, cursor, limit: Optional[int] = None) -> List[str]:
+        return [document[self.field] for document in cursor.limit(limit or self.limit) if self.field in document]
@@ -0,0 +1,117 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Servir la skill con varios procesos, desde la raíz del repositorio:
+#
+#         gunicorn                                      # Flask (app:app)
+#         gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+#
+#     gunicorn lee este archivo solo, las opciones salen de datos/info.py
+#
+#     Con preload_app (por defecto) el proceso padre importa la skill, carga
+#     los snapshots y los índices de nombres una vez y después crea los
+#     workers con fork: todos comparten esas estructuras (copy-on-write) en
+#     vez de tener cada uno su copia. Cada worker abre sus propias conexiones
+#     y su hilo de logs y del watcher, que no pasan de un proceso a otro
+#
+#     Recarga sin cortar peticiones: `kill -HUP <pid del padre>` crea workers
+#     nuevos y para los viejos cuando terminan lo que estén atendiendo (como
+#     mucho graceful_timeout segundos). Con preload_app los workers nuevos
+#     salen del padre, así que un cambio de código necesita reiniciar el padre
+#     (o `kill -USR2` para arrancar otro padre junto al viejo)
+# ==========================================================
+
+# Recolector de basura
+import gc
+
+# Número de núcleos
+import os
+
+# Información
+from datos import info
+
+
+# ==========================================================
+#      OPCIONES
+# ==========================================================
+
+wsgi_app = getattr(info, "server_app", "app:app")
+bind = getattr(info, "server_bind", "0.0.0.0:8000")
+
+# un proceso por núcleo, y en cada uno varios hilos para las esperas de red (LWA, Mongo)
+workers = getattr(info, "server_workers", os.cpu_count() or 1)
+threads = getattr(info, "server_threads", 8)
+worker_class = getattr(info, "server_worker_class", "gthread")
+
+# Alexa espera como mucho 8 segundos por respuesta
+timeout = getattr(info, "server_timeout", 30)
+graceful_timeout = getattr(info, "server_graceful_timeout", 30)
+keepalive = getattr(info, "server_keepalive", 5)
+
+# reiniciar cada worker tras N peticiones (0 = nunca), el jitter evita que lo hagan todos a la vez
+max_requests = getattr(info, "server_max_requests", 0)
+max_requests_jitter = getattr(info, "server_max_requests_jitter", 0)
+
+preload_app = getattr(info, "preload_app", True)
+
+# la skill tiene que saber que no debe arrancar hilos al importarse (ver app.prefork)
+info.prefork = preload_app
+
+
+# ==========================================================
+#      HOOKS
+# ==========================================================
+
+def on_starting(server):
+    """
+    Proceso padre, con la skill ya importada: carga los datos que heredarán los workers
+    > las conexiones se cierran, cada worker abre las suyas
+    > gc.freeze saca los objetos cargados del recolector: si no, cada pasada
+    del recolector en un worker los tocaría y dejarían de estar compartidos
+    """
+    if not preload_app:
+        return
+
+    import app
+
+    app.warm_up()
+    app.reset_connections()
+
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Worker recién creado: clientes y logs propios
+    > los clientes del padre no se cierran desde aquí, son suyos
+    """
+    if not preload_app:
+        return
+
+    import app
+
+    app.reset_connections(close=False)
+    app.setup_logging()
+
+
+def post_worker_init(worker):
+    """
+    Worker listo para atender peticiones: hilos, señales y conexiones
+    > gunicorn quita los handlers de señales al crear el worker, aquí se vuelve
+    a instalar SIGHUP para recargar los datos de este worker
+    > sin preload_app cada worker carga sus datos
+    """
+    import app
+
+    if preload_app:
+        app.start_process()
+
+    # con el worker de uvicorn lo hace asgi.py al arrancar
+    if "uvicorn" not in worker_class:
+        app.warm_up(data=not preload_app)
@@ -0,0 +1,287 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Genera las imágenes de los horarios (las que enseña ScheduleIntentHandler)
+#     a partir de la colección `horarios` y las sube a S3:
+#
+#         python horarios.py                              # todos los cursos
+#         python horarios.py --estudios 5071 --workers 4
+#         python horarios.py --endpoint-url http://localhost:5000 --bucket pruebas
+#
+#     Un documento por titulación y curso:
+#
+#         {"_id": {"id_estudios": "5071", "curso": 1},
+#          "clases": [{"dia": "Lunes", "inicio": "9:00", "fin": "11:00",
+#                      "asignatura": "Cálculo", "aula": "A-101"}, ...]}
+#
+#     > Las imágenes se dibujan en un pool de procesos (ver images.render_schedule),
+#     una por núcleo, y se suben en un pool de hilos
+#     > El manifiesto (imagenes/horarios/manifest.json) guarda el hash de los
+#     datos de cada horario y el de la imagen subida: si los datos no han
+#     cambiado no se vuelve a dibujar, y si la imagen es igual que la de S3
+#     no se sube. Sin manifiesto se compara con el ETag de S3 (md5)
+#     > `--endpoint-url` (o info.s3_endpoint_url) apunta a cualquier servicio
+#     compatible con S3, p.ej. para probar en local con MinIO o moto_server
+# ==========================================================
+
+# Argumentos
+import argparse
+import os
+
+# Hashes y manifiesto
+import hashlib
+import json
+
+# Tiempo
+import time
+
+# Concurrencia
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+# Información
+from datos import info
+
+# MongoDB
+from pymongo import MongoClient
+
+# S3
+import boto3
+from botocore.exceptions import ClientError
+
+# Type hinting
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Dibujo de los horarios
+import images
+
+
+# subcarpeta /imagenes/horarios/ junto al script
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'imagenes', 'horarios')
+
+# los nombres de los días, sin tildes ni mayúsculas, como vienen a veces en los datos
+DAY_NAMES = {
+    day.lower().translate(str.maketrans("áéíóú", "aeiou")): day for day in images.DAYS
+}
+
+
+# ==========================================================
+#      DATOS
+# ==========================================================
+
+def object_key(studying: str, year) -> str:
+    """Nombre del archivo en s3, el mismo que usa ScheduleIntentHandler"""
+    return f"{studying}-{year}.png"
+
+
+def clean(classes: list) -> Tuple[List[dict], int]:
+    """
+    Clases que se pueden dibujar, ordenadas (para que el hash no dependa del orden)
+    > devuelve también cuántas se han descartado
+    """
+
+    valid = []
+    for item in classes:
+        day = DAY_NAMES.get(str(item.get("dia", "")).strip().lower().translate(str.maketrans("áéíóú", "aeiou")))
+        try:
+            start, end = images.minutes(item["inicio"]), images.minutes(item["fin"])
+        except (KeyError, ValueError):
+            continue
+        if day is None or not item.get("asignatura") or start >= end:
+            continue
+
+        valid.append({
+            "dia": day,
+            "inicio": str(item["inicio"]),
+            "fin": str(item["fin"]),
+            "asignatura": str(item["asignatura"]),
+            "aula": str(item.get("aula", "")),
+        })
+
+    valid.sort(key=lambda item: (images.DAYS.index(item["dia"]), images.minutes(item["inicio"]), item["asignatura"]))
+    return valid, len(classes) - len(valid)
+
+
+def read_schedules(database, studies: Optional[List[str]] = None) -> Iterator[Tuple[str, object, str, List[dict], int]]:
+    """(titulación, curso, título, clases, descartadas) de cada documento de `horarios`"""
+
+    names = {document["_id"]: document.get("nombre") for document in database.estudios.find({}, {"nombre": True})}
+    query = {"_id.id_estudios": {"$in": studies}} if studies else {}
+
+    for document in database.horarios.find(query).sort("_id", 1):
+        studying, year = document["_id"]["id_estudios"], document["_id"]["curso"]
+        title = f"{names.get(studying) or studying} - {year}º curso"
+        classes, discarded = clean(document.get("clases") or [])
+        yield studying, year, title, classes, discarded
+
+
+def data_hash(title: str, classes: List[dict]) -> str:
+    """Hash de lo que se dibuja, si no cambia la imagen tampoco"""
+    payload = json.dumps({"titulo": title, "clases": classes}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def file_md5(file_path: str) -> str:
+    """md5 del archivo, el ETag que pone S3 a los objetos subidos con put_object"""
+    with open(file_path, 'rb') as data:
+        return hashlib.md5(data.read()).hexdigest()
+
+
+class Manifest:
+    """
+    clave de s3 -> {"datos": hash de los datos, "md5": md5 de la imagen subida}
+    > JSON junto a las imágenes, se guarda al final de cada ejecución
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as file:
+                self.entries: Dict[str, dict] = json.load(file)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def get(self, key: str) -> dict:
+        return self.entries.setdefault(key, {})
+
+    def save(self) -> None:
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+# ==========================================================
+#      S3
+# ==========================================================
+
+def new_client(endpoint_url: Optional[str] = None):
+    """Cliente de s3, o de otro servicio compatible si hay `endpoint_url`"""
+    return boto3.client('s3', endpoint_url=endpoint_url) if endpoint_url else boto3.client('s3')
+
+
+def uploaded_etag(s3, bucket: str, key: str) -> Optional[str]:
+    """ETag del objeto que hay en s3 (None si no existe)"""
+    try:
+        response = s3.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        return None
+    return response['ETag'].strip('"')
+
+
+def upload(s3, bucket: str, key: str, file_path: str, md5: str, entry: dict, force: bool = False) -> str:
+    """Sube la imagen si es distinta a la de s3 (o con `force`), devuelve "subidas" o "iguales" """
+
+    if not force:
+        # sin manifiesto (o sin subir nunca) preguntamos a s3
+        if entry.get('md5') is None:
+            entry['md5'] = uploaded_etag(s3, bucket, key)
+        if entry['md5'] == md5:
+            return "iguales"
+
+    with open(file_path, 'rb') as data:
+        s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType='image/png')
+    entry['md5'] = md5
+    return "subidas"
+
+
+# ==========================================================
+#      MAIN
+# ==========================================================
+
+def main(
+    studies: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    uploaders: int = 8,
+    output_dir: str = OUTPUT_DIR,
+    endpoint_url: Optional[str] = None,
+    bucket: Optional[str] = None,
+    upload_images: bool = True,
+    force: bool = False,
+) -> Dict[str, int]:
+    """
+    Dibuja los horarios que han cambiado y sube los que son distintos a los de s3
+    > con `force` se dibujan y se suben todos
+    > devuelve cuántos hay de cada caso
+    """
+
+    database = MongoClient(info.database_ip)[info.database_name]
+    bucket = bucket or info.s3_bucket_name
+    s3 = new_client(endpoint_url) if upload_images else None
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(output_dir, 'manifest.json'))
+
+    counts = {"dibujadas": 0, "sin cambios": 0, "subidas": 0, "iguales": 0, "clases descartadas": 0, "errores": 0}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as renderer, ThreadPoolExecutor(max_workers=uploaders) as uploads:
+        rendering, uploading = {}, {}
+
+        def submit_upload(key: str, file_path: str) -> None:
+            if s3 is not None:
+                md5 = file_md5(file_path)
+                uploading[uploads.submit(upload, s3, bucket, key, file_path, md5, manifest.get(key), force)] = key
+
+        for studying, year, title, classes, discarded in read_schedules(database, studies):
+            key = object_key(studying, year)
+            file_path = os.path.join(output_dir, key)
+            digest = data_hash(title, classes)
+            counts["clases descartadas"] += discarded
+
+            entry = manifest.get(key)
+            if not force and entry.get('datos') == digest and os.path.exists(file_path):
+                counts["sin cambios"] += 1
+                submit_upload(key, file_path)
+                continue
+
+            rendering[renderer.submit(images.render_schedule, title, classes, file_path)] = (key, file_path, digest)
+
+        for future in as_completed(rendering):
+            key, file_path, digest = rendering[future]
+            try:
+                future.result()
+            except Exception as exception:
+                counts["errores"] += 1
+                print(f"{key}: no se pudo dibujar ({exception})")
+                continue
+
+            counts["dibujadas"] += 1
+            manifest.get(key)['datos'] = digest
+            submit_upload(key, file_path)
+
+        for future in as_completed(uploading):
+            try:
+                counts[future.result()] += 1
+            except Exception as exception:
+                counts["errores"] += 1
+                print(f"{uploading[future]}: no se pudo subir ({exception})")
+
+    manifest.save()
+
+    elapsed = time.perf_counter() - start
+    print(", ".join(f"{key}: {value}" for key, value in counts.items()) + f" -- {elapsed:.2f}s")
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Imágenes de los horarios de la base de datos")
+    parser.add_argument("--estudios", nargs="*", help="solo estas titulaciones (por defecto todas)")
+    parser.add_argument("--workers", type=int, default=None, help="procesos que dibujan (por defecto uno por núcleo)")
+    parser.add_argument("--uploaders", type=int, default=8, help="subidas a S3 en paralelo")
+    parser.add_argument("--output", default=OUTPUT_DIR, help="carpeta de las imágenes")
+    parser.add_argument("--endpoint-url", default=getattr(info, "s3_endpoint_url", None),
+                        help="servicio compatible con S3 (MinIO, moto_server...)")
+    parser.add_argument("--bucket", default=None, help="bucket (por defecto info.s3_bucket_name)")
+    parser.add_argument("--no-upload", action="store_true", help="solo dibujar, sin subir nada")
+    parser.add_argument("--force", action="store_true", help="dibujar y subir todos aunque no hayan cambiado")
+    args = parser.parse_args()
+
+    main(
+        args.estudios, args.workers, args.uploaders, args.output,
+        args.endpoint_url, args.bucket, not args.no_upload, args.force,
+    )
@@ -0,0 +1,141 @@
+import os
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+# tamaños recomendados para las imágenes de las Card de Alexa
+# https://developer.amazon.com/docs/custom-skills/include-a-card-in-your-skills-response.html
+VARIANTS = {
+    "small": (720, 480),
+    "large": (1200, 800),
+}
+
+
+def variant_path(file_path: str, variant: str) -> str:
+    """imagenes/xxx.png -> imagenes/xxx_small.png"""
+    root, extension = os.path.splitext(file_path)
+    return f"{root}_{variant}{extension}"
+
+
+def optimize(file_path: str) -> dict:
+    """
+    Genera las variantes de la imagen para las Card (ver VARIANTS)
+
+    > Recortamos por arriba: en una captura de una web lo importante está al principio
+    > Reducimos a 256 colores, las capturas son casi todo texto y fondo liso, así
+    el PNG ocupa mucho menos y se sigue leyendo igual
+
+    *Se ejecuta en un pool de procesos, por eso está en un módulo aparte y no
+    importa nada de la skill ni de la base de datos*
+
+    Devuelve {variante: ruta} y los tamaños en bytes para saber cuánto ahorramos
+    """
+
+    result = {"original": os.path.getsize(file_path), "paths": {}, "bytes": {}}
+
+    with Image.open(file_path) as image:
+        image = image.convert("RGB")
+
+        for variant, size in VARIANTS.items():
+            path = variant_path(file_path, variant)
+            resized = ImageOps.fit(image, size, method=Image.LANCZOS, centering=(0.5, 0.0))
+            resized.quantize(colors=256, method=Image.Quantize.MEDIANCUT).save(path, optimize=True)
+
+            result["paths"][variant] = path
+            result["bytes"][variant] = os.path.getsize(path)
+
+    return result
+
+
+# ==========================================================
+#      HORARIOS
+# ==========================================================
+
+DAYS = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes"]
+
+# colores de las clases, cada asignatura siempre con el mismo
+PALETTE = ["#cfe2f3", "#d9ead3", "#fff2cc", "#f4cccc", "#d9d2e9", "#fce5cd", "#d0e0e3", "#ead1dc"]
+
+
+def font(size: int):
+    """DejaVu si está instalada, si no la que trae Pillow"""
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def minutes(hour: str) -> int:
+    """"9:30" -> 570"""
+    hours, _, mins = str(hour).partition(":")
+    return int(hours) * 60 + int(mins or 0)
+
+
+def fit_text(draw, text: str, width: int, text_font) -> str:
+    """Recorta el texto con "..." para que quepa en `width` píxeles"""
+    if draw.textlength(text, font=text_font) <= width:
+        return text
+    while text and draw.textlength(text + "...", font=text_font) > width:
+        text = text[:-1]
+    return text + "..."
+
+
+def render_schedule(title: str, classes: list, file_path: str) -> dict:
+    """
+    Dibuja el horario semanal de un curso y lo guarda en PNG
+
+    > Una columna por día y las horas de la primera a la última clase, cada
+    clase es un rectángulo con la asignatura y el aula
+    > Mismo tamaño y 256 colores, como la variante "large" de las capturas
+    > Con los mismos datos el PNG sale igual byte a byte, así el que lo sube
+    puede comparar hashes
+
+    *Se ejecuta en un pool de procesos (ver horarios.py)*
+
+    Devuelve la ruta y el tamaño en bytes
+    """
+
+    width, height = VARIANTS["large"]
+    margin, header, hours_width = 24, 90, 70
+
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    title_font, day_font, text_font = font(30), font(20), font(16)
+
+    draw.text((margin, margin), fit_text(draw, title, width - 2 * margin, title_font), fill="black", font=title_font)
+
+    # rejilla
+    start = min((minutes(item["inicio"]) for item in classes), default=8 * 60) // 60 * 60
+    end = -(-max((minutes(item["fin"]) for item in classes), default=14 * 60) // 60) * 60
+    left, top, bottom = margin + hours_width, header + 30, height - margin
+    column = (width - margin - left) / len(DAYS)
+    scale = (bottom - top) / max(end - start, 60)
+
+    for index, day in enumerate(DAYS):
+        x = left + index * column
+        draw.text((x + column / 2, header + 15), day, fill="black", font=day_font, anchor="mm")
+        draw.line([(x, header), (x, bottom)], fill="#999999")
+    draw.line([(width - margin, header), (width - margin, bottom)], fill="#999999")
+
+    for hour in range(start, end + 1, 60):
+        y = top + (hour - start) * scale
+        draw.line([(left, y), (width - margin, y)], fill="#dddddd")
+        draw.text((left - 10, y), f"{hour // 60}:00", fill="#555555", font=text_font, anchor="rm")
+
+    # clases
+    subjects = sorted({item["asignatura"] for item in classes})
+    for item in classes:
+        day = DAYS.index(item["dia"])
+        x0, x1 = left + day * column + 3, left + (day + 1) * column - 3
+        y0, y1 = top + (minutes(item["inicio"]) - start) * scale + 2, top + (minutes(item["fin"]) - start) * scale - 2
+
+        color = PALETTE[subjects.index(item["asignatura"]) % len(PALETTE)]
+        draw.rectangle([x0, y0, x1, y1], fill=color, outline="#666666")
+
+        lines = [item["asignatura"], item.get("aula", ""), f"{item['inicio']} - {item['fin']}"]
+        y = y0 + 6
+        for line in lines:
+            if line and y + 18 <= y1:
+                draw.text((x0 + 6, y), fit_text(draw, line, x1 - x0 - 12, text_font), fill="black", font=text_font)
+                y += 20
+
+    image.quantize(colors=256, method=Image.Quantize.MEDIANCUT).save(file_path, optimize=True)
+    return {"path": file_path, "bytes": os.path.getsize(file_path)}
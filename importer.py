@@ -0,0 +1,348 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Carga los catálogos académicos en MongoDB:
+#
+#         python importer.py exportacion/                 # todos los archivos de la carpeta
+#         python importer.py asignaturas.csv profesores.jsonl --batch-size 5000
+#
+#     El nombre del archivo dice la colección (asignaturas.csv -> asignaturas),
+#     se aceptan CSV, JSON (lista de documentos) y JSON lines. Columnas:
+#
+#         secretarias   _id, y una columna por forma de contacto (email, telefono...)
+#         profesores    _id (email), nombre
+#         estudios      _id, nombre, escuela
+#         asignaturas   id_estudios, codigo, nombre, guia_docente, responsable (email)
+#         fechas        _id (titulación), y una columna por tipo de fecha
+#         usuarios      _id, estudios
+#
+#     > Los documentos se escriben por lotes con upserts (bulk_write sin
+#     orden), así se puede volver a importar la misma exportación
+#     > Las referencias se comprueban antes de escribir: las filas que apuntan
+#     a un profesor, titulación o escuela que no existe se descartan (o con
+#     --strict se para la importación)
+#     > Crea los índices que usan los handlers y pone la fecha de modificación
+#     (ver watcher.py) a los documentos que cambian, así los procesos de la
+#     skill ven los cambios y una importación repetida no invalida nada
+# ==========================================================
+
+# Argumentos
+import argparse
+import os
+
+# Lectura de archivos
+import csv
+import json
+
+# Tiempo
+import time
+import datetime
+
+# Información
+from datos import info
+
+# MongoDB
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Type hinting
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from collections.abc import Callable
+
+# Palabras normalizadas de los nombres de asignatura
+import candidates
+
+
+# orden de importación: cada colección solo apunta a las anteriores
+ORDER = ["secretarias", "profesores", "estudios", "asignaturas", "fechas", "usuarios"]
+
+# campos obligatorios (además del _id)
+REQUIRED = {
+    "profesores": ("nombre",),
+    "estudios": ("nombre", "escuela"),
+    "asignaturas": ("nombre",),
+    "usuarios": ("estudios",),
+}
+
+# colección -> [(función que saca la referencia del documento, colección a la que apunta)]
+REFERENCES: Dict[str, List[Tuple[Callable, str]]] = {
+    "estudios": [(lambda document: document.get("escuela"), "secretarias")],
+    "asignaturas": [
+        (lambda document: document["_id"]["id_estudios"], "estudios"),
+        (lambda document: document.get("responsable"), "profesores"),
+    ],
+    "fechas": [(lambda document: document["_id"], "estudios")],
+    "usuarios": [(lambda document: document.get("estudios"), "estudios")],
+}
+
+# índices de las consultas de los handlers y de la skill (el de _id ya existe)
+INDEXES = {
+    # find() de asignaturas filtra por titulación
+    "asignaturas": [[("_id.id_estudios", ASCENDING)]],
+    # registro: estudios de una escuela, y el id a partir del nombre
+    "estudios": [[("escuela", ASCENDING)], [("nombre", ASCENDING)]],
+}
+
+EXTENSIONS = (".csv", ".json", ".jsonl")
+
+
+# ==========================================================
+#      LECTURA
+# ==========================================================
+
+def read(path: str) -> Iterator[dict]:
+    """Filas del archivo, una a una (salvo JSON, que es una lista)"""
+
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        if extension == ".csv":
+            yield from csv.DictReader(file)
+        elif extension == ".jsonl":
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        elif extension == ".json":
+            yield from json.load(file)
+        else:
+            raise ValueError(f"Formato no soportado: {path}")
+
+
+def to_document(collection: str, row: dict) -> dict:
+    """
+    Documento de Mongo a partir de una fila
+    > las celdas vacías del CSV no se guardan
+    > en asignaturas el _id es {id_estudios, codigo}, y se añaden las palabras del nombre
+    """
+
+    document = {key: value.strip() if isinstance(value, str) else value for key, value in row.items()}
+    document = {key: value for key, value in document.items() if key and value not in ("", None)}
+
+    if collection == "asignaturas" and "_id" not in document:
+        code = document.pop("codigo", None)
+        if isinstance(code, str) and code.isdigit():
+            code = int(code)
+        document["_id"] = {"id_estudios": document.pop("id_estudios", None), "codigo": code}
+
+    if collection == "asignaturas" and isinstance(document.get("nombre"), str):
+        document.update(candidates.token_fields(document["nombre"]))
+
+    return document
+
+
+def problem(collection: str, document: dict, known: Dict[str, Set[Any]]) -> Optional[str]:
+    """Por qué no se puede importar el documento (None si se puede)"""
+
+    _id = document.get("_id")
+    if _id is None or (isinstance(_id, dict) and None in _id.values()):
+        return "sin _id"
+
+    for field in REQUIRED.get(collection, ()):
+        if field not in document:
+            return f"sin {field}"
+
+    for reference, target in REFERENCES.get(collection, ()):
+        try:
+            value = reference(document)
+        except (KeyError, TypeError):
+            # p.ej. una asignatura con un _id que no es {id_estudios, codigo}
+            return f"referencia a {target} no válida"
+        if value is not None and value not in known[target]:
+            return f"{target} no existe: {value}"
+
+    return None
+
+
+# ==========================================================
+#      ESCRITURA
+# ==========================================================
+
+class Report:
+    """Lo que ha pasado con una colección"""
+
+    def __init__(self, collection: str):
+        self.collection = collection
+        self.read = 0
+        self.upserted = 0
+        self.modified = 0
+        self.errors = 0
+        self.skipped: Dict[str, int] = {}
+        self.examples: List[str] = []
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+
+    def skip(self, reason: str, row: int) -> None:
+        kind = reason.split(":")[0]
+        self.skipped[kind] = self.skipped.get(kind, 0) + 1
+        if len(self.examples) < 5:
+            self.examples.append(f"fila {row}: {reason}")
+
+    def print(self) -> None:
+        rate = self.read / self.seconds if self.seconds else 0.0
+        skipped = sum(self.skipped.values())
+        print(
+            f"{self.collection:<12}{self.read:>9}{self.upserted:>9}{self.modified:>11}"
+            f"{skipped:>11}{self.errors:>8}{self.seconds:>9.2f}s{rate:>11.0f}/s"
+        )
+        for example in self.examples:
+            print(f"    {example}")
+
+
+def upsert(_id: Any, document: dict, version_field: Optional[str], now: datetime.datetime) -> UpdateOne:
+    """
+    Upsert del documento
+    > con `version_field`, la fecha solo cambia si cambia alguno de los campos (o es nuevo),
+    si no watcher.py vería como modificados todos los documentos de cada importación
+    > los valores van con $literal para que un texto como "$x" no se lea como un campo
+    """
+
+    values = {field: {"$literal": value} for field, value in document.items()}
+    # un $set vacío no es válido (p.ej. una secretaría sin formas de contacto)
+    stages = [{"$set": values}] if values else []
+
+    if version_field is not None:
+        unchanged = {"$and": [
+            # los documentos nuevos no tienen fecha
+            {"$gt": [f"${version_field}", None]},
+            *({"$eq": [f"${field}", value]} for field, value in values.items()),
+        ]}
+        version = {"$cond": [unchanged, f"${version_field}", {"$literal": now}]}
+        stages.insert(0, {"$set": {version_field: version}})
+
+    return UpdateOne({"_id": _id}, stages, upsert=True)
+
+
+def flush(database, collection: str, batch: List[UpdateOne], report: Report) -> None:
+    try:
+        result = database[collection].bulk_write(batch, ordered=False)
+    except BulkWriteError as error:
+        # sin orden, Mongo escribe el resto del lote aunque fallen algunos
+        result = error.details
+        report.upserted += result.get("nUpserted", 0)
+        report.modified += result.get("nModified", 0)
+        report.errors += len(result.get("writeErrors", ()))
+        return
+
+    report.upserted += result.upserted_count
+    report.modified += result.modified_count
+
+
+def import_collection(
+    database,
+    collection: str,
+    paths: List[str],
+    known: Dict[str, Set[Any]],
+    batch_size: int = 1000,
+    strict: bool = False,
+) -> Report:
+    """
+    Escribe los documentos de los archivos en la colección
+    > cada documento válido se añade a `known`, para las referencias de las siguientes colecciones
+    """
+
+    version_field = getattr(info, "version_field", "actualizado")
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    report = Report(collection)
+    batch: List[UpdateOne] = []
+    for path in paths:
+        for row in read(path):
+            report.read += 1
+            current = to_document(collection, row)
+
+            reason = problem(collection, current, known)
+            if reason is not None:
+                if strict:
+                    raise SystemExit(f"{path}, fila {report.read}: {reason}")
+                report.skip(reason, report.read)
+                continue
+
+            _id = current.pop("_id")
+            # los usuarios no forman parte de los datos académicos, no los vigila watcher.py
+            batch.append(upsert(_id, current, None if collection == "usuarios" else version_field, now))
+            if not isinstance(_id, dict):
+                known[collection].add(_id)
+
+            if len(batch) >= batch_size:
+                flush(database, collection, batch, report)
+                batch = []
+
+    if batch:
+        flush(database, collection, batch, report)
+
+    report.seconds = time.perf_counter() - report.start
+    return report
+
+
+def ensure_indexes(database) -> None:
+    """Índices de las consultas de la skill, y el de la fecha de modificación para watcher.py"""
+
+    version_field = getattr(info, "version_field", "actualizado")
+    for collection in ORDER:
+        for keys in INDEXES.get(collection, ()):
+            database[collection].create_index(keys)
+        if collection != "usuarios":
+            database[collection].create_index([(version_field, ASCENDING)])
+
+
+# ==========================================================
+#      MAIN
+# ==========================================================
+
+def files(paths: List[str]) -> Dict[str, List[str]]:
+    """colección -> archivos, a partir de los nombres (las carpetas se recorren)"""
+
+    found: Dict[str, List[str]] = {}
+    for path in paths:
+        names = sorted(os.path.join(path, name) for name in os.listdir(path)) if os.path.isdir(path) else [path]
+        for name in names:
+            stem, extension = os.path.splitext(os.path.basename(name))
+            if extension.lower() not in EXTENSIONS:
+                continue
+            if stem not in ORDER:
+                raise SystemExit(f"No sé a qué colección va {name} (se esperaba {', '.join(ORDER)})")
+            found.setdefault(stem, []).append(name)
+    return found
+
+
+def main(paths: List[str], batch_size: int, strict: bool) -> None:
+    database = MongoClient(info.database_ip)[info.database_name]
+
+    to_import = files(paths)
+    if not to_import:
+        raise SystemExit("No hay archivos que importar")
+
+    # ids que ya hay en la base de datos, las referencias pueden apuntar a ellos
+    known: Dict[str, Set[Any]] = {
+        collection: set(database[collection].distinct("_id"))
+        for collection in ("secretarias", "profesores", "estudios")
+    }
+    known.update({collection: set() for collection in ORDER if collection not in known})
+
+    print(f"{'colección':<12}{'leídos':>9}{'nuevos':>9}{'cambiados':>11}{'saltados':>11}{'error':>8}{'tiempo':>10}{'ritmo':>13}")
+    start = time.perf_counter()
+    total = 0
+    for collection in ORDER:
+        if collection in to_import:
+            report = import_collection(database, collection, to_import[collection], known, batch_size, strict)
+            report.print()
+            total += report.read
+
+    ensure_indexes(database)
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{total} filas en {elapsed:.2f}s ({total / elapsed:.0f}/s), índices creados")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga los catálogos académicos en MongoDB")
+    parser.add_argument("paths", nargs="+", help="archivos o carpetas (el nombre es la colección)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="documentos por bulk_write")
+    parser.add_argument("--strict", action="store_true", help="parar en la primera fila con errores")
+    args = parser.parse_args()
+
+    main(args.paths, args.batch_size, args.strict)
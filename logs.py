@@ -0,0 +1,184 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+
+# Debug
+import logging
+import logging.handlers
+
+# Concurrencia
+import atexit
+import queue
+
+# JSON
+import json
+
+# Copiar registros
+import copy
+
+# Type hinting
+from typing import Dict, Optional
+
+# Tiempos por petición (id e intent de la petición en curso)
+import metrics
+
+
+# niveles por defecto de las librerías que más escriben
+# > pymongo y urllib3 en DEBUG escriben cada consulta y cada conexión
+LOGGER_LEVELS = {
+    "pymongo": "WARNING",
+    "urllib3": "WARNING",
+    "botocore": "WARNING",
+    "selenium": "WARNING",
+}
+
+TEXT_FORMAT = "%(asctime)s -- %(levelname)s %(request_id)s %(intent)s -- %(message)s"
+DATE_FORMAT = "%d/%b/%y %H:%M:%S"
+
+# hilo que escribe los registros de la cola, ver setup
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+# ==========================================================
+#      FORMATO
+# ==========================================================
+
+class RequestFilter(logging.Filter):
+    """
+    Añade a cada registro el id y el intent de la petición que lo escribe
+    > se ejecuta en el hilo que escribe, que es el único que sabe qué petición está atendiendo
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        timer = metrics.current()
+        record.request_id = timer.id if timer is not None else None
+        record.intent = timer.intent if timer is not None else None
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Un objeto JSON por línea"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "fecha": self.formatTime(record, DATE_FORMAT),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "intent": getattr(record, "intent", None),
+        }
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["error"] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que deja el formato para el hilo que escribe en disco
+
+    > el de la librería formatea el mensaje (y la traza) con su propio formato
+    y el JSON acabaría con todo metido en "mensaje"
+    > aquí solo resolvemos lo que no se puede mandar a otro hilo: los argumentos
+    del mensaje y la excepción
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+# ==========================================================
+#      CONFIGURACIÓN
+# ==========================================================
+
+def file_handler(path: str, max_bytes: int, backups: int, when: Optional[str]) -> logging.Handler:
+    """
+    Fichero con rotación
+    > por tiempo si se da `when` ("midnight", "H", ...), si no por tamaño
+    """
+    if when:
+        return logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backups, encoding="utf-8")
+    return logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+
+
+def setup(
+    path: str = "app.log",
+    level: str = "INFO",
+    json_format: bool = True,
+    max_bytes: int = 10 * 1024 * 1024,
+    backups: int = 5,
+    when: Optional[str] = None,
+    levels: Optional[Dict[str, str]] = None,
+    use_queue: bool = True,
+) -> Optional[logging.handlers.QueueListener]:
+    """
+    Configura el logger raíz
+
+    > Con `use_queue` las peticiones solo meten el registro en una cola, un hilo
+    aparte es el que formatea y escribe en disco
+    > `levels` permite cambiar el nivel de loggers concretos, ver LOGGER_LEVELS
+    > Los errores (CatchAllExceptionHandler) van con su traza y la petición que los causó
+
+    Devuelve el QueueListener (None sin cola), hay que pararlo para vaciar la cola
+    > se para solo al salir, y después de hacer fork hay que volver a llamar a setup
+    """
+
+    global _listener
+
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    # si se llama más de una vez (p.ej. después de un fork) no duplicamos handlers ni hilos
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+    for name, logger_level in {**LOGGER_LEVELS, **(levels or {})}.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    output = file_handler(path, max_bytes, backups, when)
+    output.setFormatter(JSONFormatter() if json_format else logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+
+    if not use_queue:
+        output.addFilter(RequestFilter())
+        root.addHandler(output)
+        return None
+
+    log_queue = queue.SimpleQueue()
+
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(RequestFilter())
+    root.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+    return _listener
+
+
+@atexit.register
+def shutdown() -> None:
+    """Vacía la cola antes de salir"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,204 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+
+# Concurrencia
+import asyncio
+import threading
+
+# Tiempo
+import time
+
+# Tiempos por petición
+import metrics
+
+# Type hinting
+from typing import Dict, Tuple
+
+# Peticiones HTTP
+from requests import Session
+from requests.exceptions import RequestException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Peticiones HTTP asíncronas (httpx), solo hacen falta para servir la skill por
+# ASGI, se importan al crear `AsyncLWAClient` para no cargarlas con Flask
+
+
+# ==========================================================
+#      CLIENTE
+# ==========================================================
+
+class _Stats:
+    """Métricas de las consultas a LWA"""
+
+    def _init_stats(self) -> None:
+        self._lock = threading.Lock()
+        self._stats = {"peticiones": 0, "errores": 0, "segundos": 0.0, "maximo": 0.0}
+
+    def _record(self, elapsed: float, error: bool) -> None:
+        with self._lock:
+            self._stats["peticiones"] += 1
+            self._stats["errores"] += error
+            self._stats["segundos"] += elapsed
+            self._stats["maximo"] = max(self._stats["maximo"], elapsed)
+
+        # también cuenta como etapa de la petición que la ha hecho
+        metrics.record("lwa", elapsed)
+
+    def stats(self) -> Dict[str, float]:
+        """Número de consultas, errores y latencia (media y máxima) en segundos"""
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats["media"] = stats["segundos"] / stats["peticiones"] if stats["peticiones"] else 0.0
+        return stats
+
+
+class LWAClient(_Stats):
+    """
+    Cliente de Login with Amazon para obtener el id del usuario a partir de su token
+
+    > Una sola sesión de requests: las conexiones (y el handshake TLS) se reutilizan
+    > Timeouts de conexión y lectura, Alexa solo nos da 8 segundos por petición
+    > Reintentos limitados con espera exponencial para fallos de red y 429/5xx
+    > `base_url` se puede apuntar a un servidor local de pruebas
+    """
+
+    def __init__(
+        self,
+        base_url: str = "https://api.amazon.com",
+        timeout: Tuple[float, float] = (1.0, 2.0),
+        retries: int = 1,
+        backoff: float = 0.2,
+        pool_size: int = 10,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        self.session = Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,  # solo hablamos con un host
+            pool_maxsize=pool_size,  # una conexión por hilo del servidor
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset({"GET"}),
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._init_stats()
+
+    def user_id(self, token: str) -> str:
+        """Id del usuario dueño del token"""
+
+        start = time.perf_counter()
+        error = True
+        try:
+            # mandamos el token en la cabecera en vez de en la URL para que no acabe en los logs
+            response = self.session.get(
+                f"{self.base_url}/user/profile",
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            user_id = response.json()["user_id"]
+            error = False
+            return user_id
+        finally:
+            self._record(time.perf_counter() - start, error)
+
+    def warm_up(self) -> None:
+        """
+        Abre una conexión (DNS + TCP + TLS) para que la primera petición no pague el handshake
+        > la respuesta da igual, si falla ya se reintentará al usarlo
+        """
+        try:
+            self.session.head(self.base_url, timeout=self.timeout)
+        except RequestException:
+            pass
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncLWAClient(_Stats):
+    """
+    Versión asíncrona de `LWAClient` (con httpx) para el servidor ASGI
+
+    > Mismas opciones: pool de conexiones, timeouts y reintentos con espera exponencial
+    > Hay que crearlo dentro del bucle de eventos que lo va a usar
+    """
+
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        base_url: str = "https://api.amazon.com",
+        timeout: Tuple[float, float] = (1.0, 2.0),
+        retries: int = 1,
+        backoff: float = 0.2,
+        pool_size: int = 100,
+    ):
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError("Hace falta httpx para consultar LWA de forma asíncrona")
+        self._httpx = httpx
+
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+
+        connect, read = timeout
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+        self._init_stats()
+
+    async def user_id(self, token: str) -> str:
+        """Id del usuario dueño del token"""
+
+        start = time.perf_counter()
+        error = True
+        try:
+            for attempt in range(self.retries + 1):
+                last = attempt == self.retries
+                try:
+                    response = await self.client.get(
+                        f"{self.base_url}/user/profile",
+                        headers={"Authorization": f"Bearer {token}"},
+                    )
+                except self._httpx.TransportError:
+                    if last:
+                        raise
+                else:
+                    if response.status_code not in self.RETRY_STATUS or last:
+                        response.raise_for_status()
+                        user_id = response.json()["user_id"]
+                        error = False
+                        return user_id
+
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        finally:
+            self._record(time.perf_counter() - start, error)
+
+    async def warm_up(self) -> None:
+        """Abre una conexión antes de la primera petición (ver `LWAClient.warm_up`)"""
+        try:
+            await self.client.head(self.base_url)
+        except self._httpx.HTTPError:
+            pass
+
+    async def close(self) -> None:
+        await self.client.aclose()
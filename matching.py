@@ -0,0 +1,542 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+
+# Concurrencia
+import threading
+
+# Estructuras
+from collections import Counter, OrderedDict, defaultdict
+
+# Type hinting
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from collections.abc import Callable
+
+# Parecido string
+from difflib import SequenceMatcher
+
+# Claves de los filtros
+import json
+
+# Normalización
+import re
+import unicodedata
+
+
+# ==========================================================
+#      FUNCIONES
+# ==========================================================
+
+def _ratio(matches: int, length: int) -> float:
+    """Misma fórmula que usa difflib, para que las comparaciones sean exactas"""
+    return 2.0 * matches / length if length else 1.0
+
+
+def _mask(positions: Iterable[int], size: int) -> int:
+    """Entero con los bits de las posiciones dadas a 1"""
+    data = bytearray((size + 7) // 8)
+    for i in positions:
+        data[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(data, "little")
+
+
+def _positions(mask: int) -> Iterator[int]:
+    """Posiciones de los bits a 1 (la búsqueda la hace str.find, no un bucle por bit)"""
+    bits = bin(mask)[:1:-1]
+    i = bits.find("1")
+    while i != -1:
+        yield i
+        i = bits.find("1", i + 1)
+
+
+def _add(slices: List[int], mask: int) -> None:
+    """
+    Suma 1 a las posiciones de `mask` en un contador por bits: `slices[j]` es
+    el bit j del contador de cada posición, así se suma en todas a la vez
+    """
+    for j, value in enumerate(slices):
+        slices[j], mask = value ^ mask, value & mask
+        if not mask:
+            return
+    slices.append(mask)
+
+
+def _at_least(slices: List[int], threshold: int, universe: int) -> int:
+    """Posiciones de `universe` cuyo contador es >= threshold"""
+    if threshold <= 0:
+        return universe
+    if threshold >= 1 << len(slices):
+        return 0
+
+    greater, equal = 0, universe
+    for j in range(len(slices) - 1, -1, -1):
+        if threshold >> j & 1:
+            equal &= slices[j]
+        else:
+            greater |= equal & slices[j]
+            equal &= ~slices[j]
+    return greater | equal
+
+
+def _popcount(mask: int) -> int:
+    return bin(mask).count("1")
+
+
+def _trigrams(text: str) -> set:
+    """Trigramas de la cadena (en minúsculas y con relleno para los extremos)"""
+    text = f"  {text.lower()} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# ==========================================================
+#      NORMALIZACIÓN
+# ==========================================================
+
+# palabras que no ayudan a distinguir un nombre de otro
+STOP_WORDS = frozenset({
+    "a", "al", "con", "de", "del", "e", "el", "en", "la", "las", "lo", "los",
+    "o", "para", "por", "u", "un", "una", "y",
+})
+
+# numerales romanos, con palabras y ordinales -> dígitos ("Cálculo II" == "calculo dos")
+NUMERALS = {
+    "i": "1", "ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6",
+    "uno": "1", "dos": "2", "tres": "3", "cuatro": "4", "cinco": "5", "seis": "6",
+    "primero": "1", "primera": "1", "segundo": "2", "segunda": "2", "tercero": "3",
+    "tercera": "3", "cuarto": "4", "cuarta": "4", "quinto": "5", "quinta": "5",
+    "sexto": "6", "sexta": "6",
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_ORDINAL = re.compile(r"^(\d+)[oa]$")  # "1º" queda como "1o" al quitar los acentos
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin tildes ni diéresis ("Cálculo" -> "calculo")"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def tokens(text: str) -> List[str]:
+    """
+    Palabras del nombre, normalizadas
+    > sin tildes, sin palabras vacías ("de", "la", "y"...) y con los numerales como dígitos
+    > si todas son palabras vacías las dejamos, si no no quedaría nada que comparar
+    """
+    words = []
+    for word in _TOKEN.findall(fold(text)):
+        ordinal = _ORDINAL.match(word)
+        words.append(ordinal.group(1) if ordinal else NUMERALS.get(word, word))
+
+    significant = [word for word in words if word not in STOP_WORDS]
+    return significant or words
+
+
+def phonetic(word: str) -> str:
+    """
+    Clave fonética (aproximada) de una palabra en español
+    > b/v, c/k/q, c/z/s, g/j, ll/y, h muda, letras dobles...
+    """
+    if word.isdigit():
+        return word
+
+    word = word.replace("ch", "C")
+    word = re.sub(r"gu(?=[ei])", "G", word)
+    word = re.sub(r"g(?=[ei])", "j", word)
+    word = re.sub(r"qu(?=[ei])", "k", word)
+    word = re.sub(r"c(?=[ei])", "s", word)
+    word = word.replace("ll", "y").replace("h", "").replace("x", "ks")
+    word = word.translate(str.maketrans({"c": "k", "q": "k", "z": "s", "v": "b", "w": "b", "G": "g"}))
+    word = re.sub(r"y$", "i", word)
+    return re.sub(r"(.)\1+", r"\1", word).replace("C", "ch")
+
+
+class NormalizedName:
+    """Formas precalculadas de un nombre, para compararlo sin tildes, orden ni fonética"""
+
+    __slots__ = ("key", "words", "sound")
+
+    def __init__(self, text: str):
+        words = tokens(text)
+        # palabras normalizadas en orden, es lo que se compara con difflib
+        self.key = " ".join(words)
+        # mismas palabras en cualquier orden
+        self.words = frozenset(words)
+        # cómo suena
+        self.sound = " ".join(phonetic(word) for word in words)
+
+
+# ==========================================================
+#      ÍNDICE
+# ==========================================================
+
+class _Snapshot:
+    """
+    Estructuras del índice, se reemplazan de golpe al refrescar
+
+    > `keys` son las cadenas con las que se compara la entrada: los propios
+    nombres, o su forma normalizada si el índice normaliza
+    """
+
+    def __init__(self, names: Iterable[str], normalize: bool = False):
+        # quitamos duplicados, difflib devolvería la misma cadena
+        self.names: List[str] = list(dict.fromkeys(names))
+        self.normalized = normalize
+
+        # forma normalizada -> nombres que la tienen ("Cálculo I" y "Calculo 1")
+        self.exact: Dict[str, List[str]] = defaultdict(list)
+        self.words: Dict[frozenset, List[str]] = defaultdict(list)
+        self.sounds: Dict[str, List[str]] = defaultdict(list)
+
+        if normalize:
+            for name in self.names:
+                normalized = NormalizedName(name)
+                self.exact[normalized.key].append(name)
+                self.words[normalized.words].append(name)
+                self.sounds[normalized.sound].append(name)
+            self.keys: List[str] = list(self.exact)
+        else:
+            self.keys = self.names
+
+        # caracteres de cada clave, para la cota de quick_ratio
+        self.counts: List[Counter] = [Counter(key) for key in self.keys]
+        # trigrama -> posiciones de las claves que lo contienen (solo para construir la máscara)
+        self.trigrams: Dict[str, List[int]] = defaultdict(list)
+        # longitud -> posiciones de las claves con esa longitud
+        self.lengths: Dict[int, List[int]] = defaultdict(list)
+        # palabra -> posiciones de las claves que la contienen (solo si se normaliza)
+        self.postings: Dict[str, Set[int]] = defaultdict(set)
+        # (carácter, n) -> posiciones de las claves que lo tienen al menos n veces
+        chars: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+
+        for i, key in enumerate(self.keys):
+            self.lengths[len(key)].append(i)
+            for trigram in _trigrams(key):
+                self.trigrams[trigram].append(i)
+            for char, count in self.counts[i].items():
+                for n in range(1, count + 1):
+                    chars[char, n].append(i)
+            if normalize:
+                for word in key.split():
+                    self.postings[word].add(i)
+
+        # lo mismo como máscaras de bits, para calcular la cota de todas las claves a la vez
+        size = len(self.keys)
+        self.all = (1 << size) - 1
+        self.char_masks: Dict[Tuple[str, int], int] = {key: _mask(positions, size) for key, positions in chars.items()}
+        self.length_masks: Dict[int, int] = {length: _mask(positions, size) for length, positions in self.lengths.items()}
+        self.trigram_masks: Dict[str, int] = {trigram: _mask(positions, size) for trigram, positions in self.trigrams.items()}
+        del self.trigrams
+
+    def containing(self, words: frozenset) -> Optional[Set[int]]:
+        """Posiciones de las claves que tienen todas las palabras (None si ninguna)"""
+        sets = sorted((self.postings.get(word, set()) for word in words), key=len)
+        if not sets or not sets[0]:
+            return None
+        positions = set(sets[0]).intersection(*sets[1:])
+        return positions or None
+
+    def lookup(self, normalized: NormalizedName) -> List[str]:
+        """Nombres que coinciden sin más que normalizar: mismas palabras, en otro orden o que suenan igual"""
+        return (
+            self.exact.get(normalized.key)
+            or self.words.get(normalized.words)
+            or self.sounds.get(normalized.sound)
+            or []
+        )
+
+
+class NameIndex:
+    """
+    Índice en memoria de los valores de un campo, para no tener que leer la
+    colección entera y pasar difflib sobre todos los nombres en cada petición
+
+    > Devuelve el mismo resultado que `get_close_matches(..., n=1, cutoff=0)[0]`:
+    el nombre con mayor `ratio()` y, en caso de empate, la cadena mayor
+
+    > Casi todos los nombres se descartan con las cotas de difflib
+    (real_quick_ratio y quick_ratio) sin llegar a calcular el ratio completo
+    > La cota de quick_ratio (caracteres en común) se calcula para todas las
+    claves a la vez con máscaras de bits: una por (carácter, veces) y un
+    contador por bits que las suma. Por consulta son unos cientos de
+    operaciones sobre enteros de n bits: sigue siendo O(n), pero en C y de
+    64 en 64 claves, no un bucle de Python por nombre. En Python solo se
+    miran las pocas claves con mejor cota (ver `_search`)
+    > Medido con benchmarks/find.py: ~1 ms de mediana con 10k nombres y ~5 ms
+    con 100k (antes ~50 ms con 10k). Las frases cortadas tienen cotas flojas
+    y pueden llegar a puntuar muchas más claves
+
+    > Con `normalize` se compara la forma normalizada (ver `tokens`) en vez del
+    nombre tal cual: si coincide exactamente, en otro orden o suena igual no
+    hace falta puntuar nada, y si no se busca igual que difflib pero sobre las
+    formas normalizadas. Ya no devuelve siempre lo mismo que get_close_matches,
+    pero acierta más con lo que llega de Alexa (sin tildes, "calculo dos"...)
+    """
+
+    def __init__(self, loader: Callable, seeds: int = 16, memo_size: int = 1024, normalize: bool = False):
+        # función que devuelve los nombres, se vuelve a llamar al refrescar
+        self.loader = loader
+        self.normalize = normalize
+        # claves con más trigramas en común que puntuamos antes del barrido
+        self.seeds = seeds
+        self.memo_size = memo_size
+
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._memo: OrderedDict = OrderedDict()
+
+    def refresh(self) -> None:
+        """Vuelve a leer los nombres y reconstruye el índice"""
+        snapshot = _Snapshot(self.loader(), self.normalize)
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._memo = OrderedDict()
+
+    def invalidate(self) -> None:
+        """Marca el índice como obsoleto, se reconstruirá al usarlo"""
+        with self._lock:
+            self._snapshot = None
+            self._memo = OrderedDict()
+
+    @property
+    def names(self) -> List[str]:
+        return self._get_snapshot().names
+
+    def _get_snapshot(self) -> _Snapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.refresh()
+            snapshot = self._snapshot
+        return snapshot
+
+    def best_match(self, input_str: str) -> str:
+        """Nombre más parecido a la cadena recibida"""
+
+        snapshot = self._get_snapshot()
+
+        with self._lock:
+            if input_str in self._memo:
+                self._memo.move_to_end(input_str)
+                return self._memo[input_str]
+
+        result = self._resolve(snapshot, input_str)
+
+        with self._lock:
+            # si se ha refrescado mientras buscábamos, no guardamos el resultado
+            if snapshot is self._snapshot:
+                self._memo[input_str] = result
+                if len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+
+        return result
+
+    def resolve(self, input_str: str) -> str:
+        """
+        Como `best_match` pero sin pasar por el memo
+        > para índices de usar y tirar sobre unos pocos nombres (ver candidates.CandidateIndex)
+        """
+        return self._resolve(self._get_snapshot(), input_str)
+
+    def _resolve(self, snapshot: _Snapshot, input_str: str) -> str:
+        """Búsqueda sin memo"""
+
+        if not snapshot.normalized:
+            return self._search(snapshot, input_str)
+
+        normalized = NormalizedName(input_str)
+        candidates = snapshot.lookup(normalized)
+        if not candidates and snapshot.keys:
+            # si hay nombres con todas las palabras ("teoria circuitos"), se elige entre ellos
+            allowed = snapshot.containing(normalized.words)
+            candidates = snapshot.exact[self._search(snapshot, normalized.key, allowed)]
+
+        return self._pick(candidates, input_str)
+
+    @staticmethod
+    def _pick(candidates: List[str], input_str: str) -> str:
+        """Entre nombres con la misma forma normalizada, el más parecido tal cual (como difflib)"""
+        if not candidates:
+            raise IndexError("No hay valores en el índice")
+        if len(candidates) == 1:
+            return candidates[0]
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(input_str)
+
+        def score(name: str) -> Tuple[float, str]:
+            matcher.set_seq1(name)
+            return matcher.ratio(), name
+
+        return max(candidates, key=score)
+
+    def _search(self, snapshot: _Snapshot, input_str: str, allowed: Optional[Set[int]] = None) -> str:
+        """
+        Clave más parecida a la entrada, igual que get_close_matches(input_str, keys, 1, 0)[0]
+        > con `allowed` solo se consideran esas posiciones de `snapshot.keys`
+
+        > Primero se puntúan las `seeds` claves con más trigramas en común, para
+        empezar con un buen mejor ratio. Después, por longitudes, solo las que
+        tienen suficientes caracteres en común para igualarlo (ver `_at_least`),
+        hasta que ninguna longitud puede mejorarlo
+        """
+
+        names = snapshot.keys
+        if not names:
+            # mismo error que obteníamos con get_close_matches(...)[0]
+            raise IndexError("No hay valores en el índice")
+
+        # igual que en get_close_matches: seq2 es la entrada, seq1 cada candidato
+        matcher = SequenceMatcher()
+        matcher.set_seq2(input_str)
+        input_len = len(input_str)
+        input_counts = Counter(input_str)
+
+        # (ratio, nombre), comparar tuplas resuelve los empates como difflib
+        best: Tuple[float, str] = (-1.0, "")
+
+        # caracteres en común de cada clave con la entrada (la cota de quick_ratio), en bits
+        slices: List[int] = []
+        for char, count in input_counts.items():
+            for n in range(1, count + 1):
+                mask = snapshot.char_masks.get((char, n))
+                if mask is None:
+                    break
+                _add(slices, mask)
+
+        # longitudes de mayor a menor real_quick_ratio
+        bounds = sorted(
+            (
+                (_ratio(min(length, input_len), length + input_len), length)
+                for length in snapshot.lengths
+            ),
+            reverse=True,
+        )
+
+        def score(batch: int) -> None:
+            """Ratio completo de las claves, de mayor a menor cota de quick_ratio hasta que ninguna puede mejorar"""
+            nonlocal best
+            candidates = []
+            for i in _positions(batch):
+                name = names[i]
+                matches = sum(min(n, input_counts[c]) for c, n in snapshot.counts[i].items())
+                candidates.append((_ratio(matches, len(name) + input_len), name))
+
+            for bound in sorted(candidates, reverse=True):
+                if bound <= best:
+                    break
+                matcher.set_seq1(bound[1])
+                candidate = (matcher.ratio(), bound[1])
+                if candidate > best:
+                    best = candidate
+
+        universe = snapshot.all if allowed is None else _mask(allowed, len(names))
+
+        # > primero los nombres con más trigramas en común: el mayor número de
+        # trigramas que tienen al menos `seeds` claves (o las del siguiente, si
+        # con ese son demasiadas)
+        shared: List[int] = []
+        for trigram in _trigrams(input_str):
+            mask = snapshot.trigram_masks.get(trigram)
+            if mask is not None:
+                _add(shared, mask)
+
+        low, high = 0, len(_trigrams(input_str)) + 1
+        while high - low > 1:
+            middle = (low + high) // 2
+            if _popcount(_at_least(shared, middle, universe)) >= self.seeds:
+                low = middle
+            else:
+                high = middle
+        seeds = _at_least(shared, low, universe)
+        if _popcount(seeds) > 4 * self.seeds:
+            seeds = _at_least(shared, low + 1, universe) or seeds
+        score(seeds)
+        universe &= ~seeds
+
+        # > después por longitudes, de mayor a menor real_quick_ratio, solo las
+        # claves con suficientes caracteres en común para igualar al mejor
+        for bound, length in bounds:
+            # ninguna clave de esta longitud (ni de las siguientes) puede mejorarlo
+            if bound < best[0]:
+                break
+
+            total = length + input_len
+            needed = max(0, int(best[0] * total / 2) - 1)
+            while _ratio(needed, total) < best[0]:
+                needed += 1
+
+            batch = _at_least(slices, needed, snapshot.length_masks[length] & universe)
+            if batch:
+                score(batch)
+
+        return best[1]
+
+
+# ==========================================================
+#      REGISTRO DE ÍNDICES
+# ==========================================================
+
+# (colección, campo, filtro) -> índice
+_indexes: Dict[Tuple[str, str, str], NameIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _freeze(filtering: dict) -> str:
+    """Los filtros son dicts (no hasheables), los pasamos a JSON para usarlos como clave"""
+    return json.dumps(filtering, sort_keys=True, default=str)
+
+
+def get_index(
+    collection: str,
+    field: str,
+    filtering: dict,
+    loader: Callable,
+    normalize: bool = False,
+    factory: Optional[Callable] = None,
+) -> NameIndex:
+    """
+    Índice de la combinación dada, se crea la primera vez que se pide
+    > `factory(index)` permite envolver el índice en memoria en otro con la misma
+    interfaz (ver candidates.CandidateIndex)
+    """
+
+    key = (collection, field, _freeze(filtering))
+
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = NameIndex(loader, normalize=normalize)
+                if factory is not None:
+                    index = factory(index)
+                _indexes[key] = index
+
+    return index
+
+
+def _select(collection: Optional[str]) -> List[NameIndex]:
+    with _indexes_lock:
+        return [index for key, index in _indexes.items() if collection in (None, key[0])]
+
+
+def invalidate(collection: Optional[str] = None) -> None:
+    """Marca como obsoletos los índices (de una colección o todos), se reconstruyen al usarlos"""
+    for index in _select(collection):
+        index.invalidate()
+
+
+def refresh(collection: Optional[str] = None) -> None:
+    """
+    Reconstruye los índices (de una colección o todos) sin reiniciar la app
+
+    > Los que no se han usado nunca no existen todavía, no hay nada que hacer
+    """
+
+    for index in _select(collection):
+        index.refresh()
@@ -0,0 +1,329 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+
+# Debug
+import logging
+
+# Concurrencia
+import threading
+from contextvars import ContextVar
+
+# Tiempo
+import time
+
+# JSON
+import json
+
+# Decoradores
+import functools
+from contextlib import contextmanager
+
+# MongoDB
+from pymongo import monitoring
+
+# Type hinting
+from typing import Dict, List, Optional, Tuple
+from collections.abc import Callable
+
+
+# límites (en segundos) de los histogramas, Alexa nos da 8 segundos por petición
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 8.0)
+
+
+# ==========================================================
+#      HISTOGRAMAS
+# ==========================================================
+
+class Histogram:
+    """Histograma con etiquetas, en el formato de texto de Prometheus"""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+
+        self._lock = threading.Lock()
+        # valores de las etiquetas -> [cuenta por bucket..., suma, total]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+
+        for values, counts in sorted(series.items()):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, values))
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {counts[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {counts[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {counts[-1]}")
+
+        return lines
+
+
+requests_histogram = Histogram(
+    "alexa_request_seconds", "Tiempo total de cada petición", ("handler",),
+)
+stages_histogram = Histogram(
+    "alexa_stage_seconds", "Tiempo de cada etapa de una petición", ("handler", "stage"),
+)
+
+
+def expose() -> str:
+    """Todas las métricas, para la ruta /metrics"""
+    return "\n".join(requests_histogram.expose() + stages_histogram.expose()) + "\n"
+
+
+# ==========================================================
+#      PETICIONES
+# ==========================================================
+
+class RequestTimer:
+    """Tiempos de una petición, se rellenan según pasa por cada etapa"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.id: Optional[str] = None
+        self.intent: Optional[str] = None
+        self.handler = "desconocido"
+        # segundos en el response_builder que aún no se han apuntado (ver `instrument`)
+        self.building = 0.0
+        # (etapa, segundos) en el orden en que terminan
+        self.stages: List[Tuple[str, float]] = []
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+# dentro de una serialización, para medir solo la de fuera (ver `instrument_serializer`)
+_serializing: ContextVar[bool] = ContextVar("serializing", default=False)
+
+# petición que se está atendiendo
+# > para que llegue a los hilos de prefetch hay que lanzarlos con contextvars.copy_context()
+_current: ContextVar[Optional[RequestTimer]] = ContextVar("request_timer", default=None)
+
+
+def current() -> Optional[RequestTimer]:
+    return _current.get()
+
+
+def record(name: str, seconds: float) -> None:
+    """Apunta el tiempo de una etapa en la petición actual (si hay)"""
+    timer = _current.get()
+    if timer is not None:
+        timer.stages.append((name, seconds))
+        stages_histogram.observe((timer.handler, name), seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Mide lo que tarda el bloque"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable:
+    """Decorador para medir lo que tarda una función"""
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def request(slow_threshold: Optional[float] = None):
+    """
+    Mide una petición entera
+
+    > "sdk" es lo que no es ni el handler ni la respuesta: verificación,
+    deserialización de la petición y elegir el handler
+    > "respuesta" es montar la respuesta (las llamadas al response_builder,
+    ver `instrument`) y serializarla (ver `instrument_serializer`)
+    > si tarda más de `slow_threshold` segundos, se escribe en el log con todas sus etapas
+    """
+
+    timer = RequestTimer()
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        # lo montado de una respuesta que no se ha llegado a serializar
+        if timer.building:
+            record("respuesta", timer.building)
+        _current.reset(token)
+        total = timer.elapsed()
+
+        own_time = sum(seconds for name, seconds in timer.stages if name in ("handler", "respuesta"))
+        timer.stages.append(("sdk", total - own_time))
+        stages_histogram.observe((timer.handler, "sdk"), total - own_time)
+        requests_histogram.observe((timer.handler,), total)
+
+        if slow_threshold is not None and total > slow_threshold:
+            logging.warning("Petición lenta " + json.dumps({
+                "id": timer.id,
+                "intent": timer.intent,
+                "handler": timer.handler,
+                "total_ms": round(total * 1000, 2),
+                "etapas": [[name, round(seconds * 1000, 2)] for name, seconds in timer.stages],
+            }))
+
+
+def label(handler: str, request_id: Optional[str], intent: Optional[str]) -> None:
+    """Apunta en la petición actual (si hay) quién la atiende"""
+    timer = _current.get()
+    if timer is not None:
+        timer.handler = handler
+        timer.id = request_id
+        timer.intent = intent
+
+
+class TimedResponseBuilder:
+    """
+    Envuelve el response_builder del SDK y suma lo que tardan sus llamadas
+    (speak, set_card...) en `seconds`
+    > los métodos que devuelven el propio builder devuelven este objeto, así
+    también se miden las llamadas encadenadas
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+        self.seconds = 0.0
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._builder, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+            return self if result is self._builder else result
+        return call
+
+
+def instrument(handler):
+    """
+    Mide el `handle` del handler y deja apuntado en la petición quién la ha atendido
+    > lo que se va en el response_builder cuenta como "respuesta", no como "handler"
+    > se aplica al registrar los handlers en el SkillBuilder
+    """
+
+    handle = handler.handle
+    name = handler.__class__.__name__
+
+    @functools.wraps(handle)
+    def wrapper(handler_input, *args, **kwargs):
+        request_envelope = handler_input.request_envelope.request
+        intent = getattr(request_envelope, "intent", None)
+        label(name, request_envelope.request_id, intent.name if intent is not None else request_envelope.object_type)
+
+        builder = handler_input.response_builder
+        timed_builder = handler_input.response_builder = TimedResponseBuilder(builder)
+        start = time.perf_counter()
+        try:
+            return handle(handler_input, *args, **kwargs)
+        finally:
+            handler_input.response_builder = builder
+            record("handler", time.perf_counter() - start - timed_builder.seconds)
+            # se apunta junto con la serialización, una sola etapa "respuesta"
+            timer = _current.get()
+            if timer is not None:
+                timer.building += timed_builder.seconds
+
+    handler.handle = wrapper
+    return handler
+
+
+def instrument_serializer(skill):
+    """
+    Mide la serialización de la respuesta, junto con lo que se tardó en montarla,
+    como etapa "respuesta"
+    > el SkillAdapter de Flask y asgi.py usan los dos `skill.serializer.serialize`
+    > el serializador del SDK se llama a sí mismo para cada objeto anidado, solo
+    cuenta la llamada de fuera
+    """
+
+    serialize = skill.serializer.serialize
+
+    @functools.wraps(serialize)
+    def wrapper(obj):
+        if _serializing.get():
+            return serialize(obj)
+
+        token = _serializing.set(True)
+        start = time.perf_counter()
+        try:
+            return serialize(obj)
+        finally:
+            _serializing.reset(token)
+            timer = _current.get()
+            if timer is not None:
+                record("respuesta", timer.building + time.perf_counter() - start)
+                timer.building = 0.0
+
+    skill.serializer.serialize = wrapper
+    return skill
+
+
+# ==========================================================
+#      MONGODB
+# ==========================================================
+
+class MongoListener(monitoring.CommandListener):
+    """
+    Apunta cada consulta a MongoDB como la etapa "mongo:<colección>"
+    > se pasa al MongoClient en `event_listeners`
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # id de la operación -> colección
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event) -> None:
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            with self._lock:
+                self._collections[event.request_id] = collection
+
+    def _finished(self, event) -> None:
+        with self._lock:
+            collection = self._collections.pop(event.request_id, None)
+        name = f"mongo:{collection}" if collection else f"mongo:{event.command_name}"
+        record(name, event.duration_micros / 1e6)
+
+    def succeeded(self, event) -> None:
+        self._finished(event)
+
+    def failed(self, event) -> None:
+        self._finished(event)
@@ -0,0 +1,216 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Respuestas que son siempre iguales (bienvenida, ayuda, despedida...)
+#
+#     Al arrancar se pide cada una a su handler, pasando por la skill como
+#     cualquier petición, y se guarda ya en JSON. Después, para esas rutas no
+#     se crean los objetos del SDK ni se serializa nada: se verifica la
+#     petición y se devuelve el JSON guardado con los atributos de sesión de
+#     la petición, que es lo único que cambia
+#
+#     > los handlers con `static = True` son los que se guardan, solo pueden
+#     depender de la ruta (ver routing.py)
+#     > si la sesión tiene un atributo de `session_key` (el registro), o la
+#     skill comprueba el id y no coincide, se deja a la skill
+# ==========================================================
+
+# Debug
+import logging
+
+# Tiempo
+import datetime
+
+# JSON
+import json
+
+# Estructuras
+from types import SimpleNamespace
+
+# Alexa Skill Kit SDK
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_webservice_support.verifier import RequestVerifier, TimestampVerifier, VerificationException
+from dateutil.parser import isoparse
+
+# Flask
+from flask import current_app, request as flask_request
+from flask_ask_sdk.skill_adapter import SkillAdapter, VERIFY_SIGNATURE_APP_CONFIG, VERIFY_TIMESTAMP_APP_CONFIG
+from werkzeug import exceptions
+
+# Tiempos por petición
+import metrics
+
+# Type hinting
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# petición de ejemplo con la que se genera cada respuesta
+SAMPLE_USER = "amzn1.ask.account.prerender"
+
+
+class StaticResponses:
+    """Tabla ruta -> respuesta ya serializada"""
+
+    def __init__(self, skill, handlers: Iterable):
+        self.skill = skill
+        self.handlers = list(handlers)
+        self.session_keys = {
+            handler.session_key for handler in self.handlers if getattr(handler, "session_key", None) is not None
+        }
+
+        # ruta -> (nombre del handler, JSON sin el cierre, JSON con sesión vacía, JSON sin sesión)
+        self.bodies: Dict[str, Tuple[str, bytes, bytes, bytes]] = {}
+
+    # ------------------------------------------------------
+    #   Arranque
+    # ------------------------------------------------------
+
+    def render(self) -> None:
+        """Genera las respuestas, si alguna falla se deja a la skill"""
+
+        for handler in self.handlers:
+            if not getattr(handler, "static", False):
+                continue
+
+            for route in handler.routes:
+                try:
+                    self.bodies[route] = (handler.__class__.__name__, *self._render(route))
+                except Exception:
+                    logging.warning(f"No se pudo generar la respuesta de {route}", exc_info=True)
+
+    def _render(self, route: str) -> Tuple[bytes, bytes, bytes]:
+        envelope = self.skill.serializer.deserialize(payload=json.dumps(self._sample(route)), obj_type=RequestEnvelope)
+        response = self.skill.serializer.serialize(self.skill.invoke(request_envelope=envelope, context=None))
+        response.pop("sessionAttributes", None)
+
+        # "{...}" -> "{..., "sessionAttributes": " para añadir los de cada petición
+        head = json.dumps(response)[:-1].encode() + b', "sessionAttributes": '
+        return head, head + b"{}}", json.dumps(response).encode()
+
+    def _sample(self, route: str) -> dict:
+        now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        application = {"applicationId": self.skill.skill_id or "prerender"}
+        user = {"userId": SAMPLE_USER}
+
+        if route.endswith("Request"):
+            request = {"type": route}
+            if route == "SessionEndedRequest":
+                request["reason"] = "USER_INITIATED"
+        else:
+            request = {"type": "IntentRequest", "intent": {"name": route, "confirmationStatus": "NONE"}}
+
+        return {
+            "version": "1.0",
+            "session": {
+                "new": False, "sessionId": "prerender", "application": application, "attributes": {}, "user": user,
+            },
+            "context": {"System": {
+                "application": application,
+                "user": user,
+                "device": {"deviceId": "prerender", "supportedInterfaces": {}},
+                "apiEndpoint": "https://api.amazonalexa.com",
+            }},
+            "request": {**request, "requestId": "prerender", "timestamp": now, "locale": "es-ES"},
+        }
+
+    # ------------------------------------------------------
+    #   Peticiones
+    # ------------------------------------------------------
+
+    def lookup(self, body: dict) -> Optional[Tuple[str, str, bytes]]:
+        """
+        (handler, ruta, respuesta) si la petición tiene respuesta guardada
+        > None si hay que pasársela a la skill
+        """
+
+        request = body.get("request") or {}
+        request_type = request.get("type")
+        route = (request.get("intent") or {}).get("name") if request_type == "IntentRequest" else request_type
+
+        rendered = self.bodies.get(route)
+        if rendered is None:
+            return None
+
+        session = body.get("session")
+        attributes = (session or {}).get("attributes") or {}
+        if self.session_keys.intersection(attributes):
+            return None
+
+        skill_id = self.skill.skill_id
+        if skill_id is not None:
+            application = ((body.get("context") or {}).get("System") or {}).get("application") or {}
+            if application.get("applicationId") != skill_id:
+                return None
+
+        name, head, empty, no_session = rendered
+        if session is None:
+            return name, route, no_session
+        if not attributes:
+            return name, route, empty
+        return name, route, head + json.dumps(attributes).encode() + b"}"
+
+    @staticmethod
+    def verify(verifiers: List, headers: Dict[str, str], raw: str, body: dict) -> None:
+        """
+        Pasa los verificadores del SDK sin crear el RequestEnvelope
+        > la firma solo mira las cabeceras y el texto, la hora solo `request.timestamp` y el tipo
+        """
+
+        request = body.get("request") or {}
+        try:
+            timestamp = isoparse(request["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            timestamp = None  # el verificador de la hora la rechaza
+
+        envelope = SimpleNamespace(request=SimpleNamespace(timestamp=timestamp, object_type=request.get("type")))
+        for verifier in verifiers:
+            verifier.verify(headers=headers, serialized_request_env=raw, deserialized_request_env=envelope)
+
+
+class StaticSkillAdapter(SkillAdapter):
+    """
+    SkillAdapter de Flask que contesta con `StaticResponses` cuando puede
+    > el resto de peticiones siguen el camino de siempre
+    > mismos verificadores y mismas respuestas de error que el SkillAdapter
+    """
+
+    def __init__(self, skill, skill_id: str, app, static: StaticResponses):
+        self.static = static
+        self.verifiers = []
+        super().__init__(skill=skill, skill_id=skill_id, app=app)
+
+    def init_app(self, app) -> None:
+        super().init_app(app)
+
+        self.verifiers = []
+        if app.config.get(VERIFY_SIGNATURE_APP_CONFIG, True):
+            self.verifiers.append(RequestVerifier())
+        if app.config.get(VERIFY_TIMESTAMP_APP_CONFIG, True):
+            self.verifiers.append(TimestampVerifier())
+
+    def dispatch_request(self):
+        if flask_request.method == "POST":
+            content = flask_request.get_data(as_text=True)
+            try:
+                body = json.loads(content)
+            except ValueError:
+                body = None
+
+            found = self.static.lookup(body) if isinstance(body, dict) else None
+            if found is not None:
+                name, route, response = found
+                try:
+                    self.static.verify(self.verifiers, flask_request.headers, content, body)
+                except VerificationException:
+                    current_app.logger.error("Request verification failed", exc_info=True)
+                    raise exceptions.BadRequest(description="Incoming request failed verification")
+
+                metrics.label(name, body["request"].get("requestId"), route)
+                return current_app.response_class(response, mimetype="application/json")
+
+        return super().dispatch_request()
@@ -0,0 +1,98 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Elegir handler con una tabla en vez de preguntar a todos
+#
+#     El SkillBuilder del SDK pregunta `can_handle` a cada handler, en orden,
+#     hasta que uno acepta la petición. Aquí cada handler dice qué atiende
+#     (`routes`: tipos de petición o nombres de intent) y al crear la skill se
+#     monta un diccionario ruta -> handler
+#
+#     > `session_key`: el handler atiende cualquier petición de una sesión con
+#     ese atributo (la conversación del registro), se mira antes que la tabla
+#     > los handlers sin `routes` (IntentReflectorHandler) se preguntan con
+#     `can_handle` en orden si la tabla no tiene la ruta
+#     > si dos handlers tienen la misma ruta gana el primero que se registra,
+#     igual que con el SDK
+# ==========================================================
+
+# Alexa Skill Kit SDK
+from ask_sdk_core.skill_builder import SkillBuilder
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_model import IntentRequest
+from ask_sdk_runtime.dispatch_components import GenericRequestMapper
+
+
+def route(handler_input: HandlerInput) -> str:
+    """Nombre del intent o, si no es un intent, tipo de la petición"""
+    request = handler_input.request_envelope.request
+    if isinstance(request, IntentRequest):
+        return request.intent.name
+    return request.object_type
+
+
+class RoutingRequestMapper(GenericRequestMapper):
+    """Misma interfaz que el del SDK, pero buscando en una tabla"""
+
+    def __init__(self, request_handler_chains):
+        super().__init__(request_handler_chains)
+
+        self.routes = {}
+        self.session_routes = {}
+        self.fallback = []
+        for chain in self.request_handler_chains:
+            handler = chain.request_handler
+            routes = getattr(handler, "routes", ())
+            session_key = getattr(handler, "session_key", None)
+
+            for name in routes:
+                self.routes.setdefault(name, chain)
+            if session_key is not None:
+                self.session_routes.setdefault(session_key, chain)
+            if not routes and session_key is None:
+                self.fallback.append(chain)
+
+    def get_request_handler_chain(self, handler_input: HandlerInput):
+        if self.session_routes:
+            session = handler_input.request_envelope.session
+            attributes = session.attributes if session is not None else None
+            if attributes:
+                for key, chain in self.session_routes.items():
+                    if key in attributes:
+                        return chain
+
+        chain = self.routes.get(route(handler_input))
+        if chain is not None:
+            return chain
+
+        for chain in self.fallback:
+            if chain.request_handler.can_handle(handler_input):
+                return chain
+
+        return None
+
+
+def find_handler(skill, handler_input: HandlerInput):
+    """Handler que atenderá la petición (None si ninguno), sin ejecutarlo"""
+    for mapper in skill.request_dispatcher.request_mappers:
+        chain = mapper.get_request_handler_chain(handler_input)
+        if chain is not None:
+            return chain.request_handler
+    return None
+
+
+class RoutingSkillBuilder(SkillBuilder):
+    """SkillBuilder que usa `RoutingRequestMapper`, la tabla se monta al crear la skill"""
+
+    @property
+    def skill_configuration(self):
+        configuration = super().skill_configuration
+        configuration.request_mappers = [
+            RoutingRequestMapper(self.runtime_configuration_builder.request_handler_chains)
+        ]
+        return configuration
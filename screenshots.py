@@ -1,48 +1,441 @@
 import os
+import time
+import queue
+import sqlite3
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 import boto3
-from selenium.webdriver.chrome.options import Options
+import requests
+from botocore.exceptions import ClientError
+from bson import json_util
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.common.by import By
 from selenium import webdriver
 from datos import info
 from pymongo import MongoClient
-from app import parse_url
+from utils import parse_url
+import images
 
 database = MongoClient(info.database_ip)[info.database_name]
 
-options = webdriver.ChromeOptions()
-options.headless = True
-driver = webdriver.Chrome(options=options)
+# los clientes de boto3 se pueden compartir entre hilos, los resource no
+s3 = boto3.client('s3')
 
-bucket = boto3.resource('s3').Bucket(info.s3_bucket_name)
+# subcarpeta /imagenes/ junto al script
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'imagenes')
 
-def scroll(size: str) -> int: 
+# manifiesto con lo que sabemos de cada captura
+MANIFEST_PATH = os.path.join(IMAGES_DIR, 'manifest.sqlite')
+
+# marca de fin para los workers
+STOP = None
+
+
+def new_driver(timeout: float) -> webdriver.Chrome:
+    """Navegador sin ventana, cada worker tiene el suyo"""
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless=new')
+    driver = webdriver.Chrome(options=options)
+    driver.set_page_load_timeout(timeout)
+    return driver
+
+
+def close_driver(driver) -> None:
+    """Cierra el navegador (si hay), aunque esté roto"""
+    if driver is not None:
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+
+def scroll(driver: webdriver.Chrome, size: str) -> int:
     """Ver toda la pagina web en vez de la parte visible nada más abrir"""
     return driver.execute_script('return document.body.parentNode.scroll'+size)
 
 
-def image_path(url: str) -> str: 
+def image_path(url: str) -> str:
     """Alojamos el archivo en la subcarpeta /imagenes/"""
     return os.path.join(
-        os.path.dirname(os.path.abspath(__file__)), #ruta script
-        'imagenes', #subcarpeta
+        IMAGES_DIR, #ruta script/subcarpeta
         f"{parse_url(url)}.png" #nombre archivo
     )
 
 
-def take_screenshot(url: str) -> None:
+def file_hash(file_path: str, algorithm: str = 'sha256') -> str:
+    """Hash del contenido del archivo"""
+    with open(file_path, 'rb') as data:
+        return hashlib.new(algorithm, data.read()).hexdigest()
+
+
+def object_key(url: str, variant: str = None) -> str:
+    """Nombre del archivo en s3, el mismo que usa app.s3_url"""
+    return f"{parse_url(url)}_{variant}.png" if variant else f"{parse_url(url)}.png"
+
+
+def upload(url: str, file_path: str, variant: str = None) -> str:
+    """Sube la imagen a s3, devuelve el ETag del objeto"""
+    with open(file_path, 'rb') as data:
+        response = s3.put_object(
+            Bucket=info.s3_bucket_name,
+            Key=object_key(url, variant),
+            Body=data,
+            ContentType='image/png',
+        )
+    return response['ETag'].strip('"')
+
+
+def uploaded_etag(url: str):
+    """ETag del objeto que hay en s3 (None si no existe)"""
+    try:
+        response = s3.head_object(Bucket=info.s3_bucket_name, Key=object_key(url))
+    except ClientError:
+        return None
+    return response['ETag'].strip('"')
+
+
+class Manifest:
+    """
+    Lo que sabemos de cada captura, guardado en SQLite junto a las imágenes:
+    > url
+    > etag, last_modified: cabeceras HTTP de la página cuando la capturamos
+    > sha256: hash de la imagen que tenemos en disco
+    > s3_key, s3_etag, s3_sha256: objeto de s3 y hash de la imagen que subimos
+    > variants_sha256: hash de la imagen a partir de la que hicimos las variantes (ver images.py)
+    > bytes_original, bytes_variants: tamaño de la captura y de sus variantes
+
+    Con esto, al refrescar, solo volvemos a capturar las páginas que han cambiado
+    (petición HEAD condicional) y solo subimos las imágenes que son distintas
+    """
+
+    COLUMNS = {
+        'etag': 'TEXT', 'last_modified': 'TEXT', 'sha256': 'TEXT',
+        's3_key': 'TEXT', 's3_etag': 'TEXT', 's3_sha256': 'TEXT',
+        'variants_sha256': 'TEXT', 'bytes_original': 'INTEGER', 'bytes_variants': 'INTEGER',
+    }
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS capturas (url TEXT PRIMARY KEY, "
+                + ", ".join(f"{column} {kind}" for column, kind in self.COLUMNS.items())
+                + ", actualizado REAL)"
+            )
+            # manifiestos creados con una versión anterior
+            existing = {row[1] for row in self.connection.execute("PRAGMA table_info(capturas)")}
+            for column, kind in self.COLUMNS.items():
+                if column not in existing:
+                    self.connection.execute(f"ALTER TABLE capturas ADD COLUMN {column} {kind}")
+            # último _id procesado de cada colección, para continuar si se corta la ejecución
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS progreso (coleccion TEXT PRIMARY KEY, ultimo_id TEXT)"
+            )
+
+    def get(self, url: str) -> dict:
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM capturas WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else {}
+
+    def update(self, url: str, **fields) -> None:
+        """Inserta o actualiza los campos dados"""
+        columns = list(fields) + ['actualizado']
+        values = list(fields.values()) + [time.time()]
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"INSERT INTO capturas (url, {', '.join(columns)}) VALUES (?{', ?' * len(columns)}) "
+                f"ON CONFLICT(url) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns)}",
+                [url] + values,
+            )
+
+
+    def checkpoint(self, collection: str):
+        """_id del último documento procesado de la colección (None si hay que empezar de cero)"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT ultimo_id FROM progreso WHERE coleccion = ?", (collection,)
+            ).fetchone()
+        # los _id pueden ser documentos, los guardamos como JSON extendido de Mongo
+        return json_util.loads(row[0]) if row else None
+
+    def save_checkpoint(self, collection: str, last_id) -> None:
+        with self.lock, self.connection:
+            if last_id is None:
+                self.connection.execute("DELETE FROM progreso WHERE coleccion = ?", (collection,))
+            else:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO progreso VALUES (?, ?)", (collection, json_util.dumps(last_id))
+                )
+
+
+def page_changed(session: requests.Session, url: str, entry: dict, timeout: float):
+    """
+    Petición HEAD condicional para saber si la página ha cambiado desde la captura
+    > devuelve (ha cambiado, cabeceras de validación actuales)
+    > si el servidor no nos da ETag ni Last-Modified, no lo podemos saber: asumimos que sí
+    """
+
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    response = session.head(url, headers=headers, timeout=timeout, allow_redirects=True)
+    validators = {
+        'etag': response.headers.get('ETag', entry.get('etag')),
+        'last_modified': response.headers.get('Last-Modified', entry.get('last_modified')),
+    }
+
+    if response.status_code == 304:
+        return False, validators
+
+    if not (validators['etag'] or validators['last_modified']):
+        return True, validators
+
+    unchanged = (
+        validators['etag'] == entry.get('etag')
+        and validators['last_modified'] == entry.get('last_modified')
+    )
+    return not unchanged, validators
+
+
+class Progress:
+    """Cuenta lo que llevamos hecho y lo muestra por pantalla"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.counts = {
+            "capturadas": 0, "existentes": 0, "sin cambios": 0,
+            "subidas": 0, "iguales": 0, "optimizadas": 0, "errores": 0,
+        }
+        # bytes de las capturas originales y de sus variantes
+        self.bytes = {"original": 0, "variantes": 0}
+
+    def saved(self, original: int, variants: int) -> None:
+        with self.lock:
+            self.bytes["original"] += original
+            self.bytes["variantes"] += variants
+
+    def summary(self) -> str:
+        original, variants = self.bytes["original"], self.bytes["variantes"]
+        ratio = f" ({100 * (1 - variants / original):.0f}% menos)" if original else ""
+        return f"{self.counts} -- capturas {original} B, variantes {variants} B{ratio}"
+
+    def add(self, key: str, url: str = "") -> None:
+        with self.lock:
+            self.counts[key] += 1
+            elapsed = time.perf_counter() - self.start
+            summary = ", ".join(f"{k}: {v}" for k, v in self.counts.items())
+            print(f"[{elapsed:7.1f}s] {summary} -- {key} {url}")
+
+
+class Pipeline:
+    """
+    Toma capturas de muchas URLs en paralelo
+
+    > N workers, cada uno con su navegador (se reutiliza entre URLs), leen las URLs de una cola
+    > Las subidas a S3 se hacen en otro pool de hilos, así no frenan las capturas
+    > Cada URL tiene un timeout de carga y un número de reintentos, si el navegador
+    falla lo cerramos y abrimos otro
+    > Con `refresh` comprobamos (HEAD) si las páginas que ya tenemos han cambiado,
+    y nunca subimos una imagen idéntica a la que ya está en s3 (ver `Manifest`)
+    > De cada captura generamos las variantes para las Card (ver images.py) en un
+    pool de procesos, para usar todos los núcleos
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        uploaders: int = 8,
+        timeout: float = 30,
+        retries: int = 2,
+        refresh: bool = False,
+        manifest: Manifest = None,
+        optimize: bool = True,
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.refresh = refresh
+        self.manifest = manifest if manifest is not None else Manifest(MANIFEST_PATH)
+
+        # una sesión HTTP por hilo, para las peticiones HEAD
+        self.local = threading.local()
+
+        self.urls = queue.Queue(maxsize=workers * 4)
+        self.uploads = ThreadPoolExecutor(max_workers=uploaders)
+        # subidas pendientes del lote actual, ver `wait`
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.optimizer = ProcessPoolExecutor() if optimize else None
+        self.progress = Progress()
+        self.threads = []
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, url: str) -> None:
+        self.urls.put(url)
+
+    def wait(self) -> None:
+        """Espera a que se capturen y suban todas las URLs que hemos metido hasta ahora"""
+        self.urls.join()
+
+        # las subidas (y variantes) del lote también, si no el checkpoint dejaría
+        # atrás URLs sin subir que la siguiente ejecución ya no vuelve a ver
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        wait(pending)
+
+    def join(self) -> None:
+        """Espera a que se terminen todas las capturas y subidas"""
+        for _ in self.threads:
+            self.urls.put(STOP)
+        for thread in self.threads:
+            thread.join()
+        self.uploads.shutdown(wait=True)
+        if self.optimizer is not None:
+            self.optimizer.shutdown(wait=True)
+
+    def worker(self) -> None:
+        driver = None
+        try:
+            while (url := self.urls.get()) is not STOP:
+                try:
+                    driver = self.process(driver, url)
+                except Exception as exception:
+                    # una URL rota (p.ej. sin "://") no puede dejar el pipeline sin workers
+                    self.progress.add("errores", f"{url} ({exception})")
+                finally:
+                    self.urls.task_done()
+        finally:
+            close_driver(driver)
+
+    def session(self) -> requests.Session:
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def process(self, driver, url: str):
+        """Captura una URL, devuelve el navegador que hay que seguir usando (None si se ha roto)"""
+
+        entry = self.manifest.get(url)
+        validators = {}
+
+        # si ya tenemos la imagen, solo la volvemos a capturar si la página ha cambiado
+        if os.path.exists(image_path(url)):
+            changed = False
+            if self.refresh:
+                try:
+                    changed, validators = page_changed(self.session(), url, entry, self.timeout)
+                except requests.RequestException:
+                    changed = True
+
+            if not changed:
+                self.progress.add("sin cambios" if self.refresh else "existentes", url)
+                if validators:
+                    self.manifest.update(url, **validators)
+                # puede que no llegara a subirse (por ejemplo si se cortó la ejecución)
+                self.submit_upload(url)
+                return driver
+
+        for attempt in range(self.retries + 1):
+            try:
+                # si no tenemos el navegador abierto (o se ha roto), abrimos uno
+                if driver is None:
+                    driver = new_driver(self.timeout)
+                take_screenshot(driver, url, force=True)
+            except Exception as exception:
+                # el navegador puede haberse quedado en mal estado, usaremos uno nuevo
+                driver = close_driver(driver)
+                if attempt == self.retries:
+                    self.progress.add("errores", f"{url} ({exception})")
+                    return None
+                time.sleep(2 ** attempt)
+            else:
+                self.progress.add("capturadas", url)
+                if not validators:
+                    try:
+                        _, validators = page_changed(self.session(), url, {}, self.timeout)
+                    except requests.RequestException:
+                        pass
+                self.manifest.update(url, sha256=file_hash(image_path(url)), **validators)
+                self.submit_upload(url)
+                return driver
+
+    def submit_upload(self, url: str) -> None:
+        future = self.uploads.submit(self.upload, url)
+        with self.pending_lock:
+            self.pending.append(future)
+
+    def upload(self, url: str) -> None:
+        """Sube la imagen si es distinta a la que hay en s3"""
+
+        try:
+            file_path = image_path(url)
+            sha256 = file_hash(file_path)
+            entry = self.manifest.get(url)
+
+            # imágenes de antes del manifiesto: comparamos con el ETag de s3 (md5 del contenido)
+            if not entry.get('s3_sha256') and uploaded_etag(url) == file_hash(file_path, 'md5'):
+                entry['s3_sha256'] = sha256
+                self.manifest.update(url, sha256=sha256, s3_key=f"{parse_url(url)}.png", s3_sha256=sha256)
+
+            if entry.get('s3_sha256') == sha256:
+                self.progress.add("iguales", url)
+            else:
+                etag = upload(url, file_path)
+                self.manifest.update(url, sha256=sha256, s3_key=object_key(url), s3_etag=etag, s3_sha256=sha256)
+                self.progress.add("subidas", url)
+
+            # las variantes solo cambian si cambia la captura
+            if self.optimizer is not None and entry.get('variants_sha256') != sha256:
+                self.upload_variants(url, file_path, sha256)
+        except Exception as exception:
+            self.progress.add("errores", f"{url} ({exception})")
+
+    def upload_variants(self, url: str, file_path: str, sha256: str) -> None:
+        """Genera (en el pool de procesos) y sube las variantes de la captura"""
+
+        result = self.optimizer.submit(images.optimize, file_path).result()
+        for variant, path in result["paths"].items():
+            upload(url, path, variant)
+
+        variants = sum(result["bytes"].values())
+        self.manifest.update(
+            url, variants_sha256=sha256, bytes_original=result["original"], bytes_variants=variants,
+        )
+        self.progress.saved(result["original"], variants)
+        self.progress.add("optimizadas", url)
+
+
+def take_screenshot(driver: webdriver.Chrome, url: str, force: bool = False) -> bool:
     """
     Toma una screenshot de la URL recibida y la guarda en formato PNG
 
     > Usamos imagenes porque el texto de las Card de Alexa no se puede copiar, dar
-    la preview de la página aporta algo de información y nos permite saber lo que 
-    debemos encontrar, de forma que detectamos si hemos copiado mal la URL en el navegador 
+    la preview de la página aporta algo de información y nos permite saber lo que
+    debemos encontrar, de forma que detectamos si hemos copiado mal la URL en el navegador
 
     > La guardamos en el disco además de subirla a S3 para evitar hacer consultas que
     comprueben si ya tenemos la imagen, porque la cantidad de peticiones que podemos
     hacer de forma gratuita es limitada. Esto también nos permite borrar los archivos
     locales si queremos actualizar las imágenes que tenemos en S3
 
-    > Si tenemos la imagen en disco, no hay que hacer nada
+    > Si tenemos la imagen en disco, no hay que hacer nada (devuelve False), salvo que
+    nos pidan volver a capturarla (`force`)
+
+    > La subida a S3 la hace el pipeline en paralelo, ver `Pipeline.upload`, que
+    usa el manifiesto para no subir imágenes idénticas
 
     *Este código se ejecuta en la máquina con Windows*
     """
@@ -50,29 +443,74 @@ def take_screenshot(url: str) -> None:
     # ruta del archivo en el almacenamiento local
     file_path = image_path(url)
 
-    # si no tenemos imagen en local, la tomamos
-    if not os.path.exists(file_path):
-        driver.get(url)
+    # si tenemos imagen en local, no hacemos nada
+    if os.path.exists(file_path) and not force:
+        return False
+
+    driver.get(url)
+
+    # descomentar si se quiere hacer scroll para ver toda la web
+    # lo he desactivado porque tenemos limitación de tamaño en pixeles
+    # driver.set_window_size(scroll(driver, 'Width'), scroll(driver, 'Height'))
+
+    # guardamos primero en un temporal, para no dejar archivos a medias si falla
+    tmp_path = os.path.splitext(file_path)[0] + '.tmp.png'
+    driver.find_element(By.TAG_NAME, "body").screenshot(tmp_path)
+    os.replace(tmp_path, file_path)
+    return True
 
-        # descomentar si se quiere hacer scroll para ver toda la web
-        # lo he desactivado porque tenemos limitación de tamaño en pixeles
-        # driver.set_window_size(scroll('Width'),scroll('Height'))
 
-        driver.find_element(By.TAG_NAME, "body").screenshot(file_path)
-        driver.quit()
+def read_urls(collection: str, fields: list, batch_size: int, start_after=None):
+    """
+    Lee las URLs de la colección por lotes, devuelve (último _id del lote, URLs del lote)
+
+    > Solo pedimos los campos que necesitamos, no los documentos enteros
+    > Ordenamos por _id para poder continuar desde el último lote terminado
+    """
+
+    query = {} if start_after is None else {"_id": {"$gt": start_after}}
+    cursor = (
+        database[collection]
+        .find(query, {field: True for field in fields})
+        .sort("_id", 1)
+        .batch_size(batch_size)
+    )
+
+    batch, last_id = [], None
+    for document in cursor:
+        batch.extend(document[field] for field in fields if document.get(field))
+        last_id = document["_id"]
+        if len(batch) >= batch_size:
+            yield last_id, batch
+            batch = []
 
-        # una vez tenemos la imagen, la subimos a s3
-        with open(file_path, 'rb') as data:
-            bucket.put_object(Key=f"{parse_url(url)}.png", Body=data)
+    if batch:
+        yield last_id, batch
 
 
-def main(): 
+def main(
+    workers: int = 4,
+    uploaders: int = 8,
+    timeout: float = 30,
+    retries: int = 2,
+    refresh: bool = False,
+    batch_size: int = 200,
+    restart: bool = False,
+):
     """
     Para cada coleccion hacemos una query a la base de datos
     Despues, para cada documento iteramos los campos que necesitamos
 
     > Hacer este bucle en el orden contrario sería lento porque la query
     es mucho mas costosa que iterar el array que ya tenemos en memoria
+
+    > Las URLs se van metiendo en la cola del pipeline según las leemos, sin repetir
+    las que ya hemos visto (varias asignaturas comparten la misma guía docente)
+
+    > Al terminar cada lote guardamos por dónde vamos, si se corta la ejecución la
+    siguiente empieza ahí (salvo con `restart`)
+
+    > Con `refresh` se vuelven a capturar las páginas que han cambiado
     """
 
     # en este diccionario definimos todos los campos de la base de datos de los que queremos
@@ -81,11 +519,49 @@ def main():
         "asignaturas": ["guia_docente"],
     }
 
-    for collection in url_dict:        
-        for document in database[collection].find({}, {"_id": False}):
-            for field in url_dict[collection]:
-                take_screenshot(document[field])
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+
+    pipeline = Pipeline(workers, uploaders, timeout, retries, refresh)
+    pipeline.start()
+
+    # URLs que ya hemos metido en el pipeline
+    seen = set()
+
+    try:
+        for collection in url_dict:
+            start_after = None if restart else pipeline.manifest.checkpoint(collection)
+            if start_after is not None:
+                print(f"Continuando {collection} desde {start_after}")
+
+            for last_id, urls in read_urls(collection, url_dict[collection], batch_size, start_after):
+                for url in urls:
+                    if url not in seen:
+                        seen.add(url)
+                        pipeline.put(url)
+
+                pipeline.wait()
+                pipeline.manifest.save_checkpoint(collection, last_id)
+
+            # colección terminada, la próxima vez empezamos de cero
+            pipeline.manifest.save_checkpoint(collection, None)
+    finally:
+        pipeline.join()
+
+    print(pipeline.progress.summary())
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Capturas de las URLs de la base de datos")
+    parser.add_argument("--workers", type=int, default=4, help="navegadores en paralelo")
+    parser.add_argument("--uploaders", type=int, default=8, help="subidas a S3 en paralelo")
+    parser.add_argument("--timeout", type=float, default=30, help="segundos máximos de carga por URL")
+    parser.add_argument("--retries", type=int, default=2, help="reintentos por URL")
+    parser.add_argument("--refresh", action="store_true", help="volver a capturar las páginas que han cambiado")
+    parser.add_argument("--batch-size", type=int, default=200, help="URLs por lote")
+    parser.add_argument("--restart", action="store_true", help="empezar de cero aunque haya una ejecución a medias")
+    args = parser.parse_args()
+
+    main(
+        args.workers, args.uploaders, args.timeout, args.retries,
+        args.refresh, args.batch_size, args.restart,
+    )
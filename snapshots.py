@@ -0,0 +1,262 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+
+# Concurrencia
+import threading
+
+# Debug
+import logging
+
+# Tiempo
+import time
+
+# Type hinting
+from typing import Any, Dict, Iterable, Optional
+
+
+# ==========================================================
+#      FUNCIONES
+# ==========================================================
+
+def _subjects(subjects: Iterable[dict], teachers: Dict[str, str]) -> Dict[str, dict]:
+    """nombre de la asignatura -> guía docente, email y nombre del profesor responsable"""
+    return {
+        subject["nombre"]: {
+            "guia_docente": subject.get("guia_docente"),
+            "responsable": subject.get("responsable"),
+            "profesor": teachers.get(subject.get("responsable")),
+        }
+        for subject in subjects
+    }
+
+
+# ==========================================================
+#      SNAPSHOTS
+# ==========================================================
+
+class SnapshotStore:
+    """
+    Copia en memoria de los datos académicos, desnormalizada por titulación
+
+    > Cada titulación (id de `estudios`) tiene:
+        {
+            "nombre": ..., "escuela": ...,
+            "asignaturas": {nombre: {"guia_docente", "responsable", "profesor"}},
+            "fechas": {tipo de fecha: valor},
+            "contacto": {forma de contacto: valor},
+        }
+
+    > Estos datos cambian pocas veces por cuatrimestre, así cada intent se
+    resuelve con una búsqueda en un dict en vez de varias consultas a Mongo
+
+    > Se carga entera la primera vez que se usa y al llamar a `load()`, si nos
+    piden una titulación que no conocemos la leemos sola
+    """
+
+    def __init__(self, database, version_field: str = "actualizado"):
+        self.database = database
+        # campo con la fecha de modificación de los documentos (lo usa watcher.py
+        # para detectar cambios sin change streams), no forma parte de los datos
+        self.version_field = version_field
+        # se incrementa con cada cambio, para saber lo actualizado que está cada proceso
+        self.version = 0
+        self.updated = None
+
+        self._lock = threading.RLock()
+        self._studies: Dict[Any, dict] = {}
+        # titulación -> `version` en la que cambiaron sus datos por última vez
+        self._versions: Dict[Any, int] = {}
+        self._loaded = False
+
+    def load(self) -> None:
+        """Lee todas las colecciones y reconstruye los datos de todas las titulaciones"""
+
+        database = self.database
+
+        teachers = {
+            teacher["_id"]: teacher.get("nombre")
+            for teacher in database["profesores"].find({}, {"nombre": True})
+        }
+        schools = {
+            school.pop("_id"): school
+            for school in database["secretarias"].find({}, {self.version_field: False})
+        }
+        dates = {
+            date.pop("_id"): date
+            for date in database["fechas"].find({}, {self.version_field: False})
+        }
+
+        # agrupamos las asignaturas por titulación
+        subjects: Dict[Any, list] = {}
+        for subject in database["asignaturas"].find({}, {"nombre": True, "guia_docente": True, "responsable": True}):
+            subjects.setdefault(subject["_id"]["id_estudios"], []).append(subject)
+
+        studies = {
+            study["_id"]: {
+                "nombre": study.get("nombre"),
+                "escuela": study.get("escuela"),
+                "asignaturas": _subjects(subjects.get(study["_id"], ()), teachers),
+                "fechas": dates.get(study["_id"], {}),
+                "contacto": schools.get(study.get("escuela"), {}),
+            }
+            for study in database["estudios"].find({})
+        }
+
+        with self._lock:
+            self._studies = studies
+            self._loaded = True
+            self._bump()
+            self._versions = dict.fromkeys(studies, self.version)
+
+        logging.info(f"Snapshot v{self.version} cargado con {len(studies)} titulaciones")
+
+    def load_one(self, studying: Any) -> dict:
+        """Lee (o vuelve a leer) solo los datos de una titulación"""
+        entry = self._read_one(studying)
+        self._replace({studying: entry})
+        return entry
+
+    def _read_one(self, studying: Any) -> dict:
+        database = self.database
+        hidden = {"_id": False, self.version_field: False}
+
+        study = database["estudios"].find_one({"_id": studying})
+        if study is None:
+            raise KeyError(f"La titulación {studying} no existe")
+
+        subjects = list(database["asignaturas"].find({"_id.id_estudios": studying}))
+        emails = list({subject.get("responsable") for subject in subjects})
+        teachers = {
+            teacher["_id"]: teacher.get("nombre")
+            for teacher in database["profesores"].find({"_id": {"$in": emails}}, {"nombre": True})
+        }
+
+        return {
+            "nombre": study.get("nombre"),
+            "escuela": study.get("escuela"),
+            "asignaturas": _subjects(subjects, teachers),
+            "fechas": database["fechas"].find_one({"_id": studying}, hidden) or {},
+            "contacto": database["secretarias"].find_one({"_id": study.get("escuela")}, hidden) or {},
+        }
+
+    def ensure_loaded(self) -> None:
+        """Carga los datos si todavía no se ha hecho"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    def get(self, studying: Any) -> dict:
+        """Datos de la titulación"""
+
+        self.ensure_loaded()
+
+        entry = self._studies.get(studying)
+        if entry is None:
+            entry = self.load_one(studying)
+
+        return entry
+
+    def version_of(self, studying: Any) -> int:
+        """
+        Versión de los datos de la titulación, cambia solo cuando cambian ellos
+        > sirve para invalidar lo que se calcule a partir de `get(studying)`
+        """
+
+        version = self._versions.get(studying)
+        if version is None:
+            self.get(studying)
+            version = self._versions.get(studying)
+
+        return version
+
+    # ------------------------------------------------------
+    #   Cambios incrementales (ver watcher.py)
+    # ------------------------------------------------------
+
+    def _bump(self) -> None:
+        self.version += 1
+        self.updated = time.time()
+
+    def _replace(self, entries: Dict[Any, Any]) -> None:
+        """
+        Sustituye (o borra, si el valor es None) las titulaciones dadas
+        > copiamos el dict para no modificar el que puedan estar leyendo otros hilos
+        """
+        if not entries:
+            return
+
+        with self._lock:
+            studies = dict(self._studies)
+            for studying, entry in entries.items():
+                if entry is None:
+                    studies.pop(studying, None)
+                else:
+                    studies[studying] = entry
+            self._studies = studies
+            self._bump()
+
+            versions = dict(self._versions)
+            for studying in entries:
+                versions[studying] = self.version
+            self._versions = versions
+
+    def apply(self, collection: str, key: Any, document: Optional[dict]) -> None:
+        """
+        Aplica el cambio de un documento (`document` es None si se ha borrado)
+        tocando solo las titulaciones afectadas
+        """
+
+        # si aún no se ha cargado, ya leerá los datos actualizados
+        if not self._loaded:
+            return
+
+        if collection == "estudios":
+            self._replace({key: None if document is None else self._load_entry(key)})
+
+        elif collection == "asignaturas":
+            # el _id de las asignaturas incluye la titulación, solo releemos sus asignaturas
+            studying = key["id_estudios"]
+            if studying in self._studies:
+                self._replace({studying: self._load_entry(studying)})
+
+        elif collection == "profesores":
+            name = None if document is None else document.get("nombre")
+            # las entradas nuevas salen de las actuales: con el lock hasta sustituirlas,
+            # si no un `load` a la vez se machacaría con datos anteriores a él
+            with self._lock:
+                changed = {}
+                for studying, entry in self._studies.items():
+                    subjects = {
+                        subject: dict(info, profesor=name) if info["responsable"] == key else info
+                        for subject, info in entry["asignaturas"].items()
+                    }
+                    if subjects != entry["asignaturas"]:
+                        changed[studying] = dict(entry, asignaturas=subjects)
+                self._replace(changed)
+
+        elif collection in ("fechas", "secretarias"):
+            field = "fechas" if collection == "fechas" else "contacto"
+            value = {} if document is None else {
+                k: v for k, v in document.items() if k not in ("_id", self.version_field)
+            }
+            # igual que con los profesores
+            with self._lock:
+                self._replace({
+                    studying: dict(entry, **{field: value})
+                    for studying, entry in self._studies.items()
+                    # las fechas van por titulación, el contacto por escuela
+                    if (studying if collection == "fechas" else entry["escuela"]) == key
+                })
+
+    def _load_entry(self, studying: Any) -> Optional[dict]:
+        """Datos de una titulación leídos de la base de datos, sin guardarlos"""
+        try:
+            return self._read_one(studying)
+        except KeyError:
+            return None
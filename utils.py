@@ -0,0 +1,83 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+#
+#     Funciones sueltas que usan tanto la skill como los scripts (screenshots.py)
+#     > no importa nada de la skill ni abre conexiones, así los scripts no
+#     cargan el SDK de Alexa, Flask ni un cliente de Mongo solo por esto
+# ==========================================================
+
+# Concurrencia
+import threading
+
+# Type hinting
+from typing import Any, Optional
+from collections.abc import Callable
+
+
+# valor de `Lazy` antes de crearlo (el objeto puede ser None o False)
+_MISSING = object()
+
+def parse_url(url: str) -> str:
+    """Elimina algunos caracteres de la URL para evitar errores"""
+    return url.split('://')[1].replace("/", "").replace(".", "")
+
+
+def s3_url(url: str, variant: str = None) -> str:
+    """
+    URL de S3 donde se encuentra el archivo
+    > las capturas tienen variantes "small" y "large" para las Card (ver images.py)
+    """
+    if variant:
+        url = f"{url}_{variant}"
+    return f"https://imagenes-tfg.s3.eu-west-3.amazonaws.com/{url}.png"
+
+
+class Lazy:
+    """
+    Objeto que se crea la primera vez que se usa
+
+    > Se comporta como el objeto (atributos e índices), así se puede pasar a
+    quien lo necesite sin que se cree al importar
+    > `reset` lo descarta para que se vuelva a crear, p.ej. en cada proceso
+    después de hacer fork (un MongoClient no se puede compartir entre procesos)
+    """
+
+    def __init__(self, factory: Callable, close: Optional[Callable] = None):
+        self._factory = factory
+        self._close = close
+        self._lock = threading.Lock()
+        self._value: Any = _MISSING
+
+    def get(self) -> Any:
+        value = self._value
+        if value is _MISSING:
+            with self._lock:
+                if self._value is _MISSING:
+                    self._value = self._factory()
+                value = self._value
+        return value
+
+    @property
+    def created(self) -> bool:
+        return self._value is not _MISSING
+
+    def reset(self, close: bool = True) -> None:
+        """
+        Descarta el objeto, se volverá a crear al usarlo
+        > después de un fork no hay que cerrarlo: es del proceso padre
+        """
+        with self._lock:
+            value, self._value = self._value, _MISSING
+        if close and value is not _MISSING and self._close is not None:
+            self._close(value)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.get()[key]
@@ -0,0 +1,206 @@
+#     --------------------Desarrollador--------------------
+#     Pablo Martínez Bernal <martinezbernalpablo@gmail.com>
+#
+#     ----------------------Licencia.----------------------
+#     Licencia MIT [https://opensource.org/licenses/MIT]
+#     Copyright (c) 2021 Pablo Martínez Bernal
+# ==========================================================
+
+# Concurrencia
+import threading
+
+# Debug
+import logging
+
+# Tiempo
+import time
+
+# MongoDB
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Type hinting
+from typing import Any, Dict, Iterable, Optional
+from collections.abc import Callable
+
+# Datos académicos en memoria
+from snapshots import SnapshotStore
+
+
+# colecciones que tenemos en memoria
+COLLECTIONS = ("asignaturas", "profesores", "estudios", "secretarias", "fechas")
+
+# eventos tras los que no sabemos qué ha cambiado, hay que recargar todo
+RELOAD_EVENTS = ("drop", "rename", "dropDatabase", "invalidate")
+
+
+# ==========================================================
+#      WATCHER
+# ==========================================================
+
+class ChangeWatcher:
+    """
+    Hilo en segundo plano que mantiene al día el `SnapshotStore`
+
+    > Con un replica set escuchamos los change streams de la base de datos y
+    aplicamos cada cambio solo a las titulaciones afectadas
+
+    > Con un mongod standalone no hay change streams: cada `poll_interval`
+    segundos buscamos los documentos cuyo campo de versión (fecha de
+    modificación) sea posterior al último visto. Así no se detectan los
+    borrados, para eso hay que recargar (SIGHUP)
+
+    > `on_change(collection)` se llama tras cada cambio, lo usamos para
+    invalidar los índices de nombres
+    > `on_document(collection, key, document)` se llama antes, con el documento
+    que ha cambiado (None si se ha borrado). Tras una recarga se llama con
+    key y document a None: puede haber cambiado cualquiera
+    """
+
+    def __init__(
+        self,
+        database,
+        snapshots: SnapshotStore,
+        on_change: Optional[Callable] = None,
+        on_document: Optional[Callable] = None,
+        poll_interval: float = 30.0,
+        collections: Iterable[str] = COLLECTIONS,
+    ):
+        self.database = database
+        self.snapshots = snapshots
+        self.on_change = on_change
+        self.on_document = on_document
+        self.poll_interval = poll_interval
+        self.collections = list(collections)
+
+        # "change stream" o "polling", para saber cómo se está actualizando cada proceso
+        self.mode: Optional[str] = None
+        self.last_event: Optional[float] = None
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run(self) -> None:
+        """
+        Change streams si se puede y, si no, polling
+        > cualquier error que no sea de Mongo (al aplicar un cambio, en `on_change`...)
+        también nos pasa a polling, el hilo no puede morir sin avisar
+        """
+        try:
+            self._watch()
+            return
+        except OperationFailure as exception:
+            logging.info(f"Sin change streams ({exception}), comprobamos cambios cada {self.poll_interval}s")
+        except Exception:
+            logging.error(f"Error en el change stream, comprobamos cambios cada {self.poll_interval}s", exc_info=True)
+            # lo que haya cambiado desde el error no lo vería el polling, recargamos todo
+            try:
+                self._reload()
+            except Exception:
+                logging.error("Error recargando los datos", exc_info=True)
+
+        self._poll()
+
+    def _apply(self, collection: str, key: Any, document: Optional[dict]) -> None:
+        self.snapshots.apply(collection, key, document)
+        self.last_event = time.time()
+
+        if self.on_document is not None:
+            self.on_document(collection, key, document)
+        if self.on_change is not None:
+            self.on_change(collection)
+
+    def _reload(self) -> None:
+        self.snapshots.load()
+        self.last_event = time.time()
+
+        for collection in self.collections:
+            if self.on_document is not None:
+                self.on_document(collection, None, None)
+            if self.on_change is not None:
+                self.on_change(collection)
+
+    # ------------------------------------------------------
+    #   Change streams
+    # ------------------------------------------------------
+
+    def _watch(self) -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": self.collections}}}]
+        resume_token = None
+        opened = False
+
+        while not self._stop.is_set():
+            try:
+                with self.database.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                    max_await_time_ms=1000,  # para poder comprobar si nos han parado
+                ) as stream:
+                    opened = True
+                    self.mode = "change stream"
+
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        resume_token = stream.resume_token
+
+                        if change["operationType"] in RELOAD_EVENTS:
+                            self._reload()
+                        else:
+                            self._apply(
+                                change["ns"]["coll"],
+                                change["documentKey"]["_id"],
+                                change.get("fullDocument"),
+                            )
+
+            except OperationFailure:
+                # si no se ha podido abrir nunca, el servidor no los soporta
+                if not opened:
+                    raise
+                logging.error("Error en el change stream, reintentando", exc_info=True)
+                self._stop.wait(1)
+
+            except PyMongoError:
+                logging.error("Error en el change stream, reintentando", exc_info=True)
+                self._stop.wait(1)
+
+    # ------------------------------------------------------
+    #   Polling
+    # ------------------------------------------------------
+
+    def _poll(self) -> None:
+        self.mode = "polling"
+        field = self.snapshots.version_field
+
+        # último valor visto en cada colección
+        # > si no se puede leer empezamos desde el principio, se aplican todos los documentos
+        last: Dict[str, Any] = {}
+        for collection in self.collections:
+            try:
+                newest = self.database[collection].find_one({field: {"$exists": True}}, {field: True}, sort=[(field, -1)])
+            except Exception:
+                logging.error(f"Error leyendo la última versión de {collection}", exc_info=True)
+                newest = None
+            last[collection] = None if newest is None else newest[field]
+
+        while not self._stop.wait(self.poll_interval):
+            for collection in self.collections:
+                query = {field: {"$exists": True}} if last[collection] is None else {field: {"$gt": last[collection]}}
+                try:
+                    for document in self.database[collection].find(query).sort(field, 1):
+                        self._apply(collection, document["_id"], document)
+                        last[collection] = document[field]
+                except Exception:
+                    logging.error(f"Error comprobando cambios en {collection}", exc_info=True)